@@ -0,0 +1,177 @@
+"""Password hashing and the login-side AuthBackend.
+
+PBKDF2 costs tens of milliseconds of CPU per call. AuthBackend can run it in a
+bounded process pool so a burst of logins queues behind a fixed number of
+cores instead of occupying every web worker thread.
+"""
+import binascii
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, Optional, Tuple
+
+DEFAULT_MAX_PENDING = 64
+DEFAULT_AUTH_TIMEOUT = 10.0
+# the pool is started from a request thread; forking a threaded process can
+# deadlock on locks held by other threads, so workers are spawned instead
+POOL_START_METHOD = "spawn"
+
+# Stored hashes look like "pbkdf2_sha256$<iterations>$<salt hex>$<digest hex>".
+# Hashes written before the format existed are "<salt hex>:<digest hex>" with
+# a fixed LEGACY_ITERATIONS; they still verify and are upgraded on login.
+HASH_ALGORITHM = "pbkdf2_sha256"
+DEFAULT_ITERATIONS = 100_000
+LEGACY_ITERATIONS = 100_000
+
+
+class AuthBusy(RuntimeError):
+    """Raised when too many hash/verify jobs are already queued."""
+
+
+def hash_password(password: str, iterations: int = DEFAULT_ITERATIONS) -> str:
+    """Salted PBKDF2-HMAC-SHA256 in the self-describing stored format.
+
+    Module level so it can be shipped to worker processes.
+    """
+    salt = os.urandom(16)
+    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{HASH_ALGORITHM}${iterations}${binascii.hexlify(salt).decode()}${binascii.hexlify(dk).decode()}"
+
+
+def parse_hash(stored: str) -> Tuple[str, int, bytes, bytes]:
+    """Split a stored hash into (algorithm, iterations, salt, digest); raises ValueError."""
+    if "$" in stored:
+        algorithm, iterations, salt_hex, dk_hex = stored.split("$")
+        iterations = int(iterations)
+    else:
+        salt_hex, dk_hex = stored.split(":")
+        algorithm, iterations = HASH_ALGORITHM, LEGACY_ITERATIONS
+    if algorithm != HASH_ALGORITHM or iterations < 1:
+        raise ValueError(f"Unsupported password hash: {algorithm}")
+    return algorithm, iterations, binascii.unhexlify(salt_hex), binascii.unhexlify(dk_hex)
+
+
+def verify_password(stored: str, provided: str) -> bool:
+    try:
+        _algorithm, iterations, salt, dk = parse_hash(stored)
+        new_dk = hashlib.pbkdf2_hmac("sha256", provided.encode("utf-8"), salt, iterations)
+        return hmac.compare_digest(new_dk, dk)
+    except Exception:
+        return False
+
+
+def needs_rehash(stored: str, iterations: int = DEFAULT_ITERATIONS) -> bool:
+    """True for legacy-format hashes and hashes made with a different cost."""
+    if "$" not in stored:
+        return True
+    try:
+        return parse_hash(stored)[1] != iterations
+    except (ValueError, binascii.Error):
+        return False
+
+
+class AuthBackend:
+    """Runs hash_password/verify_password inline or in a process pool.
+
+    workers: pool processes; 0 runs everything in the calling thread
+    max_pending: jobs allowed in the pool at once (queued + running); further
+        calls raise AuthBusy instead of piling up behind a login storm
+    timeout: seconds a caller waits for its result before giving up
+    iterations: PBKDF2 cost for new hashes; existing hashes with another cost
+        are rehashed on the next successful login (see ``needs_rehash``)
+    """
+
+    def __init__(self, workers: int = 0, max_pending: int = DEFAULT_MAX_PENDING,
+                 timeout: float = DEFAULT_AUTH_TIMEOUT, iterations: int = DEFAULT_ITERATIONS):
+        self.workers = workers
+        self.iterations = iterations
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._futures = set()
+        self._stats = {"submitted": 0, "completed": 0, "rejected": 0, "timeouts": 0,
+                       "pending": 0, "peak_pending": 0, "busy_seconds": 0.0}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # created on first use so importing the web app never forks
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(POOL_START_METHOD))
+            return self._pool
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+            self._stats["peak_pending"] = max(self._stats["peak_pending"], self._stats["pending"])
+
+    def _run(self, fn, *args):
+        started = time.perf_counter()
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                self._count(submitted=1, completed=1, busy_seconds=time.perf_counter() - started)
+        if not self._slots.acquire(blocking=False):
+            self._count(rejected=1)
+            raise AuthBusy("Authentication is busy, please retry")
+        self._count(submitted=1, pending=1)
+
+        def release(future=None):
+            # the slot belongs to the job, not the caller: it is freed only
+            # once the job has finished or been cancelled
+            with self._lock:
+                self._futures.discard(future)
+            self._slots.release()
+            self._count(pending=-1, completed=1, busy_seconds=time.perf_counter() - started)
+
+        try:
+            future = self._executor().submit(fn, *args)
+        except BaseException:
+            release()
+            raise
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # drop it from the queue if it has not started yet
+            future.cancel()
+            self._count(timeouts=1)
+            raise AuthBusy("Authentication timed out, please retry") from None
+
+    def hash(self, password: str) -> str:
+        return self._run(hash_password, password, self.iterations)
+
+    def verify(self, stored: str, provided: str) -> bool:
+        return self._run(verify_password, stored, provided)
+
+    def needs_rehash(self, stored: str) -> bool:
+        return needs_rehash(stored, self.iterations)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self._stats)
+        out["avg_ms"] = round(1000 * out["busy_seconds"] / out["completed"], 2) if out["completed"] else 0.0
+        out["workers"] = self.workers
+        out["iterations"] = self.iterations
+        out["max_pending"] = self.max_pending
+        return out
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            futures, self._futures = list(self._futures), set()
+        # cancelled by hand: shutdown(cancel_futures=True) needs Python 3.9
+        for future in futures:
+            future.cancel()
+        if pool is not None:
+            pool.shutdown(wait=False)
@@ -1,5 +1,7 @@
-from .manager import ERPManager
+from .manager import DISMISSAL_RETENTION_DAYS, ERPManager
+import argparse
 import getpass
+import sys
 
 class CLI:
     def __init__(self):
@@ -196,3 +198,80 @@ class CLI:
                 break
             else:
                 print("Invalid")
+
+
+def import_students_command(args) -> int:
+    from .importer import read_rows
+
+    manager = ERPManager(db_path=args.db) if args.db else ERPManager()
+
+    def show(report):
+        print(f"\r{report.processed} rows read, {report.imported} imported, {report.failed} rejected",
+              end="", flush=True)
+
+    try:
+        report = manager.import_students(read_rows(args.file, args.format), chunk_size=args.chunk_size,
+                                         workers=args.workers, error_file=args.errors, progress=show)
+    finally:
+        manager.close()
+    print()
+    if report.failed and args.errors:
+        print(f"Rejected rows written to {args.errors}")
+    return 1 if report.failed else 0
+
+
+def check_counters_command(args) -> int:
+    manager = ERPManager(db_path=args.db) if args.db else ERPManager()
+    try:
+        problems = manager.check_counters()
+        for p in problems:
+            print(f"{p['table']}.{p['column']} id={p['id']}: stored {p['stored']}, actual {p['actual']}")
+        if problems and args.repair:
+            print("Corrected", manager.rebuild_counters(), "rows")
+            return 0
+        if not problems:
+            print("Counters are consistent")
+    finally:
+        manager.close()
+    return 1 if problems else 0
+
+
+def compact_dismissals_command(args) -> int:
+    manager = ERPManager(db_path=args.db) if args.db else ERPManager()
+    try:
+        print("Removed", manager.compact_dismissals(retain_days=args.retain_days), "dismissals")
+    finally:
+        manager.close()
+    return 0
+
+
+def main(argv=None) -> int:
+    """Entry point: no arguments starts the interactive menu, otherwise run a command."""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        CLI().run()
+        return 0
+    parser = argparse.ArgumentParser(prog="main.py", description="College ERP maintenance commands")
+    parser.add_argument("--db", help="SQLite database path (default: erp/erp.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    imp = commands.add_parser("import-students", help="bulk import students from CSV or JSONL")
+    imp.add_argument("file")
+    imp.add_argument("--format", choices=["csv", "jsonl"], help="default: from the file extension")
+    imp.add_argument("--errors", help="CSV file receiving rejected rows")
+    imp.add_argument("--chunk-size", type=int, default=500)
+    imp.add_argument("--workers", type=int, default=None, help="hashing processes (0 = no pool)")
+    imp.set_defaults(func=import_students_command)
+
+    chk = commands.add_parser("check-counters", help="verify trigger-maintained counters and attendance bitmaps")
+    chk.add_argument("--repair", action="store_true", help="rebuild counters that do not match")
+    chk.set_defaults(func=check_counters_command)
+
+    cmp = commands.add_parser("compact-dismissals",
+                              help="purge dismissals of deleted or long-expired announcements")
+    cmp.add_argument("--retain-days", type=int, default=DISMISSAL_RETENTION_DAYS,
+                     help="keep dismissals of announcements that ended fewer days ago")
+    cmp.set_defaults(func=compact_dismissals_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
@@ -1,10 +1,52 @@
 import sqlite3
 import os
-import hashlib
-import binascii
-from typing import List, Tuple, Optional
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Tuple, Optional
+
+from .auth import AuthBackend
+from .models import Record, record_factory
 
 DEFAULT_DB = os.path.join(os.path.dirname(__file__), "erp.db")
+DEFAULT_POOL_SIZE = 8
+DEFAULT_POOL_TIMEOUT = 30.0
+DEFAULT_PROFILE = "durable"
+# rows pulled per fetchmany() when streaming with iter_query
+DEFAULT_FETCH_SIZE = 500
+
+# Connection settings applied to every pooled connection. All writable profiles
+# use WAL so readers keep working while payments are being written; they differ
+# in how often SQLite fsyncs and how much memory each connection may use.
+# Negative cache_size values are KiB, mmap_size is bytes, busy_timeout is ms.
+STORAGE_PROFILES = {
+    # fsync on every commit: nothing acknowledged is lost on power failure
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16_000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5_000,
+    },
+    # fsync at checkpoints only: the last commits may roll back after a crash
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64_000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5_000,
+    },
+    # read-only connections to a database another process writes in WAL mode
+    "readonly-replica": {
+        "read_only": True,
+        "cache_size": -64_000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5_000,
+    },
+}
 
 
 SCHEMA_STATEMENTS = [
@@ -13,13 +55,13 @@ SCHEMA_STATEMENTS = [
     "CREATE TABLE IF NOT EXISTS hostel_rooms (id INTEGER PRIMARY KEY, block TEXT, room_no TEXT, capacity INTEGER DEFAULT 1)",
     "CREATE TABLE IF NOT EXISTS hostel_allocations (id INTEGER PRIMARY KEY, student_id INTEGER NOT NULL, room_id INTEGER NOT NULL, checkin_date TEXT, checkout_date TEXT, FOREIGN KEY(student_id) REFERENCES students(id), FOREIGN KEY(room_id) REFERENCES hostel_rooms(id))",
     "CREATE TABLE IF NOT EXISTS hostel_payments (id INTEGER PRIMARY KEY, student_id INTEGER NOT NULL, amount REAL NOT NULL, date TEXT, receipt_no TEXT, FOREIGN KEY(student_id) REFERENCES students(id))",
-    "CREATE TABLE IF NOT EXISTS drivers (id INTEGER PRIMARY KEY, name TEXT NOT NULL, license_no TEXT)",
+    "CREATE TABLE IF NOT EXISTS drivers (id INTEGER PRIMARY KEY, name TEXT NOT NULL, license_no TEXT, contact TEXT)",
     "CREATE TABLE IF NOT EXISTS buses (id INTEGER PRIMARY KEY, registration TEXT UNIQUE, capacity INTEGER DEFAULT 20, driver_id INTEGER, FOREIGN KEY(driver_id) REFERENCES drivers(id))",
     "CREATE TABLE IF NOT EXISTS routes (id INTEGER PRIMARY KEY, name TEXT, pickup_location TEXT, bus_id INTEGER, fee REAL DEFAULT 0, FOREIGN KEY(bus_id) REFERENCES buses(id))",
     "CREATE TABLE IF NOT EXISTS transport_allocations (id INTEGER PRIMARY KEY, student_id INTEGER, route_id INTEGER, active INTEGER DEFAULT 1, FOREIGN KEY(student_id) REFERENCES students(id), FOREIGN KEY(route_id) REFERENCES routes(id))",
     "CREATE TABLE IF NOT EXISTS transport_payments (id INTEGER PRIMARY KEY, student_id INTEGER, amount REAL, date TEXT, receipt_no TEXT, FOREIGN KEY(student_id) REFERENCES students(id))",
     "CREATE TABLE IF NOT EXISTS bus_attendance (id INTEGER PRIMARY KEY, student_id INTEGER, route_id INTEGER, date TEXT, present INTEGER DEFAULT 0, FOREIGN KEY(student_id) REFERENCES students(id), FOREIGN KEY(route_id) REFERENCES routes(id))",
-    "CREATE TABLE IF NOT EXISTS contact_messages (id INTEGER PRIMARY KEY, student_id INTEGER, to_role TEXT, to_id INTEGER, subject TEXT, message TEXT, created TEXT, FOREIGN KEY(student_id) REFERENCES students(id))",
+    "CREATE TABLE IF NOT EXISTS contact_messages (id INTEGER PRIMARY KEY, student_id INTEGER, to_role TEXT, to_id INTEGER, subject TEXT, message TEXT, created TEXT, sender_role TEXT, sender_id INTEGER, parent_id INTEGER, is_read INTEGER DEFAULT 0, FOREIGN KEY(student_id) REFERENCES students(id))",
     # Announcements (admin broadcasts) with optional scheduling
     "CREATE TABLE IF NOT EXISTS announcements (id INTEGER PRIMARY KEY, title TEXT, message TEXT, created TEXT, start_date TEXT, end_date TEXT, active INTEGER DEFAULT 1)",
     # Per-student dismissals for announcements
@@ -27,31 +69,509 @@ SCHEMA_STATEMENTS = [
 ]
 
 
+def _add_columns(table: str, columns: List[Tuple[str, str]]):
+    """Migration step adding columns that databases created by older releases lack."""
+    def step(conn: sqlite3.Connection):
+        existing = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+        for name, decl in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+    return step
+
+
+def _fts_index(table: str, columns: Tuple[str, ...]):
+    """Migration step adding an external-content FTS5 index ``<table>_fts``.
+
+    Triggers keep it in step with ``table``; existing rows are indexed by a
+    rebuild. SQLite builds without FTS5 skip the step and search falls back
+    to LIKE scans.
+    """
+    def step(conn: sqlite3.Connection):
+        fts = f"{table}_fts"
+        cols = ", ".join(columns)
+        new = ", ".join(f"NEW.{c}" for c in columns)
+        old = ", ".join(f"OLD.{c}" for c in columns)
+        try:
+            conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', "
+                         "content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+        except sqlite3.OperationalError as e:
+            if "fts5" in str(e):
+                return
+            raise
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_insert AFTER INSERT ON {table} BEGIN "
+                     f"INSERT INTO {fts}(rowid, {cols}) VALUES (NEW.id, {new}); END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_delete AFTER DELETE ON {table} BEGIN "
+                     f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', OLD.id, {old}); END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_update AFTER UPDATE OF {cols} ON {table} BEGIN "
+                     f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', OLD.id, {old}); "
+                     f"INSERT INTO {fts}(rowid, {cols}) VALUES (NEW.id, {new}); END")
+        conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    return step
+
+
+# Columns covered by full-text search, per table (see ERPManager.search)
+FTS_COLUMNS = {
+    "students": ("name", "roll_no", "department", "contact"),
+    "contact_messages": ("subject", "message"),
+    "announcements": ("title", "message"),
+}
+
+
+# attendance_bitmaps keeps one row per (route, month, student); bit d-1 of
+# marked_bits/present_bits stands for day d of the month.
+_DAY_BIT = "(1 << (CAST(strftime('%d', {row}.date) AS INTEGER) - 1))"
+_BITMAP_SET = (
+    "INSERT INTO attendance_bitmaps (route_id, month, student_id, present_bits, marked_bits) "
+    f"SELECT NEW.route_id, strftime('%Y-%m', NEW.date), NEW.student_id, "
+    f"(IFNULL(NEW.present, 0)<>0) * {_DAY_BIT.format(row='NEW')}, {_DAY_BIT.format(row='NEW')} "
+    "WHERE date(NEW.date) IS NOT NULL AND NEW.student_id IS NOT NULL AND NEW.route_id IS NOT NULL "
+    "ON CONFLICT(route_id, month, student_id) DO UPDATE SET "
+    "present_bits=(present_bits & ~excluded.marked_bits) | excluded.present_bits, "
+    "marked_bits=marked_bits | excluded.marked_bits;"
+)
+_BITMAP_KEY_OLD = "route_id=OLD.route_id AND month=strftime('%Y-%m', OLD.date) AND student_id=OLD.student_id"
+_BITMAP_CLEAR = (
+    f"UPDATE attendance_bitmaps SET present_bits=present_bits & ~{_DAY_BIT.format(row='OLD')}, "
+    f"marked_bits=marked_bits & ~{_DAY_BIT.format(row='OLD')} WHERE {_BITMAP_KEY_OLD}; "
+    f"DELETE FROM attendance_bitmaps WHERE {_BITMAP_KEY_OLD} AND marked_bits=0;"
+)
+
+# attendance_bitmaps recomputed from bus_attendance (backfill and repair); one
+# bit per day, so summing the distinct day bits is an OR
+ATTENDANCE_BITMAP_SQL = (
+    "SELECT route_id, month, student_id, SUM(present * bit) AS present_bits, SUM(bit) AS marked_bits FROM ("
+    f"SELECT route_id, student_id, strftime('%Y-%m', date) AS month, {_DAY_BIT.format(row='bus_attendance')} AS bit, "
+    "MAX(IFNULL(present, 0)<>0) AS present FROM bus_attendance "
+    "WHERE date(date) IS NOT NULL AND student_id IS NOT NULL AND route_id IS NOT NULL "
+    "GROUP BY route_id, student_id, date(date)) GROUP BY route_id, month, student_id"
+)
+
+
+# Numbered schema migrations: (version, description, steps). A step is either a
+# SQL string or a callable taking the connection. Each migration runs once, in
+# order, inside a transaction that also bumps PRAGMA user_version, so a database
+# that is up to date costs a single PRAGMA read at startup.
+MIGRATIONS = [
+    (1, "baseline schema and secondary indexes on foreign-key and filter columns", [
+        *SCHEMA_STATEMENTS,
+        # databases from before threading/scheduling support
+        _add_columns("contact_messages", [("sender_role", "TEXT"), ("sender_id", "INTEGER"),
+                                          ("parent_id", "INTEGER"), ("is_read", "INTEGER DEFAULT 0")]),
+        _add_columns("announcements", [("start_date", "TEXT"), ("end_date", "TEXT")]),
+        "CREATE INDEX IF NOT EXISTS idx_users_student ON users(student_id)",
+        "CREATE INDEX IF NOT EXISTS idx_hostel_allocations_student ON hostel_allocations(student_id)",
+        # open allocations only: capacity checks and occupancy reports
+        "CREATE INDEX IF NOT EXISTS idx_hostel_allocations_room_open ON hostel_allocations(room_id) WHERE checkout_date IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_hostel_payments_student ON hostel_payments(student_id)",
+        "CREATE INDEX IF NOT EXISTS idx_drivers_license ON drivers(license_no)",
+        "CREATE INDEX IF NOT EXISTS idx_buses_driver ON buses(driver_id)",
+        "CREATE INDEX IF NOT EXISTS idx_routes_bus ON routes(bus_id)",
+        "CREATE INDEX IF NOT EXISTS idx_transport_allocations_student ON transport_allocations(student_id, route_id)",
+        # active riders only: rider counts and duplicate-assignment checks
+        "CREATE INDEX IF NOT EXISTS idx_transport_allocations_route_active ON transport_allocations(route_id) WHERE active=1",
+        "CREATE INDEX IF NOT EXISTS idx_transport_payments_student ON transport_payments(student_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bus_attendance_student ON bus_attendance(student_id, route_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_bus_attendance_route_date ON bus_attendance(route_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_contact_messages_student ON contact_messages(student_id, created)",
+        "CREATE INDEX IF NOT EXISTS idx_contact_messages_parent ON contact_messages(parent_id)",
+        "CREATE INDEX IF NOT EXISTS idx_contact_messages_created ON contact_messages(created)",
+        "CREATE INDEX IF NOT EXISTS idx_dismissed_announcements_pair ON dismissed_announcements(announcement_id, student_id)",
+        "CREATE INDEX IF NOT EXISTS idx_dismissed_announcements_student ON dismissed_announcements(student_id)",
+    ]),
+    (2, "driver contact column", [
+        # older web releases added this column lazily from request handlers
+        _add_columns("drivers", [("contact", "TEXT")]),
+    ]),
+    (3, "per-room occupants counter maintained by triggers", [
+        _add_columns("hostel_rooms", [("occupants", "INTEGER NOT NULL DEFAULT 0")]),
+        "UPDATE hostel_rooms SET occupants=(SELECT COUNT(1) FROM hostel_allocations a "
+        "WHERE a.room_id=hostel_rooms.id AND a.checkout_date IS NULL)",
+        "CREATE TRIGGER IF NOT EXISTS trg_hostel_allocations_insert AFTER INSERT ON hostel_allocations "
+        "WHEN NEW.checkout_date IS NULL BEGIN "
+        "UPDATE hostel_rooms SET occupants=occupants+1 WHERE id=NEW.room_id; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_hostel_allocations_update AFTER UPDATE OF room_id, checkout_date ON hostel_allocations "
+        "BEGIN "
+        "UPDATE hostel_rooms SET occupants=occupants-1 WHERE id=OLD.room_id AND OLD.checkout_date IS NULL; "
+        "UPDATE hostel_rooms SET occupants=occupants+1 WHERE id=NEW.room_id AND NEW.checkout_date IS NULL; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_hostel_allocations_delete AFTER DELETE ON hostel_allocations "
+        "WHEN OLD.checkout_date IS NULL BEGIN "
+        "UPDATE hostel_rooms SET occupants=occupants-1 WHERE id=OLD.room_id; END",
+    ]),
+    (4, "per-route riders counter maintained by triggers", [
+        _add_columns("routes", [("riders", "INTEGER NOT NULL DEFAULT 0")]),
+        "UPDATE routes SET riders=(SELECT COUNT(1) FROM transport_allocations t "
+        "WHERE t.route_id=routes.id AND t.active=1)",
+        "CREATE TRIGGER IF NOT EXISTS trg_transport_allocations_insert AFTER INSERT ON transport_allocations "
+        "WHEN NEW.active=1 BEGIN "
+        "UPDATE routes SET riders=riders+1 WHERE id=NEW.route_id; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_transport_allocations_update AFTER UPDATE OF route_id, active ON transport_allocations "
+        "BEGIN "
+        "UPDATE routes SET riders=riders-1 WHERE id=OLD.route_id AND OLD.active=1; "
+        "UPDATE routes SET riders=riders+1 WHERE id=NEW.route_id AND NEW.active=1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_transport_allocations_delete AFTER DELETE ON transport_allocations "
+        "WHEN OLD.active=1 BEGIN "
+        "UPDATE routes SET riders=riders-1 WHERE id=OLD.route_id; END",
+    ]),
+    (5, "route index for the transport fee ledger", [
+        "CREATE INDEX IF NOT EXISTS idx_transport_allocations_route ON transport_allocations(route_id)",
+        # superseded: the full index also serves active-rider lookups
+        "DROP INDEX IF EXISTS idx_transport_allocations_route_active",
+    ]),
+    (6, "sort-key indexes for keyset pagination", [
+        "CREATE INDEX IF NOT EXISTS idx_students_name ON students(name)",
+        "CREATE INDEX IF NOT EXISTS idx_students_roll ON students(IFNULL(roll_no, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_hostel_rooms_block_room ON hostel_rooms(IFNULL(block, ''), IFNULL(room_no, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_drivers_name ON drivers(name)",
+        "CREATE INDEX IF NOT EXISTS idx_buses_registration ON buses(IFNULL(registration, ''))",
+    ]),
+    (7, "FTS5 full-text indexes for students, messages and announcements", [
+        _fts_index(table, columns) for table, columns in FTS_COLUMNS.items()
+    ]),
+    (8, "message thread roots and per-thread summary maintained by triggers", [
+        _add_columns("contact_messages", [("thread_root_id", "INTEGER")]),
+        # backfill: follow parent_id links down from every root (a message
+        # whose parent is missing starts its own thread)
+        "CREATE TEMP TABLE thread_roots (id INTEGER PRIMARY KEY, root INTEGER)",
+        "INSERT INTO thread_roots (id, root) WITH RECURSIVE chain(id, root) AS ("
+        "SELECT id, id FROM contact_messages WHERE parent_id IS NULL "
+        "OR parent_id NOT IN (SELECT id FROM contact_messages) "
+        "UNION ALL SELECT m.id, chain.root FROM contact_messages m JOIN chain ON m.parent_id=chain.id) "
+        "SELECT id, root FROM chain",
+        "UPDATE contact_messages SET thread_root_id=IFNULL("
+        "(SELECT root FROM thread_roots WHERE thread_roots.id=contact_messages.id), id)",
+        "DROP TABLE thread_roots",
+        "CREATE INDEX IF NOT EXISTS idx_contact_messages_thread ON contact_messages(thread_root_id, id)",
+        # id is the thread's root message id
+        "CREATE TABLE IF NOT EXISTS message_threads (id INTEGER PRIMARY KEY, student_id INTEGER, subject TEXT, "
+        "started TEXT, last_activity TEXT, last_message_id INTEGER, "
+        "message_count INTEGER NOT NULL DEFAULT 0, unread_count INTEGER NOT NULL DEFAULT 0)",
+        "CREATE INDEX IF NOT EXISTS idx_message_threads_student ON message_threads(student_id, last_activity)",
+        "INSERT OR REPLACE INTO message_threads (id, student_id, subject, started, last_activity, last_message_id, "
+        "message_count, unread_count) "
+        "SELECT r.id, r.student_id, r.subject, r.created, MAX(m.created), MAX(m.id), COUNT(1), "
+        "SUM(IFNULL(m.is_read, 0)=0) "
+        "FROM contact_messages m JOIN contact_messages r ON r.id=m.thread_root_id GROUP BY r.id",
+        "CREATE TRIGGER IF NOT EXISTS trg_contact_messages_thread_insert AFTER INSERT ON contact_messages BEGIN "
+        "INSERT INTO message_threads (id, student_id, subject, started, last_activity, last_message_id, "
+        "message_count, unread_count) VALUES (NEW.thread_root_id, NEW.student_id, NEW.subject, NEW.created, "
+        "NEW.created, NEW.id, 1, IFNULL(NEW.is_read, 0)=0) "
+        "ON CONFLICT(id) DO UPDATE SET last_activity=MAX(IFNULL(last_activity, ''), IFNULL(excluded.last_activity, '')), "
+        "last_message_id=excluded.last_message_id, message_count=message_count+1, "
+        "unread_count=unread_count+excluded.unread_count; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_contact_messages_thread_read AFTER UPDATE OF is_read ON contact_messages "
+        "WHEN (IFNULL(OLD.is_read, 0)=0) <> (IFNULL(NEW.is_read, 0)=0) BEGIN "
+        "UPDATE message_threads SET unread_count=unread_count+(IFNULL(NEW.is_read, 0)=0)-(IFNULL(OLD.is_read, 0)=0) "
+        "WHERE id=NEW.thread_root_id; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_contact_messages_thread_delete AFTER DELETE ON contact_messages BEGIN "
+        "UPDATE message_threads SET message_count=message_count-1, "
+        "unread_count=unread_count-(IFNULL(OLD.is_read, 0)=0), "
+        "last_activity=(SELECT MAX(created) FROM contact_messages WHERE thread_root_id=OLD.thread_root_id), "
+        "last_message_id=(SELECT MAX(id) FROM contact_messages WHERE thread_root_id=OLD.thread_root_id) "
+        "WHERE id=OLD.thread_root_id; "
+        "DELETE FROM message_threads WHERE id=OLD.thread_root_id AND message_count<=0; END",
+    ]),
+    (9, "message categories and per-recipient unread counters", [
+        _add_columns("contact_messages", [("category", "TEXT")]),
+        "UPDATE contact_messages SET category=CASE WHEN parent_id IS NOT NULL THEN 'reply' "
+        "WHEN LOWER(subject) LIKE '%payment%' THEN 'payment' ELSE 'help' END WHERE category IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_contact_messages_unread ON contact_messages(thread_root_id) WHERE is_read=0",
+        # one row per inbox (recipient role + id, 0 for the shared admin inbox) and category
+        "CREATE TABLE IF NOT EXISTS unread_counters (recipient_role TEXT NOT NULL, recipient_id INTEGER NOT NULL, "
+        "category TEXT NOT NULL, unread INTEGER NOT NULL DEFAULT 0, "
+        "PRIMARY KEY (recipient_role, recipient_id, category)) WITHOUT ROWID",
+        "INSERT OR REPLACE INTO unread_counters (recipient_role, recipient_id, category, unread) "
+        "SELECT IFNULL(to_role, ''), IFNULL(to_id, 0), category, COUNT(1) FROM contact_messages "
+        "WHERE IFNULL(is_read, 0)=0 GROUP BY 1, 2, 3",
+        "CREATE TRIGGER IF NOT EXISTS trg_contact_messages_unread_insert AFTER INSERT ON contact_messages "
+        "WHEN IFNULL(NEW.is_read, 0)=0 BEGIN "
+        "INSERT INTO unread_counters (recipient_role, recipient_id, category, unread) "
+        "VALUES (IFNULL(NEW.to_role, ''), IFNULL(NEW.to_id, 0), IFNULL(NEW.category, 'help'), 1) "
+        "ON CONFLICT(recipient_role, recipient_id, category) DO UPDATE SET unread=unread+1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_contact_messages_unread_update "
+        "AFTER UPDATE OF is_read, to_role, to_id, category ON contact_messages BEGIN "
+        "UPDATE unread_counters SET unread=unread-1 WHERE IFNULL(OLD.is_read, 0)=0 "
+        "AND recipient_role=IFNULL(OLD.to_role, '') AND recipient_id=IFNULL(OLD.to_id, 0) "
+        "AND category=IFNULL(OLD.category, 'help'); "
+        "INSERT INTO unread_counters (recipient_role, recipient_id, category, unread) "
+        "SELECT IFNULL(NEW.to_role, ''), IFNULL(NEW.to_id, 0), IFNULL(NEW.category, 'help'), 1 "
+        "WHERE IFNULL(NEW.is_read, 0)=0 "
+        "ON CONFLICT(recipient_role, recipient_id, category) DO UPDATE SET unread=unread+1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_contact_messages_unread_delete AFTER DELETE ON contact_messages "
+        "WHEN IFNULL(OLD.is_read, 0)=0 BEGIN "
+        "UPDATE unread_counters SET unread=unread-1 WHERE recipient_role=IFNULL(OLD.to_role, '') "
+        "AND recipient_id=IFNULL(OLD.to_id, 0) AND category=IFNULL(OLD.category, 'help'); END",
+        # thread summaries also track what is unread for the student (replies to them)
+        _add_columns("message_threads", [("student_unread", "INTEGER NOT NULL DEFAULT 0")]),
+        "UPDATE message_threads SET student_unread=(SELECT COUNT(1) FROM contact_messages m "
+        "WHERE m.thread_root_id=message_threads.id AND m.to_role='student' AND IFNULL(m.is_read, 0)=0)",
+        "DROP TRIGGER IF EXISTS trg_contact_messages_thread_insert",
+        "DROP TRIGGER IF EXISTS trg_contact_messages_thread_read",
+        "DROP TRIGGER IF EXISTS trg_contact_messages_thread_delete",
+        "CREATE TRIGGER trg_contact_messages_thread_insert AFTER INSERT ON contact_messages BEGIN "
+        "INSERT INTO message_threads (id, student_id, subject, started, last_activity, last_message_id, "
+        "message_count, unread_count, student_unread) VALUES (NEW.thread_root_id, NEW.student_id, NEW.subject, "
+        "NEW.created, NEW.created, NEW.id, 1, IFNULL(NEW.is_read, 0)=0, "
+        "IFNULL(NEW.is_read, 0)=0 AND IFNULL(NEW.to_role, '')='student') "
+        "ON CONFLICT(id) DO UPDATE SET last_activity=MAX(IFNULL(last_activity, ''), IFNULL(excluded.last_activity, '')), "
+        "last_message_id=excluded.last_message_id, message_count=message_count+1, "
+        "unread_count=unread_count+excluded.unread_count, student_unread=student_unread+excluded.student_unread; END",
+        "CREATE TRIGGER trg_contact_messages_thread_read AFTER UPDATE OF is_read ON contact_messages "
+        "WHEN (IFNULL(OLD.is_read, 0)=0) <> (IFNULL(NEW.is_read, 0)=0) BEGIN "
+        "UPDATE message_threads SET unread_count=unread_count+(IFNULL(NEW.is_read, 0)=0)-(IFNULL(OLD.is_read, 0)=0), "
+        "student_unread=student_unread+((IFNULL(NEW.is_read, 0)=0)-(IFNULL(OLD.is_read, 0)=0))"
+        "*(IFNULL(NEW.to_role, '')='student') WHERE id=NEW.thread_root_id; END",
+        "CREATE TRIGGER trg_contact_messages_thread_delete AFTER DELETE ON contact_messages BEGIN "
+        "UPDATE message_threads SET message_count=message_count-1, "
+        "unread_count=unread_count-(IFNULL(OLD.is_read, 0)=0), "
+        "student_unread=student_unread-(IFNULL(OLD.is_read, 0)=0 AND IFNULL(OLD.to_role, '')='student'), "
+        "last_activity=(SELECT MAX(created) FROM contact_messages WHERE thread_root_id=OLD.thread_root_id), "
+        "last_message_id=(SELECT MAX(id) FROM contact_messages WHERE thread_root_id=OLD.thread_root_id) "
+        "WHERE id=OLD.thread_root_id; "
+        "DELETE FROM message_threads WHERE id=OLD.thread_root_id AND message_count<=0; END",
+    ]),
+    (10, "normalized announcement visibility window", [
+        # start_day/end_day hold date(start_date)/date(end_date) so visibility
+        # filters compare plain ISO days through an index instead of calling
+        # date() on every row
+        _add_columns("announcements", [("start_day", "TEXT"), ("end_day", "TEXT")]),
+        "UPDATE announcements SET start_day=date(start_date), end_day=date(end_date)",
+        "CREATE INDEX IF NOT EXISTS idx_announcements_window ON announcements(active, start_day, end_day)",
+        "CREATE TRIGGER IF NOT EXISTS trg_announcements_window_insert AFTER INSERT ON announcements BEGIN "
+        "UPDATE announcements SET start_day=date(NEW.start_date), end_day=date(NEW.end_date) WHERE id=NEW.id; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_announcements_window_update AFTER UPDATE OF start_date, end_date "
+        "ON announcements BEGIN "
+        "UPDATE announcements SET start_day=date(NEW.start_date), end_day=date(NEW.end_date) WHERE id=NEW.id; END",
+    ]),
+    (11, "one dismissal per announcement and student", [
+        # repeat clicks used to insert duplicates; keep the earliest of each pair
+        "DELETE FROM dismissed_announcements WHERE id NOT IN "
+        "(SELECT MIN(id) FROM dismissed_announcements GROUP BY announcement_id, student_id)",
+        "DROP INDEX IF EXISTS idx_dismissed_announcements_pair",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_dismissed_announcements_unique "
+        "ON dismissed_announcements(announcement_id, student_id)",
+    ]),
+    (12, "one attendance mark per student, route and day", [
+        # re-marking used to add rows; the latest mark for a day wins
+        "DELETE FROM bus_attendance WHERE id NOT IN "
+        "(SELECT MAX(id) FROM bus_attendance GROUP BY student_id, route_id, date)",
+        "DROP INDEX IF EXISTS idx_bus_attendance_student",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_bus_attendance_unique ON bus_attendance(student_id, route_id, date)",
+    ]),
+    (13, "monthly attendance bitmaps maintained by triggers", [
+        "CREATE TABLE IF NOT EXISTS attendance_bitmaps (route_id INTEGER NOT NULL, month TEXT NOT NULL, "
+        "student_id INTEGER NOT NULL, present_bits INTEGER NOT NULL DEFAULT 0, marked_bits INTEGER NOT NULL DEFAULT 0, "
+        "PRIMARY KEY (route_id, month, student_id)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS idx_attendance_bitmaps_student ON attendance_bitmaps(student_id, month)",
+        "INSERT INTO attendance_bitmaps (route_id, month, student_id, present_bits, marked_bits) "
+        + ATTENDANCE_BITMAP_SQL,
+        "CREATE TRIGGER IF NOT EXISTS trg_bus_attendance_bitmap_insert AFTER INSERT ON bus_attendance BEGIN "
+        f"{_BITMAP_SET} END",
+        "CREATE TRIGGER IF NOT EXISTS trg_bus_attendance_bitmap_update "
+        "AFTER UPDATE OF student_id, route_id, date, present ON bus_attendance BEGIN "
+        f"{_BITMAP_CLEAR} {_BITMAP_SET} END",
+        "CREATE TRIGGER IF NOT EXISTS trg_bus_attendance_bitmap_delete AFTER DELETE ON bus_attendance BEGIN "
+        f"{_BITMAP_CLEAR} END",
+    ]),
+    (14, "one attendance mark per day regardless of date format", [
+        # marks written as e.g. '2024-02-01T08:00' shared a bitmap day with
+        # '2024-02-01'; keep the latest mark per day stored as a plain ISO date
+        "DELETE FROM bus_attendance WHERE date(date) IS NOT NULL AND id NOT IN "
+        "(SELECT MAX(id) FROM bus_attendance WHERE date(date) IS NOT NULL GROUP BY student_id, route_id, date(date))",
+        "UPDATE bus_attendance SET date=date(date) WHERE date(date) IS NOT NULL AND date<>date(date)",
+        "DELETE FROM attendance_bitmaps",
+        "INSERT INTO attendance_bitmaps (route_id, month, student_id, present_bits, marked_bits) "
+        + ATTENDANCE_BITMAP_SQL,
+    ]),
+    (15, "message sort index matching the keyset expression", [
+        # the message list sorts on IFNULL(created, '') so undated rows still page
+        "DROP INDEX IF EXISTS idx_contact_messages_created",
+        "CREATE INDEX IF NOT EXISTS idx_contact_messages_created_key ON contact_messages(IFNULL(created, ''))",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by worker threads.
+
+    - connections are opened lazily, up to ``size``
+    - a thread that already holds a connection gets the same one back
+      (checkouts are re-entrant), so nested helpers never deadlock
+    - ':memory:' databases exist per connection, so they use a single
+      connection that threads take turns on
+    - every new connection is configured from a STORAGE_PROFILES entry
+    """
+
+    def __init__(self, path: str, size: int = DEFAULT_POOL_SIZE, timeout: float = DEFAULT_POOL_TIMEOUT,
+                 profile: str = DEFAULT_PROFILE):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile: {profile}")
+        self.settings = STORAGE_PROFILES[profile]
+        if self.settings.get("read_only") and path == ":memory:":
+            raise ValueError("An in-memory database cannot be opened read-only")
+        self.path = path
+        self.profile = profile
+        self.size = 1 if path == ":memory:" else size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        settings = self.settings
+        if settings.get("read_only"):
+            uri = f"file:{self.path}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=self.timeout)
+            conn.execute("PRAGMA query_only=ON")
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=self.timeout)
+            if self.path != ":memory:":
+                conn.execute(f"PRAGMA journal_mode={settings['journal_mode']}")
+            conn.execute(f"PRAGMA synchronous={settings['synchronous']}")
+        conn.execute(f"PRAGMA cache_size={int(settings['cache_size'])}")
+        conn.execute(f"PRAGMA mmap_size={int(settings['mmap_size'])}")
+        conn.execute(f"PRAGMA temp_store={settings['temp_store']}")
+        conn.execute(f"PRAGMA busy_timeout={int(settings['busy_timeout'])}")
+        # tuple-backed rows with name access; see erp.models.Record
+        conn.row_factory = record_factory
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a database connection") from None
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            if conn.in_transaction:
+                # never hand a half-finished transaction to another thread
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+class RowStream:
+    """Iterator returned by ``Database.iter_query``.
+
+    ``columns`` holds the result's column names once iteration has started
+    (the query runs on the first ``next``), so consumers such as CSV exports
+    can write a header for an empty result.
+    """
+
+    def __init__(self, stream: Iterator):
+        self._stream = stream
+        self._started = False
+        self.columns: Optional[Tuple[str, ...]] = None
+
+    def __iter__(self) -> "RowStream":
+        return self
+
+    def __next__(self) -> Record:
+        if not self._started:
+            self._started = True
+            self.columns = next(self._stream)
+        return next(self._stream)
+
+    def close(self):
+        self._stream.close()
+
 
 class Database:
     """Simple SQLite helper for the ERP.
 
     Responsibilities:
-    - create schema (idempotent)
-    - provide basic execute/query helpers
+    - create and upgrade the schema through numbered MIGRATIONS
+    - provide basic execute/query helpers on top of a thread-safe ConnectionPool
     - create/verify users with salted PBKDF2-HMAC-SHA256 password storage
+
+    ``profile`` names a STORAGE_PROFILES entry. A "readonly-replica" Database
+    never touches the schema; the writer process is expected to own it.
+    ``auth`` decides where password hashing runs (default: inline).
     """
 
-    def __init__(self, path: str = DEFAULT_DB):
+    def __init__(self, path: str = DEFAULT_DB, pool_size: int = DEFAULT_POOL_SIZE, profile: str = DEFAULT_PROFILE,
+                 auth: Optional[AuthBackend] = None):
         self.path = path
-        self.conn = sqlite3.connect(self.path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
-        self._create_tables()
-
-    def _create_tables(self):
-        cur = self.conn.cursor()
-        for stmt in SCHEMA_STATEMENTS:
-            cur.execute(stmt)
-        self.conn.commit()
-
-        # Seed default admin if missing
-        cur.execute("SELECT COUNT(1) as c FROM users WHERE role='admin'")
-        row = cur.fetchone()
+        self.profile = profile
+        self.auth = auth or AuthBackend()
+        self.pool = ConnectionPool(path, size=pool_size, profile=profile)
+        self._tx = threading.local()
+        self._dummy_hash: Optional[str] = None
+        if not self.pool.settings.get("read_only"):
+            with self.pool.connection() as conn:
+                self._migrate(conn)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Bring the schema up to SCHEMA_VERSION.
+
+        Pending MIGRATIONS are applied in one transaction and recorded in
+        PRAGMA user_version; an up-to-date database only pays the version read.
+        """
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        # IMMEDIATE takes the write lock up front so two processes starting at
+        # once cannot both apply the same migration
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, _description, steps in MIGRATIONS:
+                if number <= version:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f"PRAGMA user_version={int(number)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self._seed_admin(conn)
+
+    def _seed_admin(self, conn: sqlite3.Connection):
+        row = conn.execute("SELECT COUNT(1) as c FROM users WHERE role='admin'").fetchone()
         if row and row[0] == 0:
             # store a hashed default admin password
             try:
@@ -60,87 +580,154 @@ class Database:
                 # ignore unique/insert errors during concurrent runs
                 pass
 
-        # Ensure contact_messages has new columns for threading/sender metadata
-        try:
-            cur.execute("PRAGMA table_info(contact_messages)")
-            cols = {r[1] for r in cur.fetchall()}
-            if 'sender_role' not in cols:
-                cur.execute("ALTER TABLE contact_messages ADD COLUMN sender_role TEXT")
-            if 'sender_id' not in cols:
-                cur.execute("ALTER TABLE contact_messages ADD COLUMN sender_id INTEGER")
-            if 'parent_id' not in cols:
-                cur.execute("ALTER TABLE contact_messages ADD COLUMN parent_id INTEGER")
-            if 'is_read' not in cols:
-                cur.execute("ALTER TABLE contact_messages ADD COLUMN is_read INTEGER DEFAULT 0")
-            self.conn.commit()
-        except Exception:
-            # ignore migration errors on older SQLite setups
-            pass
-
-        # Ensure announcements has start_date/end_date if older DB exists
-        try:
-            cur.execute("PRAGMA table_info(announcements)")
-            cols = {r[1] for r in cur.fetchall()}
-            if 'start_date' not in cols:
-                cur.execute("ALTER TABLE announcements ADD COLUMN start_date TEXT")
-            if 'end_date' not in cols:
-                cur.execute("ALTER TABLE announcements ADD COLUMN end_date TEXT")
-            self.conn.commit()
-        except Exception:
-            pass
-
     def _hash_password(self, password: str) -> str:
-        salt = os.urandom(16)
-        dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, 100_000)
-        return f"{binascii.hexlify(salt).decode()}:{binascii.hexlify(dk).decode()}"
+        return self.auth.hash(password)
 
     def _verify_password(self, stored: str, provided: str) -> bool:
-        try:
-            salt_hex, dk_hex = stored.split(":")
-            salt = binascii.unhexlify(salt_hex)
-            dk = binascii.unhexlify(dk_hex)
-            new_dk = hashlib.pbkdf2_hmac("sha256", provided.encode("utf-8"), salt, 100_000)
-            return binascii.hexlify(new_dk) == binascii.hexlify(dk)
-        except Exception:
-            return False
+        return self.auth.verify(stored, provided)
+
+    def _dummy_password_hash(self) -> str:
+        """Hash at the configured cost that no password matches; made on first use."""
+        if self._dummy_hash is None:
+            self._dummy_hash = self._hash_password(os.urandom(16).hex())
+        return self._dummy_hash
 
     # User helpers
     def create_user(self, username: str, password: str, role: str, student_id: Optional[int] = None) -> int:
         pw = self._hash_password(password)
-        cur = self.conn.cursor()
-        cur.execute(
+        cur = self.execute(
             "INSERT INTO users (username,password,role,student_id) VALUES (?,?,?,?)",
             (username, pw, role, student_id),
         )
-        self.conn.commit()
         return cur.lastrowid
 
-    def verify_user(self, username: str, password: str, role: Optional[str] = None) -> Optional[sqlite3.Row]:
-        cur = self.conn.cursor()
+    def insert_users(self, users: Iterable[Tuple[str, str, str, Optional[int]]]) -> None:
+        """Bulk insert of (username, password_hash, role, student_id) rows whose
+        passwords were already hashed with ``hash_password``."""
+        self.executemany("INSERT INTO users (username,password,role,student_id) VALUES (?,?,?,?)", users)
+
+    def verify_user(self, username: str, password: str, role: Optional[str] = None) -> Optional[Record]:
         if role:
-            cur.execute("SELECT * FROM users WHERE username=? AND role=?", (username, role))
+            rows = self.query("SELECT * FROM users WHERE username=? AND role=?", (username, role))
         else:
-            cur.execute("SELECT * FROM users WHERE username=?", (username,))
-        row = cur.fetchone()
+            rows = self.query("SELECT * FROM users WHERE username=?", (username,))
+        row = rows[0] if rows else None
         if not row:
+            # spend the same PBKDF2 work as a wrong password so response time
+            # does not reveal which usernames exist
+            self._verify_password(self._dummy_password_hash(), password)
             return None
-        if self._verify_password(row["password"], password):
-            return row
-        return None
+        if not self._verify_password(row["password"], password):
+            return None
+        if self.auth.needs_rehash(row["password"]) and not self.pool.settings.get("read_only"):
+            # upgrade legacy/old-cost hashes while the plaintext is at hand;
+            # the password guard skips the write if it changed meanwhile;
+            # read-only replicas leave the upgrade to a login on the writer
+            self.execute("UPDATE users SET password=? WHERE id=? AND password=?",
+                         (self._hash_password(password), row["id"], row["password"]))
+        return row
+
+    def in_transaction(self) -> bool:
+        """True while the calling thread is inside a ``transaction()`` block."""
+        return getattr(self._tx, "depth", 0) > 0
+
+    @contextmanager
+    def transaction(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        """Group several statements into one all-or-nothing commit.
+
+        ``execute`` skips its per-statement commit inside the block. Nested
+        blocks become savepoints, so an inner failure only undoes the inner
+        work when the caller handles the exception. ``immediate`` takes the
+        write lock at BEGIN, for read-then-write sequences that must not race.
+        """
+        with self.pool.connection() as conn:
+            depth = getattr(self._tx, "depth", 0)
+            if depth == 0:
+                conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+                self._tx.pending = []
+            else:
+                conn.execute(f"SAVEPOINT sp_{depth}")
+            mark = len(self._tx.pending)
+            self._tx.depth = depth + 1
+            try:
+                yield conn
+            except BaseException:
+                self._tx.depth = depth
+                # callbacks queued by the undone work must not run
+                del self._tx.pending[mark:]
+                if depth == 0:
+                    conn.rollback()
+                else:
+                    conn.execute(f"ROLLBACK TO sp_{depth}")
+                    conn.execute(f"RELEASE sp_{depth}")
+                raise
+            self._tx.depth = depth
+            if depth == 0:
+                conn.commit()
+                pending, self._tx.pending = self._tx.pending, []
+                for callback in pending:
+                    callback()
+            else:
+                conn.execute(f"RELEASE sp_{depth}")
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """Run ``callback`` once the calling thread's transaction commits.
+
+        Outside a transaction it runs at once; a rollback drops it. Cache
+        invalidation goes through here so other threads cannot re-cache rows
+        read between the write and its commit.
+        """
+        if self.in_transaction():
+            self._tx.pending.append(callback)
+        else:
+            callback()
 
     def execute(self, sql: str, params: Tuple = ()) -> sqlite3.Cursor:
-        cur = self.conn.cursor()
-        cur.execute(sql, params)
-        self.conn.commit()
-        return cur
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            if not self.in_transaction():
+                conn.commit()
+            return cur
+
+    def executemany(self, sql: str, seq_of_params: Iterable[Tuple]) -> sqlite3.Cursor:
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.executemany(sql, seq_of_params)
+            if not self.in_transaction():
+                conn.commit()
+            return cur
+
+    def query(self, sql: str, params: Tuple = ()) -> List[Record]:
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            return cur.fetchall()
 
-    def query(self, sql: str, params: Tuple = ()) -> List[sqlite3.Row]:
-        cur = self.conn.cursor()
-        cur.execute(sql, params)
-        return cur.fetchall()
+    def iter_query(self, sql: str, params: Tuple = (), chunk_size: int = DEFAULT_FETCH_SIZE) -> "RowStream":
+        """Like ``query`` but yields rows, fetching ``chunk_size`` at a time.
+
+        The pooled connection stays checked out by this thread until the
+        iterator is exhausted or closed, so finish (or ``close()``) it before
+        starting a transaction.
+        """
+        return RowStream(self._stream(sql, params, chunk_size))
+
+    def _stream(self, sql: str, params: Tuple, chunk_size: int) -> Iterator:
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                # first item: the column names, even when there are no rows
+                yield tuple(d[0] for d in cur.description)
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                cur.close()
 
     def close(self):
-        try:
-            self.conn.close()
-        except Exception:
-            pass
+        self.pool.close()
+        self.auth.close()
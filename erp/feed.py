@@ -0,0 +1,112 @@
+"""Process-wide announcement feed for student dashboards.
+
+The dashboard shows the active announcements whose schedule covers today,
+minus the ones the student dismissed. AnnouncementFeed keeps that set in
+memory: the visible list is reloaded when the date reaches the next window
+boundary (an announcement starting or ending), when ``invalidate`` is called
+after an announcement write, or after ``ttl`` seconds so other processes'
+edits show up. Each student's dismissals are an int bitset indexed by
+announcement id.
+"""
+import datetime
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from .cache import TTLCache
+
+FEED_TTL = 60.0
+DISMISSAL_CACHE_SIZE = 4096
+
+
+def _today() -> str:
+    return datetime.date.today().isoformat()
+
+
+def _bitset(ids: Iterable[int]) -> int:
+    bits = 0
+    for i in ids:
+        bits |= 1 << i
+    return bits
+
+
+class AnnouncementFeed:
+    """Visible announcements plus per-student dismissal bitsets.
+
+    load_visible(today) -> (rows newest first, next boundary day or None)
+    load_dismissed(student_id) -> announcement ids the student dismissed
+    """
+
+    def __init__(self, load_visible: Callable[[str], Tuple[List, Optional[str]]],
+                 load_dismissed: Callable[[int], Iterable[int]], ttl: Optional[float] = FEED_TTL,
+                 clock: Callable[[], float] = time.monotonic, today: Callable[[], str] = _today):
+        self._load_visible = load_visible
+        self._load_dismissed = load_dismissed
+        self.ttl = ttl
+        self._clock = clock
+        self._today = today
+        self._lock = threading.Lock()
+        # (rows, next_boundary, expires) or None
+        self._snapshot = None
+        self._generation = 0
+        self._dismissal_generation = 0
+        # bitsets expire with the visible set so other workers' dismissals show up as quickly
+        self.dismissals = TTLCache(maxsize=DISMISSAL_CACHE_SIZE, ttl=ttl, clock=clock)
+        self.reloads = 0
+
+    def visible(self) -> List:
+        """Announcements visible today, newest first (a shared list; do not mutate)."""
+        today = self._today()
+        snapshot = self._snapshot
+        if snapshot is not None:
+            rows, boundary, expires = snapshot
+            if (boundary is None or today < boundary) and (expires is None or self._clock() < expires):
+                return rows
+        generation = self._generation
+        rows, boundary = self._load_visible(today)
+        expires = self._clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self.reloads += 1
+            # a write during the load invalidated it; serve it but do not keep it
+            if generation == self._generation:
+                self._snapshot = (rows, boundary, expires)
+        return rows
+
+    def _dismissed_bits(self, student_id: int) -> int:
+        bits = self.dismissals.get(student_id)
+        if bits is None:
+            generation = self._dismissal_generation
+            bits = _bitset(self._load_dismissed(student_id))
+            with self._lock:
+                # a dismissal committed during the load may be missing from it
+                if generation == self._dismissal_generation:
+                    self.dismissals.set(student_id, bits)
+        return bits
+
+    def for_student(self, student_id: int) -> List:
+        bits = self._dismissed_bits(student_id)
+        return [a for a in self.visible() if not (bits >> a["id"]) & 1]
+
+    def is_dismissed(self, student_id: int, announcement_id: int) -> bool:
+        return bool((self._dismissed_bits(student_id) >> announcement_id) & 1)
+
+    def dismissed(self, student_id: int, *announcement_ids: int):
+        """Record committed dismissals in the student's cached bitset, if loaded."""
+        with self._lock:
+            self._dismissal_generation += 1
+            bits = self.dismissals.get(student_id)
+            if bits is not None:
+                self.dismissals.set(student_id, bits | _bitset(announcement_ids))
+
+    def invalidate(self, dismissals: bool = False):
+        """Drop the visible set; call after creating, editing or deleting announcements.
+
+        dismissals: also drop every cached bitset, needed after a delete since
+        SQLite may hand the freed id to the next announcement
+        """
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+            if dismissals:
+                self._dismissal_generation += 1
+                self.dismissals.clear()
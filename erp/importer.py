@@ -0,0 +1,164 @@
+"""Bulk student import from CSV or JSON Lines files.
+
+Rows are streamed from the file, validated, and written in chunks: passwords
+for a chunk are hashed in a process pool, then the chunk is inserted with
+executemany in a single transaction. Rejected rows go to an optional error
+file instead of aborting the import.
+"""
+import csv
+import functools
+import json
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .auth import POOL_START_METHOD, hash_password
+
+STUDENT_FIELDS = ("name", "roll_no", "department", "contact", "address", "username", "password")
+DEFAULT_CHUNK_SIZE = 500
+
+
+class ImportReport:
+    def __init__(self):
+        self.processed = 0
+        self.imported = 0
+        self.failed = 0
+        self.student_ids: List[int] = []
+
+    def __repr__(self):
+        return f"<ImportReport processed={self.processed} imported={self.imported} failed={self.failed}>"
+
+
+def read_rows(path: str, fmt: Optional[str] = None) -> Iterator[Dict]:
+    """Yield one dict per record from a CSV (with header) or JSONL file."""
+    if fmt is None:
+        fmt = "jsonl" if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson", ".json") else "csv"
+    with open(path, newline="", encoding="utf-8") as fh:
+        if fmt == "csv":
+            yield from csv.DictReader(fh)
+        elif fmt == "jsonl":
+            for line in fh:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def validate_student(row: Dict) -> Dict:
+    """Return a cleaned copy of ``row`` or raise ValueError."""
+    clean = {}
+    for field in STUDENT_FIELDS:
+        value = row.get(field)
+        if value is not None:
+            value = str(value).strip()
+        clean[field] = value or None
+    if not clean["name"]:
+        raise ValueError("name is required")
+    if bool(clean["username"]) != bool(clean["password"]):
+        raise ValueError("username and password must be given together")
+    return clean
+
+
+def _chunks(rows: Iterable[Dict], size: int) -> Iterator[List[Tuple[int, Dict]]]:
+    chunk: List[Tuple[int, Dict]] = []
+    for number, row in enumerate(rows, start=1):
+        chunk.append((number, row))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _existing(manager, sql: str, values: List[str]) -> set:
+    if not values:
+        return set()
+    marks = ",".join("?" for _ in values)
+    return {r[0] for r in manager.db.query(sql.format(marks=marks), tuple(values))}
+
+
+def import_students(manager, rows: Iterable[Dict], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    workers: Optional[int] = None, error_file: Optional[str] = None,
+                    progress: Optional[Callable[[ImportReport], None]] = None) -> ImportReport:
+    """Import student rows through ``manager.bulk_add_students``.
+
+    workers: hashing processes (None = one per CPU, 0 = hash in this process)
+    error_file: CSV path receiving rejected rows with their row number and reason
+    progress: called with the running ImportReport after every chunk
+    """
+    report = ImportReport()
+    # same cost as interactive logins on this deployment
+    hasher = functools.partial(hash_password, iterations=manager.db.auth.iterations)
+    # spawned like the auth pool: the importer may run beside a threaded app
+    pool = (ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(POOL_START_METHOD))
+            if workers != 0 else None)
+    err_fh = open(error_file, "w", newline="", encoding="utf-8") if error_file else None
+    err_writer = None
+    if err_fh:
+        err_writer = csv.writer(err_fh)
+        err_writer.writerow(("row", "error") + STUDENT_FIELDS[:-1])
+
+    def reject(number: int, row: Dict, reason: str):
+        report.failed += 1
+        if err_writer:
+            # never write plaintext passwords to the error file
+            err_writer.writerow((number, reason) + tuple(row.get(f) for f in STUDENT_FIELDS[:-1]))
+
+    try:
+        for chunk in _chunks(rows, chunk_size):
+            report.processed += len(chunk)
+            valid: List[Tuple[int, Dict]] = []
+            for number, row in chunk:
+                try:
+                    valid.append((number, validate_student(row)))
+                except ValueError as e:
+                    reject(number, row, str(e))
+
+            # reject rows clashing with the database or with earlier rows of the chunk
+            taken_rolls = _existing(manager, "SELECT roll_no FROM students WHERE roll_no IN ({marks})",
+                                    [r["roll_no"] for _, r in valid if r["roll_no"]])
+            taken_users = _existing(manager, "SELECT username FROM users WHERE username IN ({marks})",
+                                    [r["username"] for _, r in valid if r["username"]])
+            accepted: List[Tuple[int, Dict]] = []
+            for number, r in valid:
+                if r["roll_no"] and r["roll_no"] in taken_rolls:
+                    reject(number, r, f"duplicate roll_no {r['roll_no']}")
+                elif r["username"] and r["username"] in taken_users:
+                    reject(number, r, f"duplicate username {r['username']}")
+                else:
+                    if r["roll_no"]:
+                        taken_rolls.add(r["roll_no"])
+                    if r["username"]:
+                        taken_users.add(r["username"])
+                    accepted.append((number, r))
+
+            passwords = [r["password"] for _, r in accepted if r["username"]]
+            if pool:
+                hashes = iter(pool.map(hasher, passwords, chunksize=max(1, len(passwords) // 32)))
+            else:
+                hashes = iter([hasher(p) for p in passwords])
+            for _, r in accepted:
+                r["password_hash"] = next(hashes) if r["username"] else None
+                r["password"] = None
+
+            try:
+                ids = manager.bulk_add_students([r for _, r in accepted])
+            except sqlite3.IntegrityError as e:
+                # e.g. a roll_no or username taken by another writer since the
+                # checks above; the chunk was rolled back, so reject all of it
+                for number, r in accepted:
+                    reject(number, r, f"chunk rejected by database: {e}")
+                ids = []
+            report.student_ids.extend(ids)
+            report.imported += len(ids)
+            if progress:
+                progress(report)
+    finally:
+        if pool:
+            pool.shutdown()
+        if err_fh:
+            err_fh.close()
+    return report
@@ -1,32 +1,294 @@
-from .db import Database
-from .models import Student, HostelRoom, Bus, Route
-from typing import Optional, List, Dict
+from .auth import AuthBackend
+from .cache import TTLCache
+from .db import (Database, ATTENDANCE_BITMAP_SQL, DEFAULT_FETCH_SIZE, DEFAULT_POOL_SIZE, DEFAULT_PROFILE,
+                 FTS_COLUMNS)
+from .feed import AnnouncementFeed
+from .models import Record, Student, HostelRoom, Bus, Route
+from typing import Optional, Iterable, Iterator, List, Dict, Tuple
 import datetime
+import json
+
+# Identity cache for logged-in students: bounded LRU, entries expire so other
+# worker processes' edits show up within STUDENT_CACHE_TTL seconds.
+STUDENT_CACHE_SIZE = 4096
+STUDENT_CACHE_TTL = 300.0
+# Dashboard profiles; invalidated by this process's payment/allocation writes.
+PROFILE_CACHE_SIZE = 4096
+PROFILE_CACHE_TTL = 60.0
+# Admin reports, keyed by (report name, *params). Entries are dropped when the
+# manager writes to a table listed in REPORT_TABLES; the TTL bounds how stale
+# another process's writes can look.
+REPORT_CACHE_SIZE = 256
+REPORT_CACHE_TTL = 120.0
+REPORT_TABLES = {
+    "hostel_occupancy": frozenset({"hostel_rooms", "hostel_allocations"}),
+    "vacant_rooms": frozenset({"hostel_rooms", "hostel_allocations"}),
+    "active_routes": frozenset({"routes", "buses", "transport_allocations"}),
+    "transport_fee": frozenset({"transport_allocations", "transport_payments", "routes", "students"}),
+}
+
+# Whole student profile in one round-trip: child lists come back as JSON arrays
+# and the money totals are summed by SQLite.
+PROFILE_SQL = (
+    "SELECT s.*, "
+    "(SELECT json_group_array(json_object('id', a.id, 'student_id', a.student_id, 'room_id', a.room_id, "
+    "'checkin_date', a.checkin_date, 'checkout_date', a.checkout_date, 'block', r.block, 'room_no', r.room_no)) "
+    "FROM hostel_allocations a JOIN hostel_rooms r ON a.room_id=r.id WHERE a.student_id=s.id) AS _hostel_allocations, "
+    "(SELECT json_group_array(json_object('id', t.id, 'student_id', t.student_id, 'route_id', t.route_id, "
+    "'active', t.active, 'route_name', r.name, 'pickup_location', r.pickup_location, 'fee', r.fee)) "
+    "FROM transport_allocations t JOIN routes r ON t.route_id=r.id WHERE t.student_id=s.id) AS _transport_allocations, "
+    "(SELECT json_group_array(json_object('id', p.id, 'student_id', p.student_id, 'amount', p.amount, "
+    "'date', p.date, 'receipt_no', p.receipt_no)) "
+    "FROM hostel_payments p WHERE p.student_id=s.id) AS _hostel_payments, "
+    "(SELECT json_group_array(json_object('id', p.id, 'student_id', p.student_id, 'amount', p.amount, "
+    "'date', p.date, 'receipt_no', p.receipt_no)) "
+    "FROM transport_payments p WHERE p.student_id=s.id) AS _transport_payments, "
+    "(SELECT IFNULL(SUM(amount), 0) FROM hostel_payments WHERE student_id=s.id) AS _total_hostel_paid, "
+    "(SELECT IFNULL(SUM(amount), 0) FROM transport_payments WHERE student_id=s.id) AS _total_transport_paid, "
+    "(SELECT IFNULL(SUM(r.fee), 0) FROM transport_allocations t JOIN routes r ON t.route_id=r.id "
+    "WHERE t.student_id=s.id) AS _total_route_fee "
+    "FROM students s WHERE s.id=?"
+)
+
+# Trigger-maintained counters: (table, column, correlated recount query).
+COUNTER_CHECKS = (
+    ("hostel_rooms", "occupants",
+     "SELECT COUNT(1) FROM hostel_allocations a WHERE a.room_id=hostel_rooms.id AND a.checkout_date IS NULL"),
+    ("routes", "riders",
+     "SELECT COUNT(1) FROM transport_allocations t WHERE t.route_id=routes.id AND t.active=1"),
+    ("message_threads", "message_count",
+     "SELECT COUNT(1) FROM contact_messages m WHERE m.thread_root_id=message_threads.id"),
+    ("message_threads", "unread_count",
+     "SELECT COUNT(1) FROM contact_messages m WHERE m.thread_root_id=message_threads.id AND IFNULL(m.is_read, 0)=0"),
+    ("message_threads", "student_unread",
+     "SELECT COUNT(1) FROM contact_messages m WHERE m.thread_root_id=message_threads.id "
+     "AND m.to_role='student' AND IFNULL(m.is_read, 0)=0"),
+)
+
+# attendance_bitmaps rows that differ from a recount of bus_attendance
+BITMAP_MISMATCH_SQL = (
+    f"WITH actual AS ({ATTENDANCE_BITMAP_SQL}) "
+    "SELECT a.route_id, a.month, a.student_id, b.present_bits AS stored_present, b.marked_bits AS stored_marked, "
+    "a.present_bits AS actual_present, a.marked_bits AS actual_marked FROM actual a "
+    "LEFT JOIN attendance_bitmaps b ON b.route_id=a.route_id AND b.month=a.month AND b.student_id=a.student_id "
+    "WHERE b.present_bits IS NOT a.present_bits OR b.marked_bits IS NOT a.marked_bits "
+    "UNION ALL SELECT b.route_id, b.month, b.student_id, b.present_bits, b.marked_bits, 0, 0 "
+    "FROM attendance_bitmaps b WHERE NOT EXISTS (SELECT 1 FROM actual a "
+    "WHERE a.route_id=b.route_id AND a.month=b.month AND a.student_id=b.student_id)"
+)
+
+# Keyset pagination: sort keys each listing accepts, as column expressions
+# ({t} = table alias). Every key ends with the id so the order is total and a
+# page can resume from the id of the last row the caller saw.
+SORT_KEYS = {
+    "students": {"id": ("id",), "name": ("name", "id"), "roll_no": ("roll_no", "id")},
+    "hostel_rooms": {"id": ("id",), "room": ("block", "room_no", "id")},
+    "drivers": {"id": ("id",), "name": ("name", "id")},
+    "buses": {"id": ("id",), "registration": ("registration", "id")},
+    "contact_messages": {"created": ("created", "id"), "id": ("id",)},
+}
+# Nullable sort columns compare as '' so NULL rows keep a place in the order;
+# the expression indexes (migrations 6 and 15) use the same IFNULL
+NULLABLE_SORT_COLUMNS = frozenset({"roll_no", "block", "room_no", "registration", "created"})
+
+
+def _sort_columns(table: str, sort: str) -> Tuple[str, ...]:
+    columns = SORT_KEYS[table].get(sort)
+    if columns is None:
+        raise ValueError(f"Unsupported sort key: {sort}")
+    return columns
+
+
+def keyset_cursor(table: str, sort: str, row) -> Tuple:
+    """Sort values of ``row`` (the last one shown) to pass as ``after`` for the next page."""
+    return tuple("" if row[c] is None and c in NULLABLE_SORT_COLUMNS else row[c]
+                 for c in _sort_columns(table, sort))
+
+
+# contact_messages.category values; unread badges are counted per category
+MESSAGE_CATEGORIES = ("payment", "help", "reply")
+
+# search() kinds: (indexed table, SELECT returning the result rows, its alias)
+SEARCH_KINDS = {
+    "students": ("students", "SELECT s.* FROM students s", "s"),
+    "messages": ("contact_messages", "SELECT m.id, m.student_id, st.name AS student_name, m.subject, m.message, "
+                 "m.created, m.parent_id FROM contact_messages m LEFT JOIN students st ON m.student_id=st.id", "m"),
+    "announcements": ("announcements", "SELECT a.* FROM announcements a", "a"),
+}
+SEARCH_PAGE_SIZE = 20
+
+
+def _search_terms(query: str) -> List[str]:
+    return [t for t in (query or "").split() if t.replace('"', "")]
+
+
+def _fts_query(terms: List[str]) -> str:
+    """Quote every term so user input is never parsed as FTS5 syntax; the last
+    term matches as a prefix, for search-as-you-type."""
+    quoted = ['"' + t.replace('"', '""') + '"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+OCCUPANCY_SQL = "SELECT id as room_id, block, room_no, capacity, occupants FROM hostel_rooms ORDER BY id"
+VACANT_ROOMS_SQL = ("SELECT r.*, (r.capacity - r.occupants) as vacant FROM hostel_rooms r "
+                    "WHERE r.capacity > r.occupants ORDER BY r.id")
+
+# Upsert used by every dismissal write; the pair is UNIQUE since migration 11
+DISMISS_SQL = ("INSERT INTO dismissed_announcements (announcement_id,student_id,dismissed_at) VALUES (?,?,?) "
+               "ON CONFLICT(announcement_id, student_id) DO NOTHING")
+# One mark per (student_id, route_id, date) since migration 12; the latest submission wins
+ATTENDANCE_UPSERT_SQL = ("INSERT INTO bus_attendance (student_id,route_id,date,present) VALUES (?,?,?,?) "
+                         "ON CONFLICT(student_id, route_id, date) DO UPDATE SET present=excluded.present")
+# Dismissals of ended announcements are kept this long in case the window is extended
+DISMISSAL_RETENTION_DAYS = 30
+
+PAYMENT_TABLES = {"hostel": "hostel_payments", "transport": "transport_payments"}
+
+
+def _date_filters(column: str, date_from: Optional[str], date_to: Optional[str]) -> Tuple[List[str], List]:
+    """WHERE clauses for an inclusive ISO date range on ``column``."""
+    where, params = ["1=1"], []
+    if date_from is not None:
+        where.append(f"{column}>=?")
+        params.append(date_from)
+    if date_to is not None:
+        where.append(f"{column}<=?")
+        params.append(date_to)
+    return where, params
+
+
+# int.bit_count is Python 3.10+
+_popcount = getattr(int, "bit_count", None) or (lambda bits: bin(bits).count("1"))
+
+
+def _attendance_day(value) -> str:
+    """ISO day for an attendance mark (today when None); raises ValueError."""
+    if value is None:
+        return datetime.date.today().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()[:10]
+    try:
+        return datetime.datetime.fromisoformat(str(value)).date().isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid attendance date: {value!r}") from None
+
+
+def _percent(part: int, whole: int) -> Optional[float]:
+    return round(100.0 * part / whole, 1) if whole else None
+
 
 class ERPManager:
-    def __init__(self, db_path: Optional[str] = None):
-        self.db = Database(db_path) if db_path else Database()
+    def __init__(self, db_path: Optional[str] = None, pool_size: int = DEFAULT_POOL_SIZE,
+                 profile: str = DEFAULT_PROFILE, auth: Optional[AuthBackend] = None):
+        if db_path:
+            self.db = Database(db_path, pool_size=pool_size, profile=profile, auth=auth)
+        else:
+            self.db = Database(pool_size=pool_size, profile=profile, auth=auth)
+        self.student_cache = TTLCache(maxsize=STUDENT_CACHE_SIZE, ttl=STUDENT_CACHE_TTL)
+        self.profile_cache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+        self.report_cache = TTLCache(maxsize=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_TTL)
+        # bumped on every invalidation so a load that raced a write is not stored
+        self._report_generation = 0
+        self._student_generation = 0
+        self._fts: Optional[frozenset] = None
+        self.announcement_feed = AnnouncementFeed(self._load_visible_announcements, self._load_dismissals)
+
+    def _student_changed(self, student_id: Optional[int]):
+        """Drop the student's cached row and profile once the write commits."""
+        def invalidate():
+            self._student_generation += 1
+            self.student_cache.invalidate(student_id)
+            self.profile_cache.invalidate(student_id)
+        self.db.after_commit(invalidate)
+
+    def _profiles_changed(self):
+        """Drop every cached profile once the write commits (data shared by many students)."""
+        def invalidate():
+            self._student_generation += 1
+            self.profile_cache.clear()
+        self.db.after_commit(invalidate)
+
+    def _tables_changed(self, *tables: str):
+        """Drop cached reports that read any of ``tables`` once the write commits."""
+        changed = frozenset(tables)
+
+        def invalidate():
+            self._report_generation += 1
+            self.report_cache.invalidate_where(lambda key: not REPORT_TABLES[key[0]].isdisjoint(changed))
+        self.db.after_commit(invalidate)
+
+    def _cached_report(self, name: str, loader, *params) -> List[Record]:
+        key = (name,) + params
+        rows = self.report_cache.get(key)
+        if rows is None:
+            generation = self._report_generation
+            rows = loader()
+            if generation == self._report_generation:
+                self.report_cache.set(key, rows)
+        # rows are immutable records; copy only the list
+        return list(rows)
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        return {"students": self.student_cache.stats(), "profiles": self.profile_cache.stats(),
+                "reports": self.report_cache.stats(), "dismissals": self.announcement_feed.dismissals.stats()}
 
     # -- Student CRUD --
     def add_student(self, name: str, roll_no: Optional[str] = None, department: Optional[str] = None,
                     contact: Optional[str] = None, address: Optional[str] = None, username: Optional[str] = None,
                     password: Optional[str] = None) -> int:
-        cur = self.db.execute(
-            "INSERT INTO students (name, roll_no, department, contact, address) VALUES (?,?,?,?,?)",
-            (name, roll_no, department, contact, address)
-        )
-        student_id = cur.lastrowid
-        if username and password:
-            # store hashed password using helper
-            self.db.create_user(username, password, 'student', student_id)
+        # hash before taking the write lock so other writers never wait on PBKDF2
+        password_hash = self.db._hash_password(password) if username and password else None
+        with self.transaction():
+            cur = self.db.execute(
+                "INSERT INTO students (name, roll_no, department, contact, address) VALUES (?,?,?,?,?)",
+                (name, roll_no, department, contact, address)
+            )
+            student_id = cur.lastrowid
+            if password_hash:
+                self.db.insert_users([(username, password_hash, 'student', student_id)])
+        self._tables_changed("students")
         return student_id
 
-    def get_student(self, student_id: int) -> Optional[Dict]:
+    def bulk_add_students(self, students: List[Dict]) -> List[int]:
+        """Insert many validated students in one transaction.
+
+        Each dict holds the students columns plus optional ``username`` and
+        ``password_hash`` (already hashed, see erp.auth.hash_password). Ids are
+        assigned up front under the write lock so both tables can be filled
+        with executemany. Returns the new student ids in input order.
+        """
+        if not students:
+            return []
+        with self.transaction(immediate=True):
+            start = self.db.query("SELECT IFNULL(MAX(id), 0) AS m FROM students")[0]["m"] + 1
+            ids = list(range(start, start + len(students)))
+            self.db.executemany(
+                "INSERT INTO students (id, name, roll_no, department, contact, address) VALUES (?,?,?,?,?,?)",
+                [(sid, s["name"], s.get("roll_no"), s.get("department"), s.get("contact"), s.get("address"))
+                 for sid, s in zip(ids, students)])
+            self.db.insert_users([(s["username"], s["password_hash"], 'student', sid)
+                                  for sid, s in zip(ids, students) if s.get("username") and s.get("password_hash")])
+        self._tables_changed("students")
+        return ids
+
+    def import_students(self, rows: Iterable[Dict], **options):
+        """Stream rows into the students table; see erp.importer.import_students."""
+        from .importer import import_students
+        return import_students(self, rows, **options)
+
+    def get_student(self, student_id: int) -> Optional[Record]:
+        # records are immutable, so the cached row can be shared with callers
+        cached = self.student_cache.get(student_id)
+        if cached is not None:
+            return cached
+        generation = self._student_generation
         rows = self.db.query("SELECT * FROM students WHERE id=?", (student_id,))
         if not rows:
             return None
-        r = rows[0]
-        return dict(r)
+        if generation == self._student_generation:
+            self.student_cache.set(student_id, rows[0])
+        return rows[0]
 
     def update_student(self, student_id: int, **fields) -> bool:
         if not fields:
@@ -34,41 +296,88 @@ class ERPManager:
         keys = ",".join(f"{k}=?" for k in fields.keys())
         params = tuple(fields.values()) + (student_id,)
         self.db.execute(f"UPDATE students SET {keys} WHERE id=?", params)
+        self._student_changed(student_id)
+        self._tables_changed("students")
         return True
 
     def delete_student(self, student_id: int) -> bool:
-        self.db.execute("DELETE FROM users WHERE student_id=?", (student_id,))
-        self.db.execute("DELETE FROM students WHERE id=?", (student_id,))
+        with self.transaction():
+            self.db.execute("DELETE FROM users WHERE student_id=?", (student_id,))
+            self.db.execute("DELETE FROM students WHERE id=?", (student_id,))
+        self._student_changed(student_id)
+        self._tables_changed("students")
         return True
 
-    def list_students(self) -> List[Dict]:
-        rows = self.db.query("SELECT * FROM students")
-        return [dict(r) for r in rows]
+
+    def _keyset_page(self, select_sql: str, table: str, alias: str, sort: str, after: Optional[Tuple],
+                     limit: Optional[int], descending: bool = False) -> List[Record]:
+        sql, params = self._keyset_sql(select_sql, table, alias, sort, after, limit, descending)
+        return self.db.query(sql, params)
+
+    def _keyset_sql(self, select_sql: str, table: str, alias: str, sort: str, after: Optional[Tuple],
+                    limit: Optional[int], descending: bool = False) -> Tuple[str, Tuple]:
+        """Order ``select_sql`` by a SORT_KEYS entry, starting after the cursor ``after``.
+
+        ``after`` holds the previous page's last sort values (see keyset_cursor),
+        so deleting that row between pages does not lose the position. A bare
+        id is accepted for single-column sorts.
+        """
+        columns = _sort_columns(table, sort)
+        outer = [f"IFNULL({alias}.{c}, '')" if c in NULLABLE_SORT_COLUMNS else f"{alias}.{c}" for c in columns]
+        cmp = "<" if descending else ">"
+        params: List = []
+        if after is not None:
+            after = tuple(after) if isinstance(after, (tuple, list)) else (after,)
+            if len(after) != len(columns):
+                raise ValueError(f"Cursor does not match sort key: {sort}")
+            if len(columns) == 1:
+                select_sql += f" WHERE {outer[0]} {cmp} ?"
+            else:
+                marks = ", ".join("?" for _ in columns)
+                select_sql += f" WHERE ({', '.join(outer)}) {cmp} ({marks})"
+            params.extend(after)
+        direction = "DESC" if descending else "ASC"
+        select_sql += " ORDER BY " + ", ".join(f"{k} {direction}" for k in outer)
+        if limit is not None:
+            select_sql += " LIMIT ?"
+            params.append(limit)
+        return select_sql, tuple(params)
+
+    def list_students(self, after: Optional[Tuple] = None, limit: Optional[int] = None, sort: str = 'id') -> List[Record]:
+        """Students ordered by ``sort`` ('id', 'name' or 'roll_no'); page with after/limit."""
+        return self._keyset_page("SELECT s.* FROM students s", "students", "s", sort, after, limit)
+
+    def iter_students(self, sort: str = 'id', chunk_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Record]:
+        """Stream every student in ``sort`` order without loading the table."""
+        sql, params = self._keyset_sql("SELECT s.* FROM students s", "students", "s", sort, None, None)
+        return self.db.iter_query(sql, params, chunk_size)
 
     # -- Hostel management --
     def add_room(self, block: str, room_no: str, capacity: int = 1) -> int:
         cur = self.db.execute("INSERT INTO hostel_rooms (block,room_no,capacity) VALUES (?,?,?)",
                               (block, room_no, capacity))
+        self._tables_changed("hostel_rooms")
         return cur.lastrowid
 
-    def list_rooms(self) -> List[Dict]:
-        rows = self.db.query("SELECT * FROM hostel_rooms")
-        return [dict(r) for r in rows]
+    def list_rooms(self, after: Optional[Tuple] = None, limit: Optional[int] = None, sort: str = 'id') -> List[Record]:
+        return self._keyset_page("SELECT r.* FROM hostel_rooms r", "hostel_rooms", "r", sort, after, limit)
 
     def allocate_room(self, student_id: int, room_id: int, checkin_date: Optional[str] = None) -> int:
-        # enforce capacity: check current occupants
-        rows = self.db.query("SELECT capacity FROM hostel_rooms WHERE id=?", (room_id,))
-        if not rows:
-            raise ValueError("Room not found")
-        capacity = rows[0]["capacity"]
-        occ = self.db.query("SELECT COUNT(1) as c FROM hostel_allocations WHERE room_id=? AND checkout_date IS NULL", (room_id,))
-        occupants = occ[0]["c"] if occ else 0
-        if occupants >= capacity:
-            raise ValueError("Room is full")
         if checkin_date is None:
             checkin_date = datetime.date.today().isoformat()
-        cur = self.db.execute("INSERT INTO hostel_allocations (student_id,room_id,checkin_date) VALUES (?,?,?)",
-                              (student_id, room_id, checkin_date))
+        # enforce capacity in the INSERT itself: hostel_rooms.occupants is kept
+        # current by triggers, so two admins cannot both take the last bed
+        with self.transaction(immediate=True):
+            cur = self.db.execute(
+                "INSERT INTO hostel_allocations (student_id,room_id,checkin_date) "
+                "SELECT ?, id, ? FROM hostel_rooms WHERE id=? AND occupants < capacity",
+                (student_id, checkin_date, room_id))
+            if cur.rowcount == 0:
+                if not self.db.query("SELECT id FROM hostel_rooms WHERE id=?", (room_id,)):
+                    raise ValueError("Room not found")
+                raise ValueError("Room is full")
+        self._student_changed(student_id)
+        self._tables_changed("hostel_allocations")
         return cur.lastrowid
 
     def authenticate_user(self, username: str, password: str, role: Optional[str] = None) -> Optional[Dict]:
@@ -80,7 +389,12 @@ class ERPManager:
     def checkout_student(self, allocation_id: int, checkout_date: Optional[str] = None) -> bool:
         if checkout_date is None:
             checkout_date = datetime.date.today().isoformat()
-        self.db.execute("UPDATE hostel_allocations SET checkout_date=? WHERE id=?", (checkout_date, allocation_id))
+        rows = self.db.query("SELECT student_id FROM hostel_allocations WHERE id=?", (allocation_id,))
+        self.db.execute("UPDATE hostel_allocations SET checkout_date=? WHERE id=? AND checkout_date IS NULL",
+                        (checkout_date, allocation_id))
+        if rows:
+            self._student_changed(rows[0]["student_id"])
+        self._tables_changed("hostel_allocations")
         return True
 
     def record_hostel_payment(self, student_id: int, amount: float, date: Optional[str] = None) -> int:
@@ -89,37 +403,44 @@ class ERPManager:
         receipt_no = f"H-{int(datetime.datetime.now().timestamp())}-{student_id}"
         cur = self.db.execute("INSERT INTO hostel_payments (student_id,amount,date,receipt_no) VALUES (?,?,?,?)",
                               (student_id, amount, date, receipt_no))
+        self._student_changed(student_id)
         return cur.lastrowid
 
     def hostel_payments_for_student(self, student_id: int):
         rows = self.db.query("SELECT * FROM hostel_payments WHERE student_id=?", (student_id,))
-        return [dict(r) for r in rows]
+        return rows
+
+    def hostel_occupancy_report(self) -> List[Record]:
+        # occupants is maintained by triggers on hostel_allocations
+        return self._cached_report("hostel_occupancy", lambda: self.db.query(OCCUPANCY_SQL))
 
-    def hostel_occupancy_report(self):
-        rows = self.db.query("SELECT r.id as room_id, r.block, r.room_no, r.capacity, COUNT(a.id) as occupants "
-                             "FROM hostel_rooms r LEFT JOIN hostel_allocations a ON r.id=a.room_id AND a.checkout_date IS NULL "
-                             "GROUP BY r.id")
-        return [dict(r) for r in rows]
+    def iter_occupancy_report(self, chunk_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Record]:
+        return self.db.iter_query(OCCUPANCY_SQL, (), chunk_size)
 
-    def vacant_rooms_report(self):
-        rows = self.db.query("SELECT r.*, (r.capacity - IFNULL(t.occupants,0)) as vacant FROM hostel_rooms r "
-                             "LEFT JOIN (SELECT room_id, COUNT(id) as occupants FROM hostel_allocations WHERE checkout_date IS NULL GROUP BY room_id) t "
-                             "ON r.id=t.room_id WHERE (r.capacity - IFNULL(t.occupants,0)) > 0")
-        return [dict(r) for r in rows]
+    def vacant_rooms_report(self) -> List[Record]:
+        return self._cached_report("vacant_rooms", lambda: self.db.query(VACANT_ROOMS_SQL))
+
+    def iter_vacant_rooms(self, chunk_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Record]:
+        return self.db.iter_query(VACANT_ROOMS_SQL, (), chunk_size)
 
     # -- Transport management --
-    def register_driver(self, name: str, license_no: Optional[str] = None) -> int:
+    def register_driver(self, name: str, license_no: Optional[str] = None, contact: Optional[str] = None) -> int:
         # validate unique license_no if provided
         if license_no:
             exists = self.db.query("SELECT id FROM drivers WHERE license_no=?", (license_no,))
             if exists:
                 raise ValueError("License number already exists")
-        cur = self.db.execute("INSERT INTO drivers (name,license_no) VALUES (?,?)", (name, license_no))
+        cur = self.db.execute("INSERT INTO drivers (name,license_no,contact) VALUES (?,?,?)", (name, license_no, contact))
         return cur.lastrowid
 
-    def list_drivers(self) -> List[Dict]:
-        rows = self.db.query("SELECT * FROM drivers")
-        return [dict(r) for r in rows]
+    def list_drivers(self, after: Optional[Tuple] = None, limit: Optional[int] = None, sort: str = 'id') -> List[Record]:
+        return self._keyset_page("SELECT d.* FROM drivers d", "drivers", "d", sort, after, limit)
+
+    def get_driver(self, driver_id: int) -> Optional[Record]:
+        rows = self.db.query("SELECT * FROM drivers WHERE id=?", (driver_id,))
+        if not rows:
+            return None
+        return rows[0]
 
     def update_driver(self, driver_id: int, **fields) -> bool:
         if not fields:
@@ -136,8 +457,9 @@ class ERPManager:
 
     def delete_driver(self, driver_id: int) -> bool:
         # unset driver from buses, then delete
-        self.db.execute("UPDATE buses SET driver_id=NULL WHERE driver_id=?", (driver_id,))
-        self.db.execute("DELETE FROM drivers WHERE id=?", (driver_id,))
+        with self.transaction():
+            self.db.execute("UPDATE buses SET driver_id=NULL WHERE driver_id=?", (driver_id,))
+            self.db.execute("DELETE FROM drivers WHERE id=?", (driver_id,))
         return True
 
     def register_bus(self, registration: str, capacity: int = 20, driver_id: Optional[int] = None) -> int:
@@ -147,11 +469,19 @@ class ERPManager:
             raise ValueError("Bus registration already exists")
         cur = self.db.execute("INSERT INTO buses (registration,capacity,driver_id) VALUES (?,?,?)",
                               (registration, capacity, driver_id))
+        self._tables_changed("buses")
         return cur.lastrowid
 
-    def list_buses(self) -> List[Dict]:
-        rows = self.db.query("SELECT b.*, d.name as driver_name, d.license_no FROM buses b LEFT JOIN drivers d ON b.driver_id=d.id")
-        return [dict(r) for r in rows]
+    def list_buses(self, after: Optional[Tuple] = None, limit: Optional[int] = None, sort: str = 'id') -> List[Record]:
+        return self._keyset_page("SELECT b.*, d.name as driver_name, d.license_no FROM buses b "
+                                 "LEFT JOIN drivers d ON b.driver_id=d.id", "buses", "b", sort, after, limit)
+
+    def get_bus(self, bus_id: int) -> Optional[Record]:
+        rows = self.db.query("SELECT b.*, d.name as driver_name, d.license_no FROM buses b "
+                             "LEFT JOIN drivers d ON b.driver_id=d.id WHERE b.id=?", (bus_id,))
+        if not rows:
+            return None
+        return rows[0]
 
     def update_bus(self, bus_id: int, **fields) -> bool:
         if not fields:
@@ -164,19 +494,41 @@ class ERPManager:
         keys = ",".join(f"{k}=?" for k in fields.keys())
         params = tuple(fields.values()) + (bus_id,)
         self.db.execute(f"UPDATE buses SET {keys} WHERE id=?", params)
+        self._tables_changed("buses")
         return True
 
     def delete_bus(self, bus_id: int) -> bool:
         # unset bus from routes, then delete
-        self.db.execute("UPDATE routes SET bus_id=NULL WHERE bus_id=?", (bus_id,))
-        self.db.execute("DELETE FROM buses WHERE id=?", (bus_id,))
+        with self.transaction():
+            self.db.execute("UPDATE routes SET bus_id=NULL WHERE bus_id=?", (bus_id,))
+            self.db.execute("DELETE FROM buses WHERE id=?", (bus_id,))
+        self._tables_changed("buses", "routes")
         return True
 
     def register_route(self, name: str, pickup_location: str, bus_id: Optional[int] = None, fee: float = 0.0) -> int:
         cur = self.db.execute("INSERT INTO routes (name,pickup_location,bus_id,fee) VALUES (?,?,?,?)",
                               (name, pickup_location, bus_id, fee))
+        self._tables_changed("routes")
         return cur.lastrowid
 
+    def get_route(self, route_id: int) -> Optional[Record]:
+        rows = self.db.query("SELECT r.*, b.registration as bus_reg FROM routes r "
+                             "LEFT JOIN buses b ON r.bus_id=b.id WHERE r.id=?", (route_id,))
+        if not rows:
+            return None
+        return rows[0]
+
+    def update_route(self, route_id: int, **fields) -> bool:
+        if not fields:
+            return False
+        keys = ",".join(f"{k}=?" for k in fields.keys())
+        params = tuple(fields.values()) + (route_id,)
+        self.db.execute(f"UPDATE routes SET {keys} WHERE id=?", params)
+        # route name/pickup/fee appear in every rider's profile
+        self._profiles_changed()
+        self._tables_changed("routes")
+        return True
+
     def assign_student_to_route(self, student_id: int, route_id: int) -> int:
         # Prevent duplicate active transport allocation for same student and route
         exists = self.db.query(
@@ -188,6 +540,8 @@ class ERPManager:
 
         cur = self.db.execute("INSERT INTO transport_allocations (student_id,route_id,active) VALUES (?,?,?)",
                               (student_id, route_id, 1))
+        self._student_changed(student_id)
+        self._tables_changed("transport_allocations")
         return cur.lastrowid
 
     def record_transport_payment(self, student_id: int, amount: float, date: Optional[str] = None) -> int:
@@ -196,61 +550,300 @@ class ERPManager:
         receipt_no = f"T-{int(datetime.datetime.now().timestamp())}-{student_id}"
         cur = self.db.execute("INSERT INTO transport_payments (student_id,amount,date,receipt_no) VALUES (?,?,?,?)",
                               (student_id, amount, date, receipt_no))
+        self._student_changed(student_id)
+        self._tables_changed("transport_payments")
         return cur.lastrowid
 
     def mark_bus_attendance(self, student_id: int, route_id: int, date: Optional[str] = None, present: int = 1) -> int:
-        if date is None:
-            date = datetime.date.today().isoformat()
-        cur = self.db.execute("INSERT INTO bus_attendance (student_id,route_id,date,present) VALUES (?,?,?,?)",
-                              (student_id, route_id, date, present))
-        return cur.lastrowid
+        """Mark one rider; marking the same day again replaces the mark. Returns the row id."""
+        date = _attendance_day(date)
+        with self.transaction():
+            self.record_attendance(route_id, date, [(student_id, present)])
+            return self.db.query("SELECT id FROM bus_attendance WHERE student_id=? AND route_id=? AND date=?",
+                                 (student_id, route_id, date))[0][0]
+
+    def attendance_roster(self, route_id: int, date: Optional[str] = None) -> List[Record]:
+        """Active riders of a route with their mark for ``date`` (present is None if unmarked)."""
+        date = _attendance_day(date)
+        return self.db.query(
+            "SELECT t.student_id, s.name AS student_name, s.roll_no, s.department, a.present "
+            "FROM transport_allocations t LEFT JOIN students s ON t.student_id=s.id "
+            "LEFT JOIN bus_attendance a ON a.student_id=t.student_id AND a.route_id=t.route_id AND a.date=? "
+            "WHERE t.route_id=? AND t.active=1 ORDER BY s.name, t.student_id", (date, route_id))
+
+    def record_attendance(self, route_id: int, date: str, marks: Iterable[Tuple[int, int]]) -> int:
+        """Write a whole roster of (student_id, present) marks in one transaction.
+
+        Only the route's active riders can be marked; anyone else raises
+        ValueError and nothing is written. Re-submitting a day overwrites the
+        earlier marks. ``date`` is stored as
+        a plain ISO day so it matches the attendance_bitmaps day bit. Returns
+        the number of marks written.
+        """
+        date = _attendance_day(date)
+        rows = [(int(student_id), route_id, date, 1 if present else 0) for student_id, present in marks]
+        if not rows:
+            return 0
+        with self.transaction():
+            riders = {r[0] for r in self.db.query(
+                "SELECT student_id FROM transport_allocations WHERE route_id=? AND active=1", (route_id,))}
+            strangers = sorted({r[0] for r in rows} - riders)
+            if strangers:
+                raise ValueError(f"Not active riders of route {route_id}: {', '.join(map(str, strangers))}")
+            self.db.executemany(ATTENDANCE_UPSERT_SQL, rows)
+        return len(rows)
+
+    def attendance_summary(self, route_id: int, date_from: str, date_to: str,
+                           student_id: Optional[int] = None) -> Dict:
+        """Attendance percentages for a route between two ISO dates, inclusive.
+
+        Reads the monthly attendance_bitmaps (one row per rider and month)
+        and popcounts the days in range instead of scanning bus_attendance.
+        Returns route totals plus one entry per student; ``percent`` is None
+        when nothing was marked.
+        """
+        start = datetime.date.fromisoformat(date_from)
+        end = datetime.date.fromisoformat(date_to)
+        first, last = start.strftime("%Y-%m"), end.strftime("%Y-%m")
+        sql = ("SELECT b.student_id, s.name AS student_name, s.roll_no, b.month, b.present_bits, b.marked_bits "
+               "FROM attendance_bitmaps b LEFT JOIN students s ON b.student_id=s.id "
+               "WHERE b.route_id=? AND b.month BETWEEN ? AND ?")
+        params: List = [route_id, first, last]
+        if student_id is not None:
+            sql += " AND b.student_id=?"
+            params.append(student_id)
+
+        students: Dict[int, Dict] = {}
+        for r in self.db.query(sql, tuple(params)):
+            # days of this month inside [start, end] as a bit mask
+            lo = start.day if r["month"] == first else 1
+            hi = end.day if r["month"] == last else 31
+            mask = ((1 << hi) - 1) & ~((1 << (lo - 1)) - 1)
+            entry = students.setdefault(r["student_id"], {
+                "student_id": r["student_id"], "student_name": r["student_name"], "roll_no": r["roll_no"],
+                "marked": 0, "present": 0})
+            entry["marked"] += _popcount(r["marked_bits"] & mask)
+            entry["present"] += _popcount(r["present_bits"] & mask)
+
+        rows = sorted(students.values(), key=lambda e: (e["student_name"] or "", e["student_id"]))
+        for e in rows:
+            e["percent"] = _percent(e["present"], e["marked"])
+        marked = sum(e["marked"] for e in rows)
+        present = sum(e["present"] for e in rows)
+        return {"route_id": route_id, "date_from": start.isoformat(), "date_to": end.isoformat(),
+                "marked": marked, "present": present, "percent": _percent(present, marked), "students": rows}
+
+    def iter_payments(self, kind: str = 'transport', student_id: Optional[int] = None,
+                      date_from: Optional[str] = None, date_to: Optional[str] = None,
+                      chunk_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Record]:
+        """Stream hostel or transport payments (with student name/roll) in id order."""
+        table = PAYMENT_TABLES.get(kind)
+        if table is None:
+            raise ValueError(f"Unknown payment kind: {kind}")
+        where, params = _date_filters("p.date", date_from, date_to)
+        if student_id is not None:
+            where.append("p.student_id=?")
+            params.append(student_id)
+        sql = (f"SELECT p.*, s.name AS student_name, s.roll_no FROM {table} p "
+               f"LEFT JOIN students s ON p.student_id=s.id WHERE {' AND '.join(where)} ORDER BY p.id")
+        return self.db.iter_query(sql, tuple(params), chunk_size)
+
+    def iter_attendance(self, route_id: Optional[int] = None, date_from: Optional[str] = None,
+                        date_to: Optional[str] = None, chunk_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Record]:
+        """Stream bus attendance marks ordered by date, optionally for one route."""
+        where, params = _date_filters("a.date", date_from, date_to)
+        if route_id is not None:
+            where.append("a.route_id=?")
+            params.append(route_id)
+        sql = ("SELECT a.*, s.name AS student_name, s.roll_no FROM bus_attendance a "
+               f"LEFT JOIN students s ON a.student_id=s.id WHERE {' AND '.join(where)} ORDER BY a.date, a.id")
+        return self.db.iter_query(sql, tuple(params), chunk_size)
+
+    def iter_route_riders(self, route_id: Optional[int] = None, active_only: bool = True,
+                          chunk_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Record]:
+        """Stream one row per rider (student on a route), grouped by route."""
+        where, params = ["1=1"], []
+        if route_id is not None:
+            where.append("t.route_id=?")
+            params.append(route_id)
+        if active_only:
+            where.append("t.active=1")
+        sql = ("SELECT t.route_id, r.name AS route_name, r.pickup_location, t.student_id, "
+               "s.name AS student_name, s.roll_no, s.department, s.contact, t.active "
+               "FROM transport_allocations t JOIN routes r ON t.route_id=r.id "
+               "LEFT JOIN students s ON t.student_id=s.id "
+               f"WHERE {' AND '.join(where)} ORDER BY t.route_id, t.id")
+        return self.db.iter_query(sql, tuple(params), chunk_size)
+
+    def active_routes_report(self) -> List[Record]:
+        # riders is maintained by triggers on transport_allocations
+        return self._cached_report("active_routes", lambda: self.db.query(
+            "SELECT r.*, b.registration as bus_reg FROM routes r LEFT JOIN buses b ON r.bus_id=b.id"))
+
+    def transport_fee_report(self, route_id: Optional[int] = None, department: Optional[str] = None,
+                             after_id: Optional[int] = None, limit: Optional[int] = None) -> List[Record]:
+        """Fee ledger: one row per transport allocation with fee, paid and outstanding.
+
+        A student's transport payments are totalled once and applied to their
+        allocations in allocation order, so ``paid`` never double counts an
+        installment across routes. Filter by ``route_id``/``department`` and
+        page with ``after_id`` (last allocation_id seen) and ``limit``.
+        """
+        sql, params = self._fee_report_sql(route_id, department, after_id, limit)
+        return self._cached_report("transport_fee", lambda: self.db.query(sql, params),
+                                   route_id, department, after_id, limit)
+
+    def iter_transport_fee_report(self, route_id: Optional[int] = None, department: Optional[str] = None,
+                                  chunk_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Record]:
+        """Stream the whole fee ledger; same rows as ``transport_fee_report``."""
+        sql, params = self._fee_report_sql(route_id, department, None, None)
+        return self.db.iter_query(sql, params, chunk_size)
+
+    def _fee_report_sql(self, route_id: Optional[int], department: Optional[str],
+                        after_id: Optional[int], limit: Optional[int]) -> Tuple[str, Tuple]:
+        where = ["1=1"]
+        params: List = []
+        if route_id is not None:
+            where.append("t.route_id=?")
+            params.append(route_id)
+        if department is not None:
+            where.append("s.department=?")
+            params.append(department)
+        if after_id is not None:
+            where.append("t.id>?")
+            params.append(after_id)
+        sql = ("SELECT allocation_id, student_id, student_name, department, route_id, route_name, active, fee, "
+               "student_paid, MIN(fee, MAX(0, student_paid - fee_before)) AS paid, "
+               "fee - MIN(fee, MAX(0, student_paid - fee_before)) AS outstanding FROM ("
+               "SELECT t.id AS allocation_id, t.student_id, s.name AS student_name, s.department, t.route_id, "
+               "r.name AS route_name, t.active, IFNULL(r.fee, 0) AS fee, "
+               "(SELECT IFNULL(SUM(amount), 0) FROM transport_payments WHERE student_id=t.student_id) AS student_paid, "
+               # fees of this student's earlier allocations absorb payments first
+               "(SELECT IFNULL(SUM(r2.fee), 0) FROM transport_allocations t2 JOIN routes r2 ON t2.route_id=r2.id "
+               "WHERE t2.student_id=t.student_id AND t2.id<t.id) AS fee_before "
+               "FROM transport_allocations t "
+               "LEFT JOIN students s ON t.student_id=s.id "
+               "LEFT JOIN routes r ON t.route_id=r.id "
+               f"WHERE {' AND '.join(where)} ORDER BY t.id")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        sql += ")"
+        return sql, tuple(params)
+
+    # -- Search --
+    def search(self, query: str, kind: str = "students", limit: int = SEARCH_PAGE_SIZE,
+               offset: int = 0) -> List[Record]:
+        """Full-text search one of SEARCH_KINDS, best matches first.
+
+        Every whitespace-separated term must match (the last one as a prefix).
+        Uses the FTS5 indexes from migration 7, or LIKE scans ordered by
+        newest first when SQLite was built without FTS5.
+        """
+        if kind not in SEARCH_KINDS:
+            raise ValueError(f"Unknown search kind: {kind}")
+        terms = _search_terms(query)
+        if not terms:
+            return []
+        table, select_sql, alias = SEARCH_KINDS[kind]
+        fts = f"{table}_fts"
+        if fts in self._fts_tables():
+            sql = (f"{select_sql} JOIN {fts} ON {fts}.rowid={alias}.id "
+                   f"WHERE {fts} MATCH ? ORDER BY {fts}.rank LIMIT ? OFFSET ?")
+            return self.db.query(sql, (_fts_query(terms), limit, offset))
+        where, params = [], []
+        for term in terms:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where.append("(" + " OR ".join(f"{alias}.{c} LIKE ? ESCAPE '\\'" for c in FTS_COLUMNS[table]) + ")")
+            params.extend([pattern] * len(FTS_COLUMNS[table]))
+        sql = f"{select_sql} WHERE {' AND '.join(where)} ORDER BY {alias}.id DESC LIMIT ? OFFSET ?"
+        return self.db.query(sql, tuple(params) + (limit, offset))
+
+    def _fts_tables(self) -> frozenset:
+        """FTS5 tables created by migration 7; looked up once, not per search."""
+        if self._fts is None:
+            names = [f"{table}_fts" for table in FTS_COLUMNS]
+            marks = ",".join("?" for _ in names)
+            self._fts = frozenset(r[0] for r in self.db.query(
+                f"SELECT name FROM sqlite_master WHERE type='table' AND name IN ({marks})", tuple(names)))
+        return self._fts
 
-    def active_routes_report(self):
-        rows = self.db.query("SELECT r.*, b.registration as bus_reg, COUNT(ta.id) as riders "
-                             "FROM routes r LEFT JOIN buses b ON r.bus_id=b.id "
-                             "LEFT JOIN transport_allocations ta ON r.id=ta.route_id AND ta.active=1 "
-                             "GROUP BY r.id")
-        return [dict(r) for r in rows]
-
-    def transport_fee_report(self):
-        rows = self.db.query("SELECT t.id as allocation_id, s.name as student_name, r.name as route_name, r.fee, tp.amount as paid "
-                             "FROM transport_allocations t "
-                             "LEFT JOIN students s ON t.student_id=s.id "
-                             "LEFT JOIN routes r ON t.route_id=r.id "
-                             "LEFT JOIN transport_payments tp ON tp.student_id=s.id")
-        return [dict(r) for r in rows]
+    # -- Denormalized counters --
+    def check_counters(self) -> List[Dict]:
+        """Compare trigger-maintained counters and attendance bitmaps with a recount; returns the mismatches."""
+        problems = []
+        for table, column, recount in COUNTER_CHECKS:
+            rows = self.db.query(f"SELECT id, {column} AS stored, ({recount}) AS actual FROM {table} "
+                                 f"WHERE {column} <> ({recount})")
+            problems.extend({"table": table, "column": column, **dict(r)} for r in rows)
+        for r in self.db.query(BITMAP_MISMATCH_SQL):
+            key = f"{r['route_id']}/{r['month']}/{r['student_id']}"
+            for column, stored, actual in (("present_bits", r["stored_present"], r["actual_present"]),
+                                           ("marked_bits", r["stored_marked"], r["actual_marked"])):
+                if stored != actual:
+                    problems.append({"table": "attendance_bitmaps", "column": column, "id": key,
+                                     "stored": stored, "actual": actual})
+        return problems
+
+    def rebuild_counters(self) -> int:
+        """Recount every counter and rebuild drifted attendance bitmaps; returns rows corrected."""
+        fixed = 0
+        with self.transaction(immediate=True):
+            for table, column, recount in COUNTER_CHECKS:
+                cur = self.db.execute(f"UPDATE {table} SET {column}=({recount}) WHERE {column} <> ({recount})")
+                fixed += cur.rowcount
+            drifted = len(self.db.query(BITMAP_MISMATCH_SQL))
+            if drifted:
+                self.db.execute("DELETE FROM attendance_bitmaps")
+                self.db.execute("INSERT INTO attendance_bitmaps (route_id, month, student_id, present_bits, "
+                                f"marked_bits) {ATTENDANCE_BITMAP_SQL}")
+                fixed += drifted
+        self._tables_changed(*(table for table, _column, _recount in COUNTER_CHECKS))
+        return fixed
 
     # -- Integration --
     def get_student_profile(self, student_id: int) -> Dict:
-        s = self.get_student(student_id)
-        if not s:
+        """Student record plus allocations, payments and fee totals.
+
+        Built by a single query and cached per student; payment, allocation
+        and checkout writes made through the manager invalidate the entry.
+        """
+        profile = self.profile_cache.get(student_id)
+        if profile is None:
+            generation = self._student_generation
+            profile = self._load_student_profile(student_id)
+            if not profile:
+                return {}
+            if generation == self._student_generation:
+                self.profile_cache.set(student_id, profile)
+        return dict(profile)
+
+    def _load_student_profile(self, student_id: int) -> Dict:
+        rows = self.db.query(PROFILE_SQL, (student_id,))
+        if not rows:
             return {}
-        # hostel allocation
-        allocs = self.db.query("SELECT a.*, r.block, r.room_no FROM hostel_allocations a JOIN hostel_rooms r ON a.room_id=r.id WHERE a.student_id=? ORDER BY a.id DESC", (student_id,))
-        transports = self.db.query("SELECT t.*, r.name as route_name, r.pickup_location, r.fee FROM transport_allocations t JOIN routes r ON t.route_id=r.id WHERE t.student_id=?", (student_id,))
-        hostel_payments = self.db.query("SELECT * FROM hostel_payments WHERE student_id=?", (student_id,))
-        transport_payments = self.db.query("SELECT * FROM transport_payments WHERE student_id=?", (student_id,))
-
-        total_hostel_paid = sum(p["amount"] for p in hostel_payments)
-        total_transport_paid = sum(p["amount"] for p in transport_payments)
-
-        # dues: simple: latest route fee if any minus paid
-        route_fee = 0.0
-        for t in transports:
-            route_fee += t["fee"]
-
-        profile = {
-            "student": s,
-            "hostel_allocations": [dict(r) for r in allocs],
-            "transport_allocations": [dict(r) for r in transports],
-            "hostel_payments": [dict(r) for r in hostel_payments],
-            "transport_payments": [dict(r) for r in transport_payments],
-            "total_hostel_paid": total_hostel_paid,
-            "total_transport_paid": total_transport_paid,
+        row = dict(rows[0])
+        agg = {k[1:]: row.pop(k) for k in list(row) if k.startswith("_")}
+        allocs = sorted(json.loads(agg["hostel_allocations"]), key=lambda a: a["id"], reverse=True)
+        transports = sorted(json.loads(agg["transport_allocations"]), key=lambda t: t["id"])
+        route_fee = agg["total_route_fee"]
+        return {
+            "student": row,
+            "hostel_allocations": allocs,
+            "transport_allocations": transports,
+            "hostel_payments": sorted(json.loads(agg["hostel_payments"]), key=lambda p: p["id"]),
+            "transport_payments": sorted(json.loads(agg["transport_payments"]), key=lambda p: p["id"]),
+            "total_hostel_paid": agg["total_hostel_paid"],
+            "total_transport_paid": agg["total_transport_paid"],
             "total_route_fee": route_fee,
-            "total_dues": max(0.0, route_fee - total_transport_paid)
+            # dues: simple: route fees minus transport payments
+            "total_dues": max(0.0, route_fee - agg["total_transport_paid"])
         }
-        return profile
+
+    def transaction(self, immediate: bool = False):
+        """Unit of work: ``with manager.transaction(): ...`` commits once at the end
+        and rolls everything back if the block raises. Blocks may be nested."""
+        return self.db.transaction(immediate=immediate)
 
     def close(self):
         self.db.close()
@@ -261,6 +854,7 @@ class ERPManager:
             # store full ISO datetime so detail views can show time-of-publication
             date = datetime.datetime.now().isoformat()
         cur = self.db.execute("INSERT INTO announcements (title,message,created,start_date,end_date,active) VALUES (?,?,?,?,?,?)", (title, message, date, None, None, active))
+        self.db.after_commit(self.announcement_feed.invalidate)
         return cur.lastrowid
 
     def list_announcements(self, only_active: Optional[bool] = True, student_id: Optional[int] = None, sort: str = 'desc', include_dismissed: bool = False) -> List[Dict]:
@@ -282,8 +876,8 @@ class ERPManager:
             where_clauses.append("active=0")
 
         # scheduling constraints: include only announcements valid today
-        where_clauses.append("(start_date IS NULL OR date(start_date) <= date(?))")
-        where_clauses.append("(end_date IS NULL OR date(end_date) >= date(?))")
+        where_clauses.append("(start_day IS NULL OR start_day <= ?)")
+        where_clauses.append("(end_day IS NULL OR end_day >= ?)")
         params.extend([today, today])
 
         where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
@@ -311,14 +905,39 @@ class ERPManager:
         else:
             sql = f"SELECT * FROM announcements WHERE {where_sql} ORDER BY created {order}"
             rows = self.db.query(sql, tuple(params))
-        # ensure all rows are plain dicts
-        return [dict(r) if not isinstance(r, dict) else r for r in rows]
+        return rows
 
-    def get_announcement(self, aid: int) -> Optional[Dict]:
+    def _load_visible_announcements(self, today: str) -> Tuple[List[Record], Optional[str]]:
+        """Active announcements visible on ``today`` and the next day that set changes."""
+        rows = self.db.query("SELECT * FROM announcements WHERE active=1 AND (start_day IS NULL OR start_day <= ?) "
+                             "AND (end_day IS NULL OR end_day >= ?) ORDER BY created DESC", (today, today))
+        # the set changes when a scheduled announcement starts or the day after one ends
+        boundary = self.db.query(
+            "SELECT MIN(day) FROM ("
+            "SELECT MIN(start_day) AS day FROM announcements WHERE active=1 AND start_day > ? "
+            "UNION ALL SELECT date(MIN(end_day), '+1 day') FROM announcements WHERE active=1 AND end_day >= ?)",
+            (today, today))[0][0]
+        return rows, boundary
+
+    def _load_dismissals(self, student_id: int) -> List[int]:
+        return [r[0] for r in self.db.query(
+            "SELECT announcement_id FROM dismissed_announcements WHERE student_id=?", (student_id,))]
+
+    def visible_announcements(self, student_id: Optional[int] = None) -> List[Record]:
+        """Announcements visible today, newest first, minus ``student_id``'s dismissals.
+
+        Same result as ``list_announcements(only_active=True, student_id=...)``
+        but served from the in-memory AnnouncementFeed.
+        """
+        if student_id is None:
+            return list(self.announcement_feed.visible())
+        return self.announcement_feed.for_student(student_id)
+
+    def get_announcement(self, aid: int) -> Optional[Record]:
         rows = self.db.query("SELECT * FROM announcements WHERE id=?", (aid,))
         if not rows:
             return None
-        return dict(rows[0])
+        return rows[0]
 
     def update_announcement(self, aid: int, **fields) -> bool:
         if not fields:
@@ -326,48 +945,155 @@ class ERPManager:
         keys = ",".join(f"{k}=?" for k in fields.keys())
         params = tuple(fields.values()) + (aid,)
         self.db.execute(f"UPDATE announcements SET {keys} WHERE id=?", params)
+        self.db.after_commit(self.announcement_feed.invalidate)
         return True
 
     def deactivate_announcement(self, aid: int) -> bool:
         self.db.execute("UPDATE announcements SET active=0 WHERE id=?", (aid,))
+        self.db.after_commit(self.announcement_feed.invalidate)
         return True
 
     def delete_announcement(self, aid: int) -> bool:
         # remove dismissals too
-        self.db.execute("DELETE FROM dismissed_announcements WHERE announcement_id=?", (aid,))
-        self.db.execute("DELETE FROM announcements WHERE id=?", (aid,))
+        with self.transaction():
+            self.db.execute("DELETE FROM dismissed_announcements WHERE announcement_id=?", (aid,))
+            self.db.execute("DELETE FROM announcements WHERE id=?", (aid,))
+        self.db.after_commit(lambda: self.announcement_feed.invalidate(dismissals=True))
         return True
 
     def record_dismissal(self, student_id: int, announcement_id: int, date: Optional[str] = None) -> int:
+        """Dismiss one announcement for a student; repeats keep the first dismissal. Returns its id."""
         if date is None:
             date = datetime.datetime.now().isoformat()
-        cur = self.db.execute("INSERT INTO dismissed_announcements (announcement_id,student_id,dismissed_at) VALUES (?,?,?)", (announcement_id, student_id, date))
-        return cur.lastrowid
+        with self.transaction():
+            cur = self.db.execute(DISMISS_SQL, (announcement_id, student_id, date))
+            if cur.rowcount:
+                dismissal_id = cur.lastrowid
+            else:
+                dismissal_id = self.db.query("SELECT id FROM dismissed_announcements WHERE announcement_id=? "
+                                             "AND student_id=?", (announcement_id, student_id))[0][0]
+        self.db.after_commit(lambda: self.announcement_feed.dismissed(student_id, announcement_id))
+        return dismissal_id
+
+    def dismiss_many(self, student_id: int, announcement_ids: Iterable[int], date: Optional[str] = None) -> int:
+        """Dismiss several announcements in one statement batch; returns how many were new."""
+        ids = sorted({int(a) for a in announcement_ids})
+        if not ids:
+            return 0
+        if date is None:
+            date = datetime.datetime.now().isoformat()
+        cur = self.db.executemany(DISMISS_SQL, [(aid, student_id, date) for aid in ids])
+        self.db.after_commit(lambda: self.announcement_feed.dismissed(student_id, *ids))
+        return cur.rowcount
+
+    def dismiss_all(self, student_id: int, date: Optional[str] = None) -> int:
+        """Dismiss every announcement currently on the student's dashboard."""
+        return self.dismiss_many(student_id, [a["id"] for a in self.visible_announcements(student_id)], date)
+
+    def compact_dismissals(self, retain_days: int = DISMISSAL_RETENTION_DAYS, today: Optional[str] = None) -> int:
+        """Purge dismissals of deleted announcements or students, and of
+        announcements whose end date passed more than ``retain_days`` ago.
+        Returns rows deleted."""
+        if today is None:
+            today = datetime.date.today().isoformat()
+        with self.transaction(immediate=True):
+            cur = self.db.execute(
+                "DELETE FROM dismissed_announcements WHERE "
+                "announcement_id NOT IN (SELECT id FROM announcements) "
+                "OR student_id NOT IN (SELECT id FROM students) "
+                "OR announcement_id IN (SELECT id FROM announcements WHERE end_day < date(?, ?))",
+                (today, f"-{int(retain_days)} days"))
+        if cur.rowcount:
+            self.db.after_commit(lambda: self.announcement_feed.invalidate(dismissals=True))
+        return cur.rowcount
 
     def record_contact_message(self, student_id: int, to_role: str, to_id: Optional[int], subject: str, message: str,
                                date: Optional[str] = None, sender_role: Optional[str] = None,
-                               sender_id: Optional[int] = None, parent_id: Optional[int] = None) -> int:
+                               sender_id: Optional[int] = None, parent_id: Optional[int] = None,
+                               category: Optional[str] = None) -> int:
         """Store a contact/help message.
 
         student_id: the student who is primarily involved (for inbox grouping)
         to_role/to_id: recipient role and optional id (e.g., 'admin' or 'driver')
         sender_role/sender_id: who sent this message (may be 'student' or 'admin')
         parent_id: optional parent message id for threading
+        category: one of MESSAGE_CATEGORIES; defaults to 'reply' for replies, else 'help'
         """
+        if category is None:
+            category = "reply" if parent_id is not None else "help"
+        if category not in MESSAGE_CATEGORIES:
+            raise ValueError(f"Unknown message category: {category}")
         if date is None:
             date = datetime.date.today().isoformat()
-        cur = self.db.execute(
-            "INSERT INTO contact_messages (student_id,to_role,to_id,subject,message,created,sender_role,sender_id,parent_id) VALUES (?,?,?,?,?,?,?,?,?)",
-            (student_id, to_role, to_id, subject, message, date, sender_role, sender_id, parent_id),
-        )
-        return cur.lastrowid
+        # the id is assigned up front under the write lock so a new thread's
+        # root can point at itself in the same INSERT
+        with self.transaction(immediate=True):
+            msg_id = self.db.query("SELECT IFNULL(MAX(id), 0) AS m FROM contact_messages")[0]["m"] + 1
+            root_id = msg_id
+            if parent_id is not None:
+                rows = self.db.query("SELECT thread_root_id FROM contact_messages WHERE id=?", (parent_id,))
+                if rows and rows[0]["thread_root_id"]:
+                    root_id = rows[0]["thread_root_id"]
+            self.db.execute(
+                "INSERT INTO contact_messages (id,student_id,to_role,to_id,subject,message,created,sender_role,sender_id,parent_id,thread_root_id,category) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                (msg_id, student_id, to_role, to_id, subject, message, date, sender_role, sender_id, parent_id, root_id, category),
+            )
+        return msg_id
+
+    def list_message_threads(self, student_id: int) -> List[Record]:
+        """Thread summaries for one student, most recently active first."""
+        return self.db.query("SELECT * FROM message_threads WHERE student_id=? "
+                             "ORDER BY last_activity DESC, id DESC", (student_id,))
+
+    def get_thread(self, msg_id: int, student_id: Optional[int] = None) -> Optional[Dict]:
+        """The thread containing ``msg_id``: its root message as a dict whose
+        ``children`` are the replies in order. ``student_id`` restricts the
+        lookup to that student's threads."""
+        sql = ("SELECT m.* FROM contact_messages m WHERE m.thread_root_id="
+               "(SELECT thread_root_id FROM contact_messages WHERE id=?")
+        params: List = [msg_id]
+        if student_id is not None:
+            sql += " AND student_id=?"
+            params.append(student_id)
+        rows = self.db.query(sql + ") ORDER BY m.id", tuple(params))
+        if not rows:
+            return None
+        root = dict(rows[0])
+        root["children"] = rows[1:]
+        return root
+
+    def mark_thread_read(self, root_id: int, recipient_role: Optional[str] = None,
+                         recipient_id: Optional[int] = None) -> int:
+        """Mark the unread messages of a thread read; returns how many changed.
+
+        With ``recipient_role`` only messages addressed to that inbox are
+        marked, so a student opening a thread does not clear the admin's badge.
+        """
+        sql = "UPDATE contact_messages SET is_read=1 WHERE thread_root_id=? AND is_read=0"
+        params: List = [root_id]
+        if recipient_role is not None:
+            sql += " AND to_role=? AND IFNULL(to_id, 0)=?"
+            params.extend([recipient_role, recipient_id or 0])
+        return self.db.execute(sql, tuple(params)).rowcount
+
+    def unread_count(self, recipient_role: str, recipient_id: Optional[int] = None,
+                     category: Optional[str] = None) -> int:
+        """Unread messages in an inbox, read from the trigger-maintained unread_counters."""
+        sql = "SELECT IFNULL(SUM(unread), 0) AS n FROM unread_counters WHERE recipient_role=? AND recipient_id=?"
+        params: List = [recipient_role, recipient_id or 0]
+        if category is not None:
+            sql += " AND category=?"
+            params.append(category)
+        return self.db.query(sql, tuple(params))[0]["n"]
 
-    def list_contact_messages(self, limit: int = 200):
-        rows = self.db.query("SELECT m.*, s.name as student_name FROM contact_messages m JOIN students s ON m.student_id=s.id ORDER BY m.created DESC LIMIT ?", (limit,))
-        return [dict(r) for r in rows]
+    def list_contact_messages(self, limit: Optional[int] = 200, after: Optional[Tuple] = None, sort: str = 'created'):
+        """Newest messages first; pass keyset_cursor() of the last one shown as ``after`` for the next page."""
+        return self._keyset_page("SELECT m.*, s.name as student_name FROM contact_messages m "
+                                 "JOIN students s ON m.student_id=s.id", "contact_messages", "m", sort,
+                                 after, limit, descending=True)
 
-    def get_contact_message(self, msg_id: int) -> Optional[Dict]:
+    def get_contact_message(self, msg_id: int) -> Optional[Record]:
         rows = self.db.query("SELECT m.*, s.name as student_name FROM contact_messages m JOIN students s ON m.student_id=s.id WHERE m.id=?", (msg_id,))
         if not rows:
             return None
-        return dict(rows[0])
+        return rows[0]
@@ -1,6 +1,92 @@
-from typing import Optional
+import functools
+import keyword
+import operator
+from typing import Dict, Optional, Tuple
+
+
+class Record(tuple):
+    """Read-only result row: a tuple that also answers by column name.
+
+    Each distinct column list gets its own subclass (see ``record_class``)
+    carrying the names, so a row costs one tuple instead of a sqlite3.Row
+    plus a dict. Supports ``r['name']``, ``r.name``, ``r.get()``,
+    ``keys()``/``items()``, and ``dict(r)`` when a mutable copy is needed.
+    """
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _index: Dict[str, int] = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def keys(self):
+        return list(self._fields)
+
+    def values(self):
+        return list(self)
+
+    def items(self):
+        return list(zip(self._fields, self))
+
+    def _asdict(self) -> Dict:
+        return dict(zip(self._fields, self))
+
+    def __reduce__(self):
+        return _rebuild_record, (self._fields, tuple(self))
+
+    def __repr__(self):
+        return "Record(" + ", ".join(f"{k}={v!r}" for k, v in zip(self._fields, self)) + ")"
+
+
+@functools.lru_cache(maxsize=256)
+def record_class(fields: Tuple[str, ...]) -> type:
+    # first occurrence of a repeated column name wins, as with sqlite3.Row
+    index: Dict[str, int] = {}
+    for i, name in enumerate(fields):
+        index.setdefault(name, i)
+    namespace = {"__slots__": (), "_fields": fields, "_index": index}
+    for name, i in index.items():
+        if name.isidentifier() and not keyword.iskeyword(name) and not name.startswith("_") \
+                and not hasattr(Record, name):
+            namespace[name] = property(operator.itemgetter(i))
+    return type("Record", (Record,), namespace)
+
+
+def _rebuild_record(fields, values):
+    return record_class(fields)(values)
+
+
+# (cursor.description, class) of the last statement seen; statements return
+# many rows with the same description object, so the lookup is an identity check
+_last_record_class = (None, Record)
+
+
+def record_factory(cursor, row) -> Record:
+    """sqlite3 row_factory producing ``Record`` rows."""
+    global _last_record_class
+    description, cls = _last_record_class
+    if cursor.description is not description:
+        description = cursor.description
+        cls = record_class(tuple(col[0] for col in description))
+        _last_record_class = (description, cls)
+    return cls(row)
+
 
 class Student:
+    __slots__ = ("id", "name", "roll_no", "department", "contact", "address")
+
     def __init__(self, id: Optional[int], name: str, roll_no: Optional[str] = None,
                  department: Optional[str] = None, contact: Optional[str] = None,
                  address: Optional[str] = None):
@@ -15,6 +101,8 @@ class Student:
         return f"<Student id={self.id} name={self.name} roll_no={self.roll_no}>"
 
 class HostelRoom:
+    __slots__ = ("id", "block", "room_no", "capacity")
+
     def __init__(self, id: Optional[int], block: Optional[str], room_no: Optional[str], capacity: int = 1):
         self.id = id
         self.block = block
@@ -25,6 +113,8 @@ class HostelRoom:
         return f"<Room {self.block}-{self.room_no} cap={self.capacity} id={self.id}>"
 
 class Bus:
+    __slots__ = ("id", "registration", "capacity", "driver_id")
+
     def __init__(self, id: Optional[int], registration: str, capacity: int = 20, driver_id: Optional[int] = None):
         self.id = id
         self.registration = registration
@@ -35,6 +125,8 @@ class Bus:
         return f"<Bus reg={self.registration} cap={self.capacity} id={self.id}>"
 
 class Route:
+    __slots__ = ("id", "name", "pickup_location", "bus_id", "fee")
+
     def __init__(self, id: Optional[int], name: str, pickup_location: str, bus_id: Optional[int] = None, fee: float = 0.0):
         self.id = id
         self.name = name
@@ -1,4 +1,6 @@
-from erp.cli import CLI
+import sys
+
+from erp.cli import main
 
 if __name__ == '__main__':
-    CLI().run()
+    sys.exit(main())
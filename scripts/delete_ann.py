@@ -14,9 +14,10 @@ def main():
             print(f" - id={r['id']} title={r['title']} message={r['message'][:80]}")
         # Delete them
         ids = [str(r['id']) for r in rows]
-        for i in ids:
-            db.execute("DELETE FROM dismissed_announcements WHERE announcement_id=?", (i,))
-            db.execute("DELETE FROM announcements WHERE id=?", (i,))
+        with db.transaction():
+            for i in ids:
+                db.execute("DELETE FROM dismissed_announcements WHERE announcement_id=?", (i,))
+                db.execute("DELETE FROM announcements WHERE id=?", (i,))
         print(f"Deleted announcements with ids: {', '.join(ids)}")
     finally:
         db.close()
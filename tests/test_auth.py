@@ -0,0 +1,117 @@
+import unittest
+
+import binascii
+import hashlib
+import threading
+import time
+from concurrent.futures import CancelledError
+
+from erp.auth import AuthBackend, AuthBusy, hash_password, needs_rehash, verify_password
+from erp.db import Database
+
+
+class TestAuthBackend(unittest.TestCase):
+    def test_inline_hash_and_verify(self):
+        backend = AuthBackend(workers=0)
+        stored = backend.hash("secret")
+        self.assertTrue(backend.verify(stored, "secret"))
+        self.assertFalse(backend.verify(stored, "wrong"))
+        self.assertFalse(verify_password("garbage", "secret"))
+        self.assertEqual(backend.stats()["completed"], 3)
+
+    def test_process_pool_and_queue_limit(self):
+        backend = AuthBackend(workers=1, max_pending=2)
+        self.addCleanup(backend.close)
+        self.assertTrue(backend.verify(hash_password("pw"), "pw"))
+
+        # fill every slot: the next caller is turned away instead of queueing
+        backend._slots.acquire()
+        backend._slots.acquire()
+        try:
+            with self.assertRaises(AuthBusy):
+                backend.verify(hash_password("pw"), "pw")
+        finally:
+            backend._slots.release()
+            backend._slots.release()
+        stats = backend.stats()
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["completed"], 1)
+        self.assertEqual(stats["pending"], 0)
+
+    def test_timed_out_job_keeps_its_slot(self):
+        backend = AuthBackend(workers=1, max_pending=1, timeout=0.01, iterations=3_000_000)
+        self.addCleanup(backend.close)
+        with self.assertRaises(AuthBusy):
+            backend.hash("slow")
+        # the job is still running in the pool, so the slot is still taken
+        with self.assertRaises(AuthBusy) as caught:
+            backend.hash("next")
+        self.assertIn("busy", str(caught.exception))
+        self.assertEqual(backend.stats()["timeouts"], 1)
+        self.assertEqual(backend.stats()["rejected"], 1)
+
+    def test_close_cancels_queued_jobs(self):
+        backend = AuthBackend(workers=1, max_pending=6, iterations=1_000_000)
+        self.addCleanup(backend.close)
+        outcomes = []
+
+        def login():
+            try:
+                outcomes.append(backend.hash("pw"))
+            except CancelledError:
+                outcomes.append(None)
+        callers = [threading.Thread(target=login) for _ in range(6)]
+        for t in callers:
+            t.start()
+        while len(backend._futures) < 6:
+            time.sleep(0.005)
+        backend.close()
+        for t in callers:
+            t.join(30)
+        # one job runs and two wait in the call queue; the rest never started
+        self.assertGreaterEqual(outcomes.count(None), 3)
+        self.assertEqual(backend.stats()["pending"], 0)
+        self.assertEqual(backend._futures, set())
+
+
+class TestHashFormat(unittest.TestCase):
+    def test_self_describing_format(self):
+        stored = hash_password("pw", iterations=1000)
+        algorithm, iterations, salt, digest = stored.split("$")
+        self.assertEqual((algorithm, iterations), ("pbkdf2_sha256", "1000"))
+        self.assertTrue(verify_password(stored, "pw"))
+        self.assertFalse(needs_rehash(stored, 1000))
+        self.assertTrue(needs_rehash(stored, 2000))
+
+    def test_legacy_hash_upgraded_on_login(self):
+        db = Database(":memory:", auth=AuthBackend(iterations=1000))
+        self.addCleanup(db.close)
+        salt = b"0123456789abcdef"
+        legacy = "{}:{}".format(binascii.hexlify(salt).decode(),
+                                binascii.hexlify(hashlib.pbkdf2_hmac("sha256", b"old", salt, 100_000)).decode())
+        self.assertTrue(needs_rehash(legacy))
+        db.execute("INSERT INTO users (username,password,role) VALUES (?,?,?)", ("legacy", legacy, "student"))
+
+        self.assertIsNone(db.verify_user("legacy", "wrong"))
+        self.assertEqual(db.query("SELECT password FROM users WHERE username='legacy'")[0][0], legacy)
+
+        self.assertIsNotNone(db.verify_user("legacy", "old"))
+        upgraded = db.query("SELECT password FROM users WHERE username='legacy'")[0][0]
+        self.assertTrue(upgraded.startswith("pbkdf2_sha256$1000$"))
+        self.assertIsNotNone(db.verify_user("legacy", "old"))
+
+    def test_unknown_user_still_runs_pbkdf2(self):
+        backend = AuthBackend(iterations=1000)
+        db = Database(":memory:", auth=backend)
+        self.addCleanup(db.close)
+        db.create_user("known", "pw", "admin")
+        before = backend.stats()["completed"]
+        self.assertIsNone(db.verify_user("ghost", "pw"))
+        self.assertIsNone(db.verify_user("ghost", "pw"))
+        # one dummy hash made once, then one verify per attempt
+        self.assertEqual(backend.stats()["completed"] - before, 3)
+        self.assertTrue(db._dummy_password_hash().startswith("pbkdf2_sha256$1000$"))
+
+
+if __name__ == '__main__':
+    unittest.main()
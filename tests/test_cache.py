@@ -0,0 +1,32 @@
+import unittest
+
+from erp.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_lru_bound_and_expiry(self):
+        now = [0.0]
+        cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)  # "a" is now most recently used
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+        now[0] = 11.0
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get_or_load("a", lambda: 42), 42)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 3))
+
+    def test_invalidate_where(self):
+        cache = TTLCache(maxsize=10, ttl=None)
+        for key in [("rooms", 1), ("rooms", 2), ("routes",)]:
+            cache.set(key, True)
+        self.assertEqual(cache.invalidate_where(lambda key: key[0] == "rooms"), 2)
+        self.assertEqual(len(cache), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,286 @@
+import binascii
+import hashlib
+import unittest
+import tempfile
+import os
+import sqlite3
+import threading
+from erp.db import Database, SCHEMA_VERSION
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tmpf = tempfile.NamedTemporaryFile(delete=False)
+        self.db_path = self.tmpf.name
+        self.tmpf.close()
+        self.db = Database(self.db_path, pool_size=4)
+
+    def tearDown(self):
+        self.db.close()
+        if os.path.exists(self.db_path):
+            os.unlink(self.db_path)
+
+    def test_threads_use_separate_connections(self):
+        barrier = threading.Barrier(4)
+        seen = []
+        errors = []
+
+        def worker():
+            try:
+                with self.db.pool.connection() as conn:
+                    # all four threads hold a connection at the same time
+                    barrier.wait(timeout=5)
+                    seen.append(id(conn))
+                    self.db.query("SELECT COUNT(1) FROM users")
+            except Exception as e:  # pragma: no cover - surfaced below
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(seen)), 4)
+
+    def test_checkout_is_reentrant_and_bounded(self):
+        with self.db.pool.connection() as outer:
+            with self.db.pool.connection() as inner:
+                self.assertIs(outer, inner)
+            # nested helpers reuse the held connection instead of blocking
+            self.db.execute("INSERT INTO students (name) VALUES (?)", ("Pooled",))
+        self.assertLessEqual(len(self.db.pool._all), 4)
+        rows = self.db.query("SELECT name FROM students")
+        self.assertEqual([r["name"] for r in rows], ["Pooled"])
+
+
+class TestTransactions(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(":memory:")
+
+    def tearDown(self):
+        self.db.close()
+
+    def names(self):
+        return [r["name"] for r in self.db.query("SELECT name FROM students ORDER BY id")]
+
+    def test_outer_failure_rolls_back_everything(self):
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                self.db.execute("INSERT INTO students (name) VALUES (?)", ("A",))
+                self.db.execute("INSERT INTO students (name) VALUES (?)", ("B",))
+                raise RuntimeError("boom")
+        self.assertEqual(self.names(), [])
+        self.assertFalse(self.db.in_transaction())
+
+    def test_nested_block_is_a_savepoint(self):
+        with self.db.transaction():
+            self.db.execute("INSERT INTO students (name) VALUES (?)", ("kept",))
+            try:
+                with self.db.transaction():
+                    self.db.execute("INSERT INTO students (name) VALUES (?)", ("undone",))
+                    raise ValueError("inner")
+            except ValueError:
+                pass
+            with self.db.transaction():
+                self.db.execute("INSERT INTO students (name) VALUES (?)", ("inner kept",))
+        self.assertEqual(self.names(), ["kept", "inner kept"])
+
+
+class TestStorageProfiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "erp.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_writable_profiles_use_wal(self):
+        for profile, synchronous in (("durable", 2), ("fast", 1)):
+            db = Database(self.db_path, profile=profile)
+            try:
+                self.assertEqual(db.query("PRAGMA journal_mode")[0][0], "wal")
+                self.assertEqual(db.query("PRAGMA synchronous")[0][0], synchronous)
+                self.assertEqual(db.query("PRAGMA busy_timeout")[0][0], 5000)
+            finally:
+                db.close()
+
+    def test_readonly_replica_reads_but_rejects_writes(self):
+        writer = Database(self.db_path, profile="fast")
+        replica = Database(self.db_path, profile="readonly-replica")
+        try:
+            writer.execute("INSERT INTO students (name) VALUES (?)", ("Replica",))
+            rows = replica.query("SELECT name FROM students")
+            self.assertEqual([r["name"] for r in rows], ["Replica"])
+            with self.assertRaises(sqlite3.OperationalError):
+                replica.execute("INSERT INTO students (name) VALUES (?)", ("Nope",))
+        finally:
+            replica.close()
+            writer.close()
+
+    def test_readonly_replica_login_skips_rehash(self):
+        writer = Database(self.db_path, profile="fast")
+        replica = Database(self.db_path, profile="readonly-replica")
+        try:
+            salt = b"0123456789abcdef"
+            legacy = "{}:{}".format(binascii.hexlify(salt).decode(),
+                                    binascii.hexlify(hashlib.pbkdf2_hmac("sha256", b"pw", salt, 100_000)).decode())
+            writer.execute("INSERT INTO users (username,password,role) VALUES (?,?,?)", ("legacy", legacy, "admin"))
+            self.assertIsNotNone(replica.verify_user("legacy", "pw"))
+            self.assertEqual(writer.query("SELECT password FROM users WHERE username='legacy'")[0][0], legacy)
+        finally:
+            replica.close()
+            writer.close()
+
+    def test_unknown_profile_rejected(self):
+        with self.assertRaises(ValueError):
+            Database(self.db_path, profile="turbo")
+
+
+class TestIndexes(unittest.TestCase):
+    HOT_QUERIES = {
+        "SELECT COUNT(1) FROM hostel_allocations WHERE room_id=? AND checkout_date IS NULL": "idx_hostel_allocations_room_open",
+        "SELECT r.id, COUNT(a.id) FROM hostel_rooms r LEFT JOIN hostel_allocations a ON r.id=a.room_id AND a.checkout_date IS NULL GROUP BY r.id": "idx_hostel_allocations_room_open",
+        "SELECT r.id, COUNT(ta.id) FROM routes r LEFT JOIN transport_allocations ta ON r.id=ta.route_id AND ta.active=1 GROUP BY r.id": "idx_transport_allocations_route",
+        "SELECT id FROM transport_allocations WHERE student_id=? AND route_id=? AND active=1": "idx_transport_allocations_student",
+        "SELECT * FROM contact_messages WHERE student_id=? ORDER BY created ASC": "idx_contact_messages_student",
+        "SELECT * FROM contact_messages ORDER BY IFNULL(created, '') DESC, id DESC LIMIT 5": "idx_contact_messages_created_key",
+        "SELECT id FROM dismissed_announcements WHERE announcement_id=? AND student_id=?": "idx_dismissed_announcements_unique",
+        "SELECT * FROM hostel_payments WHERE student_id=?": "idx_hostel_payments_student",
+        "SELECT * FROM transport_payments WHERE student_id=?": "idx_transport_payments_student",
+        "SELECT * FROM contact_messages WHERE thread_root_id=? ORDER BY id": "idx_contact_messages_thread",
+        "SELECT * FROM message_threads WHERE student_id=? ORDER BY last_activity DESC": "idx_message_threads_student",
+        "UPDATE contact_messages SET is_read=1 WHERE thread_root_id=? AND is_read=0": "idx_contact_messages_unread",
+        "SELECT id FROM bus_attendance WHERE student_id=? AND route_id=? AND date=?": "idx_bus_attendance_unique",
+        "SELECT * FROM attendance_bitmaps WHERE student_id=? AND month BETWEEN ? AND ?": "idx_attendance_bitmaps_student",
+        "SELECT MIN(start_day) FROM announcements WHERE active=1 AND start_day > ?": "idx_announcements_window",
+    }
+
+    def setUp(self):
+        self.db = Database(":memory:")
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_migration_recorded_in_user_version(self):
+        self.assertEqual(self.db.query("PRAGMA user_version")[0][0], SCHEMA_VERSION)
+
+    def test_legacy_database_is_upgraded_once(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, "legacy.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE drivers (id INTEGER PRIMARY KEY, name TEXT NOT NULL, license_no TEXT)")
+        conn.execute("CREATE TABLE contact_messages (id INTEGER PRIMARY KEY, student_id INTEGER, to_role TEXT, to_id INTEGER, subject TEXT, message TEXT, created TEXT)")
+        conn.commit()
+        conn.close()
+
+        db = Database(path)
+        try:
+            self.assertEqual(db.query("PRAGMA user_version")[0][0], SCHEMA_VERSION)
+            driver_cols = {r[1] for r in db.query("PRAGMA table_info(drivers)")}
+            message_cols = {r[1] for r in db.query("PRAGMA table_info(contact_messages)")}
+            self.assertIn("contact", driver_cols)
+            self.assertTrue({"sender_role", "sender_id", "parent_id", "is_read"} <= message_cols)
+            self.assertEqual(len(db.query("SELECT id FROM users WHERE role='admin'")), 1)
+        finally:
+            db.close()
+        # reopening an up-to-date database must not re-seed or re-migrate
+        db = Database(path)
+        try:
+            self.assertEqual(len(db.query("SELECT id FROM users WHERE role='admin'")), 1)
+        finally:
+            db.close()
+
+    def test_thread_roots_backfilled_from_parent_links(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, "threads.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE contact_messages (id INTEGER PRIMARY KEY, student_id INTEGER, to_role TEXT, to_id INTEGER, subject TEXT, message TEXT, created TEXT, sender_role TEXT, sender_id INTEGER, parent_id INTEGER, is_read INTEGER DEFAULT 0)")
+        # 1 <- 2 <- 3 is one thread; 4 replies to a deleted message; 5 stands alone
+        conn.executemany("INSERT INTO contact_messages (id, student_id, subject, created, parent_id, is_read) VALUES (?,?,?,?,?,?)",
+                         [(1, 7, "a", "2024-01-01", None, 1), (2, 7, "re", "2024-01-02", 1, 0),
+                          (3, 7, "re", "2024-01-03", 2, 0), (4, 7, "b", "2024-01-04", 99, 0),
+                          (5, 8, "c", "2024-01-05", None, 1)])
+        conn.commit()
+        conn.close()
+
+        db = Database(path)
+        try:
+            roots = dict(db.query("SELECT id, thread_root_id FROM contact_messages"))
+            self.assertEqual(roots, {1: 1, 2: 1, 3: 1, 4: 4, 5: 5})
+            threads = {r["id"]: (r["message_count"], r["unread_count"], r["last_activity"])
+                       for r in db.query("SELECT * FROM message_threads")}
+            self.assertEqual(threads, {1: (3, 2, "2024-01-03"), 4: (1, 1, "2024-01-04"), 5: (1, 0, "2024-01-05")})
+        finally:
+            db.close()
+
+    def test_duplicate_dismissals_collapsed_before_unique_index(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, "dismissals.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE dismissed_announcements (id INTEGER PRIMARY KEY, announcement_id INTEGER NOT NULL, student_id INTEGER NOT NULL, dismissed_at TEXT)")
+        conn.executemany("INSERT INTO dismissed_announcements (id, announcement_id, student_id) VALUES (?,?,?)",
+                         [(1, 5, 7), (2, 5, 7), (3, 6, 7), (4, 5, 8), (5, 6, 7)])
+        conn.commit()
+        conn.close()
+
+        db = Database(path)
+        try:
+            self.assertEqual([r[0] for r in db.query("SELECT id FROM dismissed_announcements ORDER BY id")], [1, 3, 4])
+            with self.assertRaises(sqlite3.IntegrityError):
+                db.execute("INSERT INTO dismissed_announcements (announcement_id, student_id) VALUES (5, 7)")
+        finally:
+            db.close()
+
+    def test_duplicate_attendance_keeps_latest_mark(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, "attendance.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE bus_attendance (id INTEGER PRIMARY KEY, student_id INTEGER, route_id INTEGER, date TEXT, present INTEGER DEFAULT 0)")
+        conn.executemany("INSERT INTO bus_attendance (id, student_id, route_id, date, present) VALUES (?,?,?,?,?)",
+                         [(1, 7, 1, "2024-05-01", 1), (2, 7, 1, "2024-05-01", 0), (3, 7, 1, "2024-05-02", 1)])
+        conn.commit()
+        conn.close()
+
+        db = Database(path)
+        try:
+            rows = [tuple(r) for r in db.query("SELECT id, present FROM bus_attendance ORDER BY id")]
+            self.assertEqual(rows, [(2, 0), (3, 1)])
+            bitmaps = [tuple(r) for r in db.query("SELECT month, student_id, present_bits, marked_bits FROM attendance_bitmaps")]
+            self.assertEqual(bitmaps, [("2024-05", 7, 0b10, 0b11)])
+        finally:
+            db.close()
+
+    def test_attendance_dates_normalized_to_days(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, "attendance_days.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE bus_attendance (id INTEGER PRIMARY KEY, student_id INTEGER, route_id INTEGER, date TEXT, present INTEGER DEFAULT 0)")
+        conn.executemany("INSERT INTO bus_attendance (id, student_id, route_id, date, present) VALUES (?,?,?,?,?)",
+                         [(1, 7, 1, "2024-01-31", 1), (2, 7, 1, "2024-02-01", 1), (3, 7, 1, "2024-02-01T08:00", 0)])
+        conn.commit()
+        conn.close()
+
+        db = Database(path)
+        try:
+            rows = [tuple(r) for r in db.query("SELECT id, date, present FROM bus_attendance ORDER BY id")]
+            self.assertEqual(rows, [(1, "2024-01-31", 1), (3, "2024-02-01", 0)])
+            bitmaps = [tuple(r) for r in db.query("SELECT month, present_bits, marked_bits FROM attendance_bitmaps ORDER BY month")]
+            self.assertEqual(bitmaps, [("2024-01", 1 << 30, 1 << 30), ("2024-02", 0, 1)])
+        finally:
+            db.close()
+
+    def test_hot_queries_use_indexes(self):
+        for sql, index in self.HOT_QUERIES.items():
+            params = (1,) * sql.count("?")
+            plan = " | ".join(r[3] for r in self.db.query("EXPLAIN QUERY PLAN " + sql, params))
+            self.assertIn(index, plan, sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from erp.feed import AnnouncementFeed
+
+
+class TestAnnouncementFeed(unittest.TestCase):
+    def setUp(self):
+        self.now = [0.0]
+        self.day = ["2024-05-01"]
+        self.rows = {"2024-05-01": ([{"id": 3}, {"id": 1}], "2024-05-04"),
+                     "2024-05-04": ([{"id": 5}, {"id": 3}, {"id": 1}], None)}
+        self.dismissed = {7: [1]}
+        self.loads = []
+
+        def load_visible(today):
+            self.loads.append(today)
+            return self.rows[today]
+
+        self.feed = AnnouncementFeed(load_visible, lambda sid: self.dismissed.get(sid, []), ttl=60,
+                                     clock=lambda: self.now[0], today=lambda: self.day[0])
+
+    def test_refreshes_at_window_boundary_and_ttl(self):
+        self.assertEqual([a["id"] for a in self.feed.visible()], [3, 1])
+        self.day[0] = "2024-05-03"
+        self.feed.visible()
+        self.assertEqual(self.loads, ["2024-05-01"])
+        self.day[0] = "2024-05-04"
+        self.assertEqual([a["id"] for a in self.feed.visible()], [5, 3, 1])
+        self.now[0] = 61
+        self.feed.visible()
+        self.assertEqual(self.loads, ["2024-05-01", "2024-05-04", "2024-05-04"])
+        self.feed.invalidate()
+        self.feed.visible()
+        self.assertEqual(len(self.loads), 4)
+
+    def test_dismissal_bitsets(self):
+        self.assertEqual([a["id"] for a in self.feed.for_student(7)], [3])
+        self.assertEqual([a["id"] for a in self.feed.for_student(8)], [3, 1])
+        self.feed.dismissed(8, 3)
+        self.assertTrue(self.feed.is_dismissed(8, 3))
+        self.assertEqual([a["id"] for a in self.feed.for_student(8)], [1])
+        # not cached yet: the next load reads the database instead
+        self.feed.dismissed(9, 3)
+        self.assertNotIn(9, self.feed.dismissals._data)
+        self.feed.invalidate(dismissals=True)
+        self.assertEqual(len(self.feed.dismissals), 0)
+
+    def test_load_racing_a_dismissal_is_not_cached(self):
+        def racing_load(student_id):
+            ids = list(self.dismissed.get(student_id, []))
+            # the dismissal commits after this read
+            self.dismissed.setdefault(student_id, []).append(3)
+            self.feed.dismissed(student_id, 3)
+            return ids
+        self.feed._load_dismissed = racing_load
+        self.assertEqual([a["id"] for a in self.feed.for_student(8)], [3, 1])
+        self.assertNotIn(8, self.feed.dismissals._data)
+        self.feed._load_dismissed = lambda sid: self.dismissed.get(sid, [])
+        self.assertEqual([a["id"] for a in self.feed.for_student(8)], [1])
+
+    def test_dismissals_expire_with_the_feed(self):
+        self.feed.for_student(7)
+        self.dismissed[7].append(3)
+        self.now[0] = 61
+        self.assertEqual(self.feed.for_student(7), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
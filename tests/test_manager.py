@@ -1,7 +1,8 @@
 import unittest
 import tempfile
 import os
-from erp.manager import ERPManager
+import threading
+from erp.manager import ERPManager, keyset_cursor
 
 class TestERPManager(unittest.TestCase):
     def setUp(self):
@@ -77,5 +78,529 @@ class TestERPManager(unittest.TestCase):
         self.assertAlmostEqual(profile["total_route_fee"], 100.0)
         self.assertAlmostEqual(profile["total_dues"], 50.0)
 
+    def test_concurrent_allocations_respect_capacity(self):
+        room_id = self.mgr.add_room("B", "201", capacity=1)
+        sids = [self.mgr.add_student(f"S{i}", f"C{i:03d}") for i in range(6)]
+        barrier = threading.Barrier(len(sids))
+        results = []
+
+        def allocate(sid):
+            barrier.wait(timeout=5)
+            try:
+                results.append(self.mgr.allocate_room(sid, room_id))
+            except ValueError as e:
+                results.append(str(e))
+
+        threads = [threading.Thread(target=allocate, args=(sid,)) for sid in sids]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sum(isinstance(r, int) for r in results), 1)
+        self.assertEqual(results.count("Room is full"), len(sids) - 1)
+
+        # checkout frees the bed through the occupants trigger
+        alloc_id = next(r for r in results if isinstance(r, int))
+        self.mgr.checkout_student(alloc_id)
+        room = self.mgr.db.query("SELECT occupants FROM hostel_rooms WHERE id=?", (room_id,))[0]
+        self.assertEqual(room["occupants"], 0)
+        self.assertIsInstance(self.mgr.allocate_room(sids[1], room_id), int)
+        with self.assertRaises(ValueError):
+            self.mgr.allocate_room(sids[2], 9999)
+
+    def test_bulk_import_students(self):
+        import json
+        from erp.importer import read_rows
+        self.mgr.add_student("Existing", "R100")
+        src = self.db_path + ".jsonl"
+        errors = self.db_path + ".errors.csv"
+        self.addCleanup(lambda: [os.unlink(p) for p in (src, errors) if os.path.exists(p)])
+        with open(src, "w") as fh:
+            for row in ({"name": "Dana", "roll_no": "R101", "username": "dana", "password": "pw"},
+                        {"name": "Eli", "roll_no": "R102"},
+                        {"name": "", "roll_no": "R103"},
+                        {"name": "Dup", "roll_no": "R100"}):
+                fh.write(json.dumps(row) + "\n")
+
+        seen = []
+        report = self.mgr.import_students(read_rows(src), chunk_size=2, workers=0, error_file=errors,
+                                          progress=lambda r: seen.append(r.processed))
+        self.assertEqual((report.imported, report.failed), (2, 2))
+        self.assertEqual(seen, [2, 4])
+        self.assertEqual(self.mgr.get_student(report.student_ids[1])["name"], "Eli")
+        user = self.mgr.authenticate_user("dana", "pw", role='student')
+        self.assertEqual(user["student_id"], report.student_ids[0])
+        with open(errors) as fh:
+            self.assertEqual(len(fh.readlines()), 3)
+
+    def test_import_rejects_chunk_that_races_another_writer(self):
+        from erp.importer import import_students
+        errors = self.db_path + ".race.csv"
+        self.addCleanup(lambda: os.path.exists(errors) and os.unlink(errors))
+        real_bulk = self.mgr.bulk_add_students
+        calls = []
+
+        def racing_bulk(students):
+            if not calls:
+                # another writer takes a roll_no after the duplicate checks ran
+                self.mgr.add_student("Racer", "R301")
+            calls.append(len(students))
+            return real_bulk(students)
+        self.mgr.bulk_add_students = racing_bulk
+        rows = [{"name": "Gus", "roll_no": "R300"}, {"name": "Hal", "roll_no": "R301"},
+                {"name": "Ivy", "roll_no": "R302"}]
+        report = import_students(self.mgr, rows, chunk_size=2, workers=0, error_file=errors)
+        self.assertEqual((report.imported, report.failed), (1, 2))
+        self.assertEqual(self.mgr.get_student(report.student_ids[0])["name"], "Ivy")
+        with open(errors) as fh:
+            self.assertEqual(len(fh.readlines()), 3)
+
+    def test_student_identity_cache(self):
+        sid = self.mgr.add_student("Fay", "R200", "ME")
+        self.assertEqual(self.mgr.get_student(sid)["name"], "Fay")
+        self.assertEqual(self.mgr.get_student(sid)["name"], "Fay")
+        self.assertEqual(self.mgr.student_cache.stats()["hits"], 1)
+
+        # the shared cached record is read-only
+        with self.assertRaises(TypeError):
+            self.mgr.get_student(sid)["name"] = "Mutated"
+        self.assertEqual(self.mgr.get_student(sid)["name"], "Fay")
+
+        self.mgr.update_student(sid, department="EE")
+        self.assertEqual(self.mgr.get_student(sid)["department"], "EE")
+        self.mgr.delete_student(sid)
+        self.assertIsNone(self.mgr.get_student(sid))
+
+    def test_profile_single_query_and_invalidation(self):
+        sid = self.mgr.add_student("Gus", "R300")
+        route_id = self.mgr.register_route("Route-9", "Gate", None, fee=120.0)
+        self.mgr.assign_student_to_route(sid, route_id)
+        self.mgr.record_transport_payment(sid, 20.0)
+        first = self.mgr.get_student_profile(sid)
+        self.assertEqual(first["student"]["name"], "Gus")
+        self.assertAlmostEqual(first["total_dues"], 100.0)
+        self.assertEqual(first["transport_allocations"][0]["route_name"], "Route-9")
+
+        # served from cache until a write touches this student
+        self.assertEqual(self.mgr.get_student_profile(sid)["total_dues"], first["total_dues"])
+        self.assertEqual(self.mgr.profile_cache.stats()["hits"], 1)
+        self.mgr.record_transport_payment(sid, 30.0)
+        self.assertAlmostEqual(self.mgr.get_student_profile(sid)["total_dues"], 70.0)
+        self.mgr.update_route(route_id, fee=200.0)
+        self.assertAlmostEqual(self.mgr.get_student_profile(sid)["total_dues"], 150.0)
+        self.assertEqual(self.mgr.get_student_profile(9999), {})
+
+    def test_counters_follow_allocations_and_rebuild(self):
+        sid = self.mgr.add_student("Hal", "R400")
+        room_id = self.mgr.add_room("C", "301", capacity=2)
+        route_id = self.mgr.register_route("Route-4", "Depot", None, fee=10.0)
+        alloc_id = self.mgr.allocate_room(sid, room_id)
+        self.mgr.assign_student_to_route(sid, route_id)
+
+        occ = {r["room_id"]: r["occupants"] for r in self.mgr.hostel_occupancy_report()}
+        self.assertEqual(occ[room_id], 1)
+        vacant = {r["id"]: r["vacant"] for r in self.mgr.vacant_rooms_report()}
+        self.assertEqual(vacant[room_id], 1)
+        riders = {r["id"]: r["riders"] for r in self.mgr.active_routes_report()}
+        self.assertEqual(riders[route_id], 1)
+        self.mgr.db.execute("UPDATE transport_allocations SET active=0 WHERE student_id=?", (sid,))
+        self.mgr.checkout_student(alloc_id)
+        self.assertEqual(self.mgr.check_counters(), [])
+
+        # simulate drift (e.g. rows edited with triggers missing) and repair it
+        self.mgr.db.execute("UPDATE routes SET riders=5 WHERE id=?", (route_id,))
+        problems = self.mgr.check_counters()
+        self.assertEqual([(p["table"], p["id"], p["actual"]) for p in problems], [("routes", route_id, 0)])
+        self.assertEqual(self.mgr.rebuild_counters(), 1)
+        self.assertEqual(self.mgr.check_counters(), [])
+
+    def test_transport_fee_ledger_has_one_row_per_allocation(self):
+        a = self.mgr.add_student("Ida", "R500", "CS")
+        b = self.mgr.add_student("Jon", "R501", "EE")
+        r1 = self.mgr.register_route("North", "Gate 1", None, fee=100.0)
+        r2 = self.mgr.register_route("South", "Gate 2", None, fee=50.0)
+        self.mgr.assign_student_to_route(a, r1)
+        self.mgr.assign_student_to_route(a, r2)
+        self.mgr.assign_student_to_route(b, r2)
+        for _ in range(10):
+            self.mgr.record_transport_payment(a, 12.0)
+
+        ledger = self.mgr.transport_fee_report()
+        self.assertEqual(len(ledger), 3)
+        by_alloc = {(r["student_id"], r["route_id"]): r for r in ledger}
+        # 120 paid: the first route is settled, the remainder goes to the second
+        self.assertAlmostEqual(by_alloc[(a, r1)]["paid"], 100.0)
+        self.assertAlmostEqual(by_alloc[(a, r2)]["outstanding"], 30.0)
+        self.assertAlmostEqual(by_alloc[(b, r2)]["outstanding"], 50.0)
+
+        south = self.mgr.transport_fee_report(route_id=r2, limit=1)
+        self.assertEqual([r["student_id"] for r in south], [a])
+        nxt = self.mgr.transport_fee_report(route_id=r2, after_id=south[-1]["allocation_id"], limit=1)
+        self.assertEqual([r["student_id"] for r in nxt], [b])
+        self.assertEqual([r["student_id"] for r in self.mgr.transport_fee_report(department="EE")], [b])
+
+    def test_keyset_pages_cover_every_row_once(self):
+        for name in ["Mia", "Ann", "Zed", "Bob", "Ann", "Kim", "Lee"]:
+            self.mgr.add_student(name)
+        for sort in ("id", "name", "roll_no"):
+            full = self.mgr.list_students(sort=sort)
+            seen, after = [], None
+            while True:
+                page = self.mgr.list_students(after=after, limit=2, sort=sort)
+                if not page:
+                    break
+                seen.extend(page)
+                after = keyset_cursor("students", sort, page[-1])
+            self.assertEqual([s["id"] for s in seen], [s["id"] for s in full])
+        names = [s["name"] for s in self.mgr.list_students(sort="name")]
+        self.assertEqual(names, sorted(names))
+        with self.assertRaises(ValueError):
+            self.mgr.list_students(sort="contact; DROP TABLE students")
+
+        sid = self.mgr.list_students(limit=1)[0]["id"]
+        for i in range(5):
+            self.mgr.record_contact_message(sid, "admin", None, f"s{i}", "body")
+        first = self.mgr.list_contact_messages(limit=3)
+        rest = self.mgr.list_contact_messages(limit=3, after=keyset_cursor("contact_messages", "created", first[-1]))
+        ids = [m["id"] for m in first + rest]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(len(ids), 5)
+
+    def test_keyset_cursor_survives_deleted_row_and_nulls(self):
+        for name in ["Ann", "Bob", "Cat", "Dan"]:
+            self.mgr.add_student(name)
+        page = self.mgr.list_students(limit=2, sort="name")
+        cursor = keyset_cursor("students", "name", page[-1])
+        self.mgr.delete_student(page[-1]["id"])
+        self.assertEqual([s["name"] for s in self.mgr.list_students(after=cursor, limit=2, sort="name")],
+                         ["Cat", "Dan"])
+
+        sid = page[0]["id"]
+        undated = self.mgr.record_contact_message(sid, "admin", None, "old", "body")
+        self.mgr.db.execute("UPDATE contact_messages SET created=NULL WHERE id=?", (undated,))
+        for i in range(2):
+            self.mgr.record_contact_message(sid, "admin", None, f"n{i}", "body")
+        seen, after = [], None
+        while True:
+            page = self.mgr.list_contact_messages(limit=1, after=after)
+            if not page:
+                break
+            seen.append(page[0]["id"])
+            after = keyset_cursor("contact_messages", "created", page[0])
+        self.assertEqual(sorted(seen), [undated, undated + 1, undated + 2])
+        self.assertEqual(seen[-1], undated)
+
+    def test_iter_methods_stream_same_rows_as_lists(self):
+        for i in range(7):
+            sid = self.mgr.add_student(f"S{i}", f"R9{i}")
+            self.mgr.record_transport_payment(sid, 10.0 + i, date=f"2024-01-0{i + 1}")
+        rid = self.mgr.register_route("East", "Gate 3", None, fee=40.0)
+        self.mgr.assign_student_to_route(sid, rid)
+        self.mgr.mark_bus_attendance(sid, rid, "2024-02-01")
+        self.mgr.mark_bus_attendance(sid, rid, "2024-03-01", present=0)
+
+        self.assertEqual(list(self.mgr.iter_students(sort="name", chunk_size=2)),
+                         self.mgr.list_students(sort="name"))
+        paid = list(self.mgr.iter_payments("transport", date_from="2024-01-03", date_to="2024-01-05", chunk_size=2))
+        self.assertEqual([p["amount"] for p in paid], [12.0, 13.0, 14.0])
+        self.assertEqual(paid[0]["roll_no"], "R92")
+        self.assertEqual(list(self.mgr.iter_payments("hostel")), [])
+        with self.assertRaises(ValueError):
+            list(self.mgr.iter_payments("library"))
+        marks = list(self.mgr.iter_attendance(route_id=rid, date_from="2024-02-15"))
+        self.assertEqual([(m["date"], m["present"]) for m in marks], [("2024-03-01", 0)])
+        self.assertEqual(list(self.mgr.iter_transport_fee_report(chunk_size=1)), self.mgr.transport_fee_report())
+
+        # an abandoned iterator hands its connection back once closed
+        it = self.mgr.iter_students(chunk_size=1)
+        next(it)
+        it.close()
+        with self.mgr.transaction():
+            self.mgr.add_student("After")
+        self.assertEqual(len(self.mgr.list_students()), 8)
+
+    def test_report_cache_hits_and_write_invalidation(self):
+        sid = self.mgr.add_student("Lu", "R700")
+        room = self.mgr.add_room("C", "301", capacity=2)
+        route = self.mgr.register_route("West", "Gate 4", None, fee=20.0)
+        self.assertEqual(self.mgr.hostel_occupancy_report()[0]["occupants"], 0)
+        self.assertEqual(self.mgr.active_routes_report()[0]["riders"], 0)
+        self.mgr.active_routes_report()
+        self.assertEqual(self.mgr.report_cache.stats()["hits"], 1)
+
+        # a room write leaves the route report cached
+        self.mgr.allocate_room(sid, room)
+        self.assertEqual(self.mgr.hostel_occupancy_report()[0]["occupants"], 1)
+        self.assertIsNotNone(self.mgr.report_cache.get(("active_routes",)))
+
+        self.mgr.assign_student_to_route(sid, route)
+        self.assertEqual(self.mgr.active_routes_report()[0]["riders"], 1)
+        self.assertEqual(self.mgr.transport_fee_report(route_id=route)[0]["outstanding"], 20.0)
+        self.mgr.record_transport_payment(sid, 5.0)
+        self.assertEqual(self.mgr.transport_fee_report(route_id=route)[0]["outstanding"], 15.0)
+        self.assertIn("reports", self.mgr.cache_stats())
+
+    def test_add_student_hashes_outside_transaction(self):
+        seen = []
+        real_hash = self.mgr.db._hash_password
+
+        def hash_password(password):
+            seen.append(self.mgr.db.in_transaction())
+            return real_hash(password)
+        self.mgr.db._hash_password = hash_password
+        sid = self.mgr.add_student("Pat", "R704", username="pat", password="pw")
+        self.assertEqual(seen, [False])
+        self.assertEqual(self.mgr.authenticate_user("pat", "pw", role="student")["student_id"], sid)
+
+    def test_report_cache_invalidated_after_commit(self):
+        sid = self.mgr.add_student("Mo", "R701")
+        route = self.mgr.register_route("South", "Gate 5")
+        self.assertEqual(self.mgr.active_routes_report()[0]["riders"], 0)
+        with self.mgr.transaction():
+            self.mgr.assign_student_to_route(sid, route)
+            # another thread still sees the committed state and re-caches it
+            reader = threading.Thread(target=self.mgr.active_routes_report)
+            reader.start()
+            reader.join()
+        self.assertEqual(self.mgr.active_routes_report()[0]["riders"], 1)
+
+        # a rolled back write leaves the cache alone
+        self.mgr.active_routes_report()
+        with self.assertRaises(RuntimeError):
+            with self.mgr.transaction():
+                self.mgr.assign_student_to_route(self.mgr.add_student("Ny", "R702"), route)
+                raise RuntimeError("abort")
+        self.assertIsNotNone(self.mgr.report_cache.get(("active_routes",)))
+        self.assertEqual(self.mgr.active_routes_report()[0]["riders"], 1)
+
+    def test_profile_cache_invalidated_after_commit(self):
+        sid = self.mgr.add_student("Ola", "R703")
+        self.assertEqual(self.mgr.get_student_profile(sid)["total_transport_paid"], 0)
+        with self.mgr.transaction():
+            self.mgr.record_transport_payment(sid, 12.0)
+            reader = threading.Thread(target=self.mgr.get_student_profile, args=(sid,))
+            reader.start()
+            reader.join()
+        self.assertEqual(self.mgr.get_student_profile(sid)["total_transport_paid"], 12.0)
+
+        # a load that overlaps an invalidation is returned but not cached
+        real_load = self.mgr._load_student_profile
+
+        def racing_load(student_id):
+            profile = real_load(student_id)
+            self.mgr.record_transport_payment(sid, 3.0)
+            return profile
+        self.mgr.profile_cache.clear()
+        self.mgr._load_student_profile = racing_load
+        self.assertEqual(self.mgr.get_student_profile(sid)["total_transport_paid"], 12.0)
+        self.mgr._load_student_profile = real_load
+        self.assertEqual(self.mgr.get_student_profile(sid)["total_transport_paid"], 15.0)
+
+    def test_route_update_invalidates_profiles_after_commit(self):
+        sid = self.mgr.add_student("Quin", "R705")
+        rid = self.mgr.register_route("Hill", "Gate 6", fee=100.0)
+        self.mgr.assign_student_to_route(sid, rid)
+        self.assertEqual(self.mgr.get_student_profile(sid)["total_route_fee"], 100.0)
+        with self.mgr.transaction():
+            self.mgr.update_route(rid, fee=300.0)
+            reader = threading.Thread(target=self.mgr.get_student_profile, args=(sid,))
+            reader.start()
+            reader.join()
+        self.assertEqual(self.mgr.get_student_profile(sid)["total_route_fee"], 300.0)
+
+    def test_search_ranks_and_tracks_writes(self):
+        a = self.mgr.add_student("Priya Raman", "CS-101", "Computer Science")
+        b = self.mgr.add_student("Raman Iyer", "EE-202", "Electrical")
+        self.mgr.record_contact_message(a, "admin", None, "Bus late", "The north bus was late again")
+        self.mgr.create_announcement("Exam schedule", "Semester exams start Monday")
+
+        self.assertEqual(sorted(r["id"] for r in self.mgr.search("raman")), [a, b])
+        self.assertEqual([r["id"] for r in self.mgr.search("raman iy")], [b])
+        self.assertEqual([r["id"] for r in self.mgr.search("cs-101")], [a])
+        self.assertEqual(self.mgr.search('"unbalanced AND ('), [])
+        self.assertEqual(self.mgr.search("   "), [])
+        msgs = self.mgr.search("late bus", kind="messages")
+        self.assertEqual(msgs[0]["student_name"], "Priya Raman")
+        self.assertEqual(len(self.mgr.search("exam", kind="announcements")), 1)
+        with self.assertRaises(ValueError):
+            self.mgr.search("x", kind="users")
+
+        # triggers keep the index current
+        self.mgr.update_student(b, name="Ravi Iyer")
+        self.assertEqual([r["id"] for r in self.mgr.search("raman")], [a])
+        self.mgr.delete_student(a)
+        self.assertEqual(self.mgr.search("priya"), [])
+        self.assertEqual(len(self.mgr.search("r", limit=1, offset=1)), 0)
+
+        # the FTS5 lookup is not repeated per search
+        issued = []
+        real_query = self.mgr.db.query
+        self.mgr.db.query = lambda sql, params=(): issued.append(sql) or real_query(sql, params)
+        self.mgr.search("ravi")
+        self.assertFalse([sql for sql in issued if "sqlite_master" in sql])
+
+    def test_threads_are_indexed_on_insert(self):
+        sid = self.mgr.add_student("Mo", "R800")
+        root = self.mgr.record_contact_message(sid, "admin", None, "Refund", "Please refund",
+                                               sender_role="student", sender_id=sid)
+        reply = self.mgr.record_contact_message(sid, "student", sid, "Re: Refund", "Done",
+                                                sender_role="admin", parent_id=root)
+        self.mgr.record_contact_message(sid, "admin", None, "Re: Refund", "Thanks",
+                                        sender_role="student", sender_id=sid, parent_id=reply)
+        other = self.mgr.record_contact_message(sid, "admin", None, "Bus", "Late bus")
+
+        thread = self.mgr.get_thread(reply)
+        self.assertEqual(thread["id"], root)
+        self.assertEqual([m["message"] for m in thread["children"]], ["Done", "Thanks"])
+        self.assertIsNone(self.mgr.get_thread(reply, student_id=sid + 1))
+
+        summaries = {t["id"]: t for t in self.mgr.list_message_threads(sid)}
+        self.assertEqual(set(summaries), {root, other})
+        self.assertEqual((summaries[root]["message_count"], summaries[root]["unread_count"]), (3, 3))
+        self.assertEqual(self.mgr.mark_thread_read(root), 3)
+        self.assertEqual(self.mgr.list_message_threads(sid)[-1]["unread_count"], 0)
+        self.assertEqual(self.mgr.check_counters(), [])
+
+    def test_unread_counters_per_recipient_and_category(self):
+        sid = self.mgr.add_student("Nia", "R900")
+        pay = self.mgr.record_contact_message(sid, "admin", None, "Transport payment received", "Paid 10",
+                                              sender_role="student", sender_id=sid, category="payment")
+        help_ = self.mgr.record_contact_message(sid, "admin", None, "Locker", "Broken",
+                                                sender_role="student", sender_id=sid)
+        self.mgr.record_contact_message(sid, "student", sid, "Re: Locker", "Fixed", sender_role="admin",
+                                        parent_id=help_)
+        self.assertEqual(self.mgr.get_contact_message(help_ + 1)["category"], "reply")
+        with self.assertRaises(ValueError):
+            self.mgr.record_contact_message(sid, "admin", None, "x", "y", category="spam")
+
+        self.assertEqual(self.mgr.unread_count("admin", category="payment"), 1)
+        self.assertEqual(self.mgr.unread_count("admin"), 2)
+        self.assertEqual(self.mgr.unread_count("student", sid), 1)
+
+        # the student reading the thread only clears their own inbox
+        self.assertEqual(self.mgr.mark_thread_read(help_, "student", sid), 1)
+        self.assertEqual(self.mgr.unread_count("student", sid), 0)
+        self.assertEqual(self.mgr.unread_count("admin"), 2)
+        self.assertEqual(self.mgr.list_message_threads(sid)[0]["student_unread"], 0)
+        self.assertEqual(self.mgr.mark_thread_read(pay, "admin"), 1)
+        self.assertEqual(self.mgr.mark_thread_read(pay, "admin"), 0)
+        self.assertEqual(self.mgr.unread_count("admin", category="payment"), 0)
+        self.assertEqual(self.mgr.check_counters(), [])
+
+    def test_visible_announcements_match_sql_listing(self):
+        import datetime
+        today = datetime.date.today()
+        sid = self.mgr.add_student("Omar", "R901")
+        now = self.mgr.create_announcement("Now", "open")
+        later = self.mgr.create_announcement("Later", "soon")
+        self.mgr.update_announcement(later, start_date=(today + datetime.timedelta(days=3)).isoformat() + "T09:00:00")
+        ended = self.mgr.create_announcement("Ended", "gone")
+        self.mgr.update_announcement(ended, end_date=(today - datetime.timedelta(days=1)).isoformat())
+        self.assertEqual(self.mgr.get_announcement(later)["start_day"], (today + datetime.timedelta(days=3)).isoformat())
+
+        visible = self.mgr.visible_announcements(sid)
+        self.assertEqual([a["id"] for a in visible], [now])
+        self.assertEqual([a["id"] for a in visible],
+                         [a["id"] for a in self.mgr.list_announcements(only_active=True, student_id=sid)])
+        _rows, boundary = self.mgr._load_visible_announcements(today.isoformat())
+        self.assertEqual(boundary, (today + datetime.timedelta(days=3)).isoformat())
+
+        # served from memory until a write invalidates the feed
+        reloads = self.mgr.announcement_feed.reloads
+        self.mgr.visible_announcements(sid)
+        self.assertEqual(self.mgr.announcement_feed.reloads, reloads)
+        self.mgr.record_dismissal(sid, now)
+        self.assertEqual(self.mgr.visible_announcements(sid), [])
+        self.assertEqual(len(self.mgr.visible_announcements()), 1)
+        self.mgr.update_announcement(later, start_date=None)
+        self.assertEqual([a["id"] for a in self.mgr.visible_announcements(sid)], [later])
+
+    def test_dismissals_upsert_batch_and_compaction(self):
+        sid = self.mgr.add_student("Pia", "R902")
+        a1 = self.mgr.create_announcement("One", "x")
+        a2 = self.mgr.create_announcement("Two", "y")
+        a3 = self.mgr.create_announcement("Three", "z")
+        first = self.mgr.record_dismissal(sid, a1)
+        self.assertEqual(self.mgr.record_dismissal(sid, a1), first)
+        self.assertEqual(self.mgr.dismiss_many(sid, [a1, a2, a2]), 1)
+        self.assertEqual([a["id"] for a in self.mgr.visible_announcements(sid)], [a3])
+        self.assertEqual(self.mgr.dismiss_all(sid), 1)
+        self.assertEqual(self.mgr.visible_announcements(sid), [])
+        self.assertEqual(self.mgr.db.query("SELECT COUNT(1) FROM dismissed_announcements")[0][0], 3)
+
+        # a2 ended long ago, a3 was deleted; a1 ended recently and is kept
+        self.mgr.update_announcement(a1, end_date="2024-03-20")
+        self.mgr.update_announcement(a2, end_date="2024-01-01")
+        self.mgr.delete_announcement(a3)
+        self.mgr.db.execute("INSERT INTO dismissed_announcements (announcement_id, student_id) VALUES (?, ?)", (a1, 9999))
+        self.assertEqual(self.mgr.compact_dismissals(retain_days=30, today="2024-04-01"), 2)
+        remaining = self.mgr.db.query("SELECT announcement_id, student_id FROM dismissed_announcements")
+        self.assertEqual([tuple(r) for r in remaining], [(a1, sid)])
+
+    def test_attendance_roster_resubmission_overwrites(self):
+        rid = self.mgr.register_route("North", "Gate 1", fee=100)
+        a = self.mgr.add_student("Ravi", "R903")
+        b = self.mgr.add_student("Sara", "R904")
+        c = self.mgr.add_student("Tom", "R905")
+        for sid in (a, b, c):
+            self.mgr.assign_student_to_route(sid, rid)
+        self.mgr.db.execute("UPDATE transport_allocations SET active=0 WHERE student_id=?", (c,))
+
+        roster = self.mgr.attendance_roster(rid, "2024-05-01")
+        self.assertEqual([(r["student_id"], r["present"]) for r in roster], [(a, None), (b, None)])
+        self.assertEqual(self.mgr.record_attendance(rid, "2024-05-01", [(a, True), (b, False)]), 2)
+        self.assertEqual(self.mgr.record_attendance(rid, "2024-05-01", [(a, False), (b, True)]), 2)
+        roster = self.mgr.attendance_roster(rid, "2024-05-01")
+        self.assertEqual([(r["student_id"], r["present"]) for r in roster], [(a, 0), (b, 1)])
+        with self.assertRaises(ValueError):
+            self.mgr.record_attendance(rid, "2024-05-01", [(a, True), (c, True)])
+        self.assertEqual(self.mgr.attendance_roster(rid, "2024-05-01")[0]["present"], 0)
+        first = self.mgr.mark_bus_attendance(a, rid, "2024-05-01")
+        self.assertEqual(self.mgr.mark_bus_attendance(a, rid, "2024-05-01", present=0), first)
+        self.assertEqual(self.mgr.db.query("SELECT COUNT(1) FROM bus_attendance")[0][0], 2)
+
+    def test_attendance_summary_popcounts_bitmaps(self):
+        rid = self.mgr.register_route("West", "Gate 3")
+        a = self.mgr.add_student("Wen", "R906")
+        b = self.mgr.add_student("Xia", "R907")
+        for sid in (a, b):
+            self.mgr.assign_student_to_route(sid, rid)
+        self.mgr.record_attendance(rid, "2024-04-30", [(a, True), (b, True)])
+        self.mgr.record_attendance(rid, "2024-05-01", [(a, True), (b, False)])
+        self.mgr.record_attendance(rid, "2024-05-02", [(a, False), (b, False)])
+        self.mgr.record_attendance(rid, "2024-05-31", [(a, True)])
+        # re-submission flips b to present and a deleted mark drops out
+        self.mgr.record_attendance(rid, "2024-05-02", [(b, True)])
+        self.mgr.db.execute("DELETE FROM bus_attendance WHERE student_id=? AND date='2024-05-31'", (a,))
+
+        summary = self.mgr.attendance_summary(rid, "2024-05-01", "2024-05-31")
+        self.assertEqual((summary["marked"], summary["present"], summary["percent"]), (4, 2, 50.0))
+        per_student = {e["student_id"]: (e["marked"], e["present"]) for e in summary["students"]}
+        self.assertEqual(per_student, {a: (2, 1), b: (2, 1)})
+        self.assertEqual(self.mgr.attendance_summary(rid, "2024-04-01", "2024-05-01", student_id=b)["present"], 1)
+        self.assertIsNone(self.mgr.attendance_summary(rid, "2023-01-01", "2023-12-31")["percent"])
+
+        # timestamps collapse onto the day they fall on
+        self.mgr.mark_bus_attendance(a, rid, "2024-05-01T08:00")
+        self.assertEqual(self.mgr.db.query("SELECT COUNT(1) FROM bus_attendance WHERE student_id=? "
+                                           "AND date LIKE '2024-05-01%'", (a,))[0][0], 1)
+        with self.assertRaises(ValueError):
+            self.mgr.record_attendance(rid, "yesterday", [(a, True)])
+
+        # bitmaps agree with a scan of the raw marks
+        raw = self.mgr.db.query("SELECT COUNT(1), SUM(present) FROM bus_attendance WHERE route_id=?", (rid,))[0]
+        total = self.mgr.attendance_summary(rid, "2024-01-01", "2024-12-31")
+        self.assertEqual((total["marked"], total["present"]), tuple(raw))
+        self.assertEqual(self.mgr.check_counters(), [])
+
+        # drift is reported and repaired
+        self.mgr.db.execute("UPDATE attendance_bitmaps SET marked_bits=0 WHERE student_id=? AND month='2024-05'", (b,))
+        problems = self.mgr.check_counters()
+        self.assertEqual([(p["table"], p["column"], p["id"]) for p in problems],
+                         [("attendance_bitmaps", "marked_bits", f"{rid}/2024-05/{b}")])
+        self.assertEqual(self.mgr.rebuild_counters(), 1)
+        self.assertEqual(self.mgr.check_counters(), [])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,43 @@
+import pickle
+import sqlite3
+import unittest
+
+from erp.models import Record, Student, record_factory
+
+
+class TestRecord(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = record_factory
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_mapping_tuple_and_attribute_access(self):
+        r = self.conn.execute("SELECT 1 AS id, 'Ann' AS name, NULL AS contact").fetchone()
+        self.assertIsInstance(r, Record)
+        self.assertEqual((r["name"], r[0], r.name), ("Ann", 1, "Ann"))
+        self.assertEqual(r.get("missing", "x"), "x")
+        self.assertIn("contact", r)
+        self.assertEqual(dict(r), {"id": 1, "name": "Ann", "contact": None})
+        self.assertEqual(r.keys(), ["id", "name", "contact"])
+        with self.assertRaises(KeyError):
+            r["missing"]
+        with self.assertRaises(TypeError):
+            r["name"] = "Bob"
+        self.assertEqual(pickle.loads(pickle.dumps(r)), r)
+
+    def test_rows_of_one_statement_share_a_class(self):
+        rows = self.conn.execute("SELECT 1 AS a, 2 AS a UNION ALL SELECT 3, 4").fetchall()
+        self.assertIs(type(rows[0]), type(rows[1]))
+        # repeated column names resolve to the first, as with sqlite3.Row
+        self.assertEqual([r["a"] for r in rows], [1, 3])
+
+    def test_models_use_slots(self):
+        s = Student(1, "Ann")
+        with self.assertRaises(AttributeError):
+            s.nickname = "A"
+
+
+if __name__ == "__main__":
+    unittest.main()
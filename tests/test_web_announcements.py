@@ -0,0 +1,51 @@
+import unittest
+
+from web import app as flask_app
+
+from erp.manager import ERPManager
+
+
+class DismissAnnouncementTest(unittest.TestCase):
+    def setUp(self):
+        self.app = flask_app
+        self.app.config["TESTING"] = True
+        self.test_manager = ERPManager(db_path=':memory:')
+
+        import importlib
+        webapp_module = importlib.import_module('web.app')
+        webapp_module.manager = self.test_manager
+
+        self.sid = self.test_manager.add_student("Uma", "R1")
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["user"] = {"username": "uma", "role": "student", "student_id": self.sid}
+
+        self.first = self.test_manager.create_announcement("Bus", "Route 1 is late")
+        self.second = self.test_manager.create_announcement("Mess", "Menu changed")
+
+    def tearDown(self):
+        try:
+            self.test_manager.close()
+        except Exception:
+            pass
+
+    def flashes(self):
+        with self.client.session_transaction() as sess:
+            return [msg for _, msg in sess.pop("_flashes", [])]
+
+    def test_flash_counts_new_dismissals_only(self):
+        self.test_manager.record_dismissal(self.sid, self.second)
+        form = {"announcement_id": [str(self.first), str(self.first), str(self.second)]}
+        resp = self.client.post("/student/announcements/dismiss", data=form)
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.flashes(), ["1 announcements dismissed"])
+
+    def test_malformed_id_is_rejected(self):
+        form = {"announcement_id": [str(self.first), "abc"]}
+        resp = self.client.post("/student/announcements/dismiss", data=form)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.test_manager.db.query("SELECT COUNT(1) FROM dismissed_announcements")[0][0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
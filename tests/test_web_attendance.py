@@ -0,0 +1,68 @@
+import unittest
+
+from web import app as flask_app
+
+from erp.manager import ERPManager
+
+
+class RouteAttendanceTest(unittest.TestCase):
+    def setUp(self):
+        self.app = flask_app
+        self.app.config["TESTING"] = True
+        self.test_manager = ERPManager(db_path=':memory:')
+
+        import importlib
+        webapp_module = importlib.import_module('web.app')
+        webapp_module.manager = self.test_manager
+
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["user"] = {"username": "admin", "role": "admin"}
+
+        self.route = self.test_manager.register_route("East", "Gate 2")
+        self.a = self.test_manager.add_student("Uma", "R1")
+        self.b = self.test_manager.add_student("Vik", "R2")
+        for sid in (self.a, self.b):
+            self.test_manager.assign_student_to_route(sid, self.route)
+
+    def tearDown(self):
+        try:
+            self.test_manager.close()
+        except Exception:
+            pass
+
+    def test_roster_lists_active_riders(self):
+        resp = self.client.get(f"/routes/{self.route}/attendance?date=2024-05-01")
+        self.assertEqual(resp.status_code, 200)
+        body = resp.get_data(as_text=True)
+        self.assertIn("Uma", body)
+        self.assertIn("Vik", body)
+
+    def test_post_writes_whole_roster_once(self):
+        url = f"/routes/{self.route}/attendance"
+        form = {"date": "2024-05-01", "student_id": [str(self.a), str(self.b)], "present": [str(self.a)]}
+        for _ in range(2):
+            resp = self.client.post(url, data=form)
+            self.assertEqual(resp.status_code, 302)
+        marks = {r["student_id"]: r["present"] for r in self.test_manager.attendance_roster(self.route, "2024-05-01")}
+        self.assertEqual(marks, {self.a: 1, self.b: 0})
+        self.assertEqual(self.test_manager.db.query("SELECT COUNT(1) FROM bus_attendance")[0][0], 2)
+
+    def test_post_rejects_non_riders(self):
+        other_route = self.test_manager.register_route("West", "Gate 9")
+        outsider = self.test_manager.add_student("Wes", "R3")
+        self.test_manager.assign_student_to_route(outsider, other_route)
+        url = f"/routes/{self.route}/attendance"
+        for ids in ([str(self.a), str(outsider)], [str(self.a), "abc"]):
+            resp = self.client.post(url, data={"date": "2024-05-01", "student_id": ids, "present": ids})
+            self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.test_manager.db.query("SELECT COUNT(1) FROM bus_attendance")[0][0], 0)
+        self.assertEqual(self.test_manager.db.query("SELECT COUNT(1) FROM attendance_bitmaps")[0][0], 0)
+
+    def test_invalid_date_redirects(self):
+        resp = self.client.get(f"/routes/{self.route}/attendance?date=yesterday")
+        self.assertEqual(resp.status_code, 302)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import csv
+import io
+import unittest
+
+from web import app as flask_app
+
+from erp.manager import ERPManager
+
+
+class ReportExportTest(unittest.TestCase):
+    def setUp(self):
+        self.app = flask_app
+        self.app.config["TESTING"] = True
+        self.test_manager = ERPManager(db_path=':memory:')
+
+        import importlib
+        webapp_module = importlib.import_module('web.app')
+        webapp_module.manager = self.test_manager
+
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["user"] = {"username": "admin", "role": "admin"}
+
+    def tearDown(self):
+        try:
+            self.test_manager.close()
+        except Exception:
+            pass
+
+    def _csv(self, url):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "text/csv")
+        return list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+
+    def test_empty_report_keeps_header(self):
+        resp = self.client.get("/admin/reports/attendance.csv")
+        self.assertEqual(resp.status_code, 200)
+        header = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(header), 1)
+        self.assertIn("student_name", header[0].split(","))
+
+    def test_reports_stream_as_csv(self):
+        a = self.test_manager.add_student("Ann, Jr.", "R1", "CS")
+        b = self.test_manager.add_student("Bob", "R2", "EE")
+        room = self.test_manager.add_room("A", "101", capacity=2)
+        self.test_manager.allocate_room(a, room)
+        route = self.test_manager.register_route("North", "Gate 1", None, fee=30.0)
+        self.test_manager.assign_student_to_route(a, route)
+        self.test_manager.assign_student_to_route(b, route)
+        self.test_manager.record_transport_payment(a, 30.0)
+        self.test_manager.mark_bus_attendance(a, route, "2024-05-01")
+
+        occupancy = self._csv("/admin/reports/occupancy.csv")
+        self.assertEqual(occupancy[0]["occupants"], "1")
+        self.assertEqual(len(self._csv("/admin/reports/vacant-rooms.csv")), 1)
+        riders = self._csv(f"/admin/reports/route-riders.csv?route_id={route}")
+        self.assertEqual([r["student_name"] for r in riders], ["Ann, Jr.", "Bob"])
+        ledger = self._csv("/admin/reports/fee-ledger.csv?department=EE")
+        self.assertEqual([(r["student_name"], r["outstanding"]) for r in ledger], [("Bob", "30.0")])
+        self.assertEqual(len(self._csv("/admin/reports/attendance.csv?from=2024-05-01&to=2024-05-31")), 1)
+        self.assertEqual(self._csv("/admin/reports/attendance.csv?from=2025-01-01"), [])
+
+        self.assertEqual(self.client.get("/admin/reports/passwords.csv").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
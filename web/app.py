@@ -1,11 +1,31 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from erp.manager import ERPManager
+import csv
+import datetime
+import io
+import os
+
+from flask import (Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, g,
+                   abort, stream_with_context)
+from erp.auth import AuthBackend, AuthBusy, DEFAULT_ITERATIONS
+from erp.manager import ERPManager, keyset_cursor
 
 app = Flask(__name__)
 app.secret_key = "dev-secret-key-change-me"
 
+# Password hashing/verification runs in a small process pool so a login rush
+# cannot occupy every request thread; excess logins get AuthBusy.
+# ERP_HASH_ITERATIONS tunes the PBKDF2 cost; users are rehashed on next login.
+auth_backend = AuthBackend(workers=int(os.environ.get("ERP_AUTH_WORKERS", os.cpu_count() or 1)),
+                           max_pending=int(os.environ.get("ERP_AUTH_MAX_PENDING", 64)),
+                           iterations=int(os.environ.get("ERP_HASH_ITERATIONS", DEFAULT_ITERATIONS)))
+
 # Create a single manager instance for this simple demo.
-manager = ERPManager()
+# ERP_STORAGE_PROFILE selects the SQLite tuning (see erp.db.STORAGE_PROFILES).
+manager = ERPManager(profile=os.environ.get("ERP_STORAGE_PROFILE", "durable"), auth=auth_backend)
+
+# rows per page on the admin listings; pages resume from the last id shown
+PAGE_SIZE = 50
+# CSV exports are sent in pieces of roughly this many characters
+CSV_FLUSH_SIZE = 64 * 1024
 
 
 def login_required(roles=None):
@@ -20,6 +40,14 @@ def login_required(roles=None):
             if roles and u.get("role") not in roles:
                 flash("Unauthorized", "danger")
                 return redirect(url_for("login"))
+            # hand student handlers their record from the manager's identity cache
+            g.student = None
+            if u.get("role") == "student" and u.get("student_id"):
+                g.student = manager.get_student(u["student_id"])
+                if g.student is None:
+                    # account removed since login
+                    session.pop("user", None)
+                    return redirect(url_for("login"))
             return f(*args, **kwargs)
 
         return wrapped
@@ -27,6 +55,28 @@ def login_required(roles=None):
     return decorator
 
 
+def _paged(fetch, table, default_sort="id"):
+    """Fetch one keyset page for the current request's ?after=&sort= arguments.
+
+    The cursor is the previous page's last sort values, one ``after`` argument
+    each with the id last (?after=Ann&after=12).
+    """
+    sort = request.args.get("sort") or default_sort
+    after = request.args.getlist("after") or None
+    try:
+        if after is not None:
+            after = tuple(after[:-1]) + (int(after[-1]),)
+        # one extra row tells us whether a next page exists
+        rows = fetch(after=after, limit=PAGE_SIZE + 1, sort=sort)
+    except ValueError:
+        abort(400)
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    pager = {"sort": sort, "after": after,
+             "next_after": list(keyset_cursor(table, sort, rows[-1])) if has_next else None}
+    return rows, pager
+
+
 @app.route("/")
 def index():
     return redirect(url_for("login"))
@@ -38,7 +88,11 @@ def login():
         username = request.form.get("username")
         password = request.form.get("password")
         role = request.form.get("role")
-        user = manager.authenticate_user(username, password, role=role)
+        try:
+            user = manager.authenticate_user(username, password, role=role)
+        except AuthBusy as e:
+            flash(str(e), "danger")
+            return render_template("login.html"), 503
         if not user:
             flash("Invalid credentials", "danger")
             return render_template("login.html")
@@ -58,10 +112,9 @@ def logout():
 def dashboard():
     user = session.get("user")
     if user.get("role") == "admin":
-        # count unread payment notifications for admin (subjects contain 'payment')
+        # unread payment notifications: one lookup in the trigger-maintained counters
         try:
-            row = manager.db.query("SELECT COUNT(1) as c FROM contact_messages WHERE to_role='admin' AND is_read=0 AND subject LIKE '%payment%'")
-            unread_payments = row[0]["c"] if row else 0
+            unread_payments = manager.unread_count('admin', category='payment')
         except Exception:
             unread_payments = 0
         return render_template("admin_dashboard.html", user=user, unread_payments=unread_payments)
@@ -74,18 +127,92 @@ def dashboard():
     drivers = manager.list_drivers()
     # fetch admin announcements (global notifications for students)
     try:
-        # pass student_id so announcements the student dismissed are excluded
-        announcements = manager.list_announcements(only_active=True, student_id=student_id)
+        # served from the in-memory feed; excludes announcements the student dismissed
+        announcements = manager.visible_announcements(student_id)
     except Exception:
         announcements = []
     return render_template("student_dashboard.html", profile=profile, routes=routes, drivers=drivers, announcements=announcements)
 
 
+@app.route("/admin/auth/stats")
+@login_required(roles=["admin"])
+def auth_stats():
+    # hashing pool metrics: queue depth, rejections, average cost
+    return jsonify(manager.db.auth.stats())
+
+
+@app.route("/admin/cache/stats")
+@login_required(roles=["admin"])
+def cache_stats():
+    # hit/miss counters of this worker's student, profile and report caches
+    return jsonify(manager.cache_stats())
+
+
+# /admin/reports/<name>.csv: each entry streams rows from a manager iterator
+REPORT_EXPORTS = {
+    "occupancy": lambda args: manager.iter_occupancy_report(),
+    "vacant-rooms": lambda args: manager.iter_vacant_rooms(),
+    "route-riders": lambda args: manager.iter_route_riders(route_id=args.get("route_id", type=int),
+                                                           active_only=args.get("all") is None),
+    "fee-ledger": lambda args: manager.iter_transport_fee_report(route_id=args.get("route_id", type=int),
+                                                                 department=args.get("department") or None),
+    "attendance": lambda args: manager.iter_attendance(route_id=args.get("route_id", type=int),
+                                                       date_from=args.get("from") or None,
+                                                       date_to=args.get("to") or None),
+}
+
+
+def _csv_chunks(rows):
+    """Encode a RowStream as CSV text; the header comes from the cursor, so
+    an empty report still downloads with its columns."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    first = next(rows, None)
+    writer.writerow(rows.columns)
+    if first is not None:
+        writer.writerow(first)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= CSV_FLUSH_SIZE:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+@app.route("/admin/reports/<name>.csv")
+@login_required(roles=["admin"])
+def export_report(name):
+    loader = REPORT_EXPORTS.get(name)
+    if loader is None:
+        abort(404)
+    # rows are read from the cursor while the response is being sent
+    return Response(stream_with_context(_csv_chunks(loader(request.args))), mimetype="text/csv",
+                    headers={"Content-Disposition": f'attachment; filename="{name}.csv"'})
+
+
+@app.route("/admin/search")
+@login_required(roles=["admin"])
+def admin_search():
+    q = (request.args.get("q") or "").strip()
+    kind = request.args.get("kind") or "students"
+    offset = max(0, request.args.get("offset", 0, type=int))
+    try:
+        # one extra row tells us whether a next page exists
+        results = manager.search(q, kind=kind, limit=PAGE_SIZE + 1, offset=offset)
+    except ValueError:
+        abort(400)
+    has_next = len(results) > PAGE_SIZE
+    return render_template("search.html", q=q, kind=kind, results=results[:PAGE_SIZE], offset=offset,
+                           next_offset=offset + PAGE_SIZE if has_next else None, page_size=PAGE_SIZE)
+
+
 @app.route("/students")
 @login_required(roles=["admin"])
 def students():
-    students = manager.list_students()
-    return render_template("students.html", students=students)
+    students, pager = _paged(manager.list_students, "students")
+    return render_template("students.html", students=students, pager=pager)
 
 
 @app.route("/students/<int:student_id>")
@@ -210,13 +337,34 @@ def delete_announcement(aid):
 def dismiss_announcement():
     user = session.get('user')
     student_id = user.get('student_id')
-    ann_id = request.form.get('announcement_id')
-    if not ann_id:
+    ann_ids = request.form.getlist('announcement_id')
+    if not ann_ids:
         flash('Missing announcement id', 'danger')
         return redirect(url_for('dashboard'))
     try:
-        manager.record_dismissal(student_id, int(ann_id))
-        flash('Announcement dismissed', 'success')
+        ann_ids = [int(a) for a in ann_ids]
+    except ValueError:
+        abort(400)
+    try:
+        if len(ann_ids) == 1:
+            manager.record_dismissal(student_id, ann_ids[0])
+            flash('Announcement dismissed', 'success')
+        else:
+            # duplicates and already-dismissed ids are not counted
+            count = manager.dismiss_many(student_id, ann_ids)
+            flash(f'{count} announcements dismissed' if count else 'No announcements to dismiss', 'success')
+    except Exception as e:
+        flash(str(e), 'danger')
+    return redirect(url_for('dashboard'))
+
+
+@app.route('/student/announcements/dismiss-all', methods=['POST'])
+@login_required(roles=['student'])
+def dismiss_all_announcements():
+    student_id = session.get('user').get('student_id')
+    try:
+        count = manager.dismiss_all(student_id)
+        flash(f'{count} announcements dismissed' if count else 'No announcements to dismiss', 'success')
     except Exception as e:
         flash(str(e), 'danger')
     return redirect(url_for('dashboard'))
@@ -254,6 +402,7 @@ def student_notification_detail(aid):
     if not ann:
         flash('Notification not found', 'danger')
         return redirect(url_for('student_notifications'))
+    ann = dict(ann)  # records are read-only; add the per-student flag to a copy
     # mark whether this student previously dismissed this announcement
     user = session.get('user')
     student_id = user.get('student_id')
@@ -321,58 +470,45 @@ def assign_transport(student_id):
     driver_contact = request.form.get("driver_contact")
     pickup_location = request.form.get("pickup_location")
 
-    # If driver_id not provided but driver_name is, create driver (and add contact column if missing)
+    # All writes below commit together: a rejected assignment leaves no
+    # half-created driver or re-pointed route behind.
     try:
-        # ensure drivers table has 'contact' column (safe to ignore if already exists)
-        cols = [r[1] for r in manager.db.query("PRAGMA table_info(drivers)")]
-        if 'contact' not in cols:
-            manager.db.execute("ALTER TABLE drivers ADD COLUMN contact TEXT")
-    except Exception:
-        # ignore migration errors
-        pass
-
-    try:
-        if not driver_id and driver_name:
-            # register_driver accepts (name, license_no) - we will leave license empty and store contact after
-            did = manager.register_driver(driver_name, None)
-            driver_id = did
-            if driver_contact:
-                manager.db.execute("UPDATE drivers SET contact=? WHERE id=?", (driver_contact, driver_id))
-        elif driver_id and driver_contact:
-            # update contact if provided
-            try:
+        with manager.transaction():
+            # If driver_id not provided but driver_name is, create driver
+            if not driver_id and driver_name:
+                # leave license empty; contact is optional
+                driver_id = manager.register_driver(driver_name, None, driver_contact)
+            elif driver_id and driver_contact:
+                # update contact if provided
                 manager.db.execute("UPDATE drivers SET contact=? WHERE id=?", (driver_contact, driver_id))
-            except Exception:
-                pass
-
-        # validate bus/route compatibility: if route already has a bus assigned, it must match selected bus
-        route_rows = manager.db.query("SELECT * FROM routes WHERE id=?", (route_id,))
-        if not route_rows:
-            raise ValueError("Route not found")
-        route_row = route_rows[0]
-        existing_bus_for_route = route_row["bus_id"]
-
-        if existing_bus_for_route and bus_id and int(existing_bus_for_route) != int(bus_id):
-            # incompatible: route expects a different bus
-            flash("Selected bus is not assigned to this route. Either select the route's bus or update the route bus first.", "danger")
-            return redirect(url_for('student_detail', student_id=student_id))
 
-        # attach driver to bus if provided
-        if bus_id and driver_id:
-            manager.db.execute("UPDATE buses SET driver_id=? WHERE id=?", (driver_id, bus_id))
-
-        # update route bus/pickup if route had no bus or pickup_location provided
-        if pickup_location or (bus_id and not existing_bus_for_route):
-            # set provided values only
-            if pickup_location and bus_id and not existing_bus_for_route:
-                manager.db.execute("UPDATE routes SET bus_id=?, pickup_location=? WHERE id=?", (bus_id, pickup_location, route_id))
-            elif pickup_location:
-                manager.db.execute("UPDATE routes SET pickup_location=? WHERE id=?", (pickup_location, route_id))
-            elif bus_id and not existing_bus_for_route:
-                manager.db.execute("UPDATE routes SET bus_id=? WHERE id=?", (bus_id, route_id))
-
-        # finally assign student to route (will enforce duplicate prevention)
-        aid = manager.assign_student_to_route(student_id, route_id)
+            # validate bus/route compatibility: if route already has a bus assigned, it must match selected bus
+            route_rows = manager.db.query("SELECT * FROM routes WHERE id=?", (route_id,))
+            if not route_rows:
+                raise ValueError("Route not found")
+            route_row = route_rows[0]
+            existing_bus_for_route = route_row["bus_id"]
+
+            if existing_bus_for_route and bus_id and int(existing_bus_for_route) != int(bus_id):
+                # incompatible: route expects a different bus
+                raise ValueError("Selected bus is not assigned to this route. Either select the route's bus or update the route bus first.")
+
+            # attach driver to bus if provided
+            if bus_id and driver_id:
+                manager.db.execute("UPDATE buses SET driver_id=? WHERE id=?", (driver_id, bus_id))
+
+            # update route bus/pickup if route had no bus or pickup_location provided
+            if pickup_location or (bus_id and not existing_bus_for_route):
+                # set provided values only
+                if pickup_location and bus_id and not existing_bus_for_route:
+                    manager.update_route(route_id, bus_id=bus_id, pickup_location=pickup_location)
+                elif pickup_location:
+                    manager.update_route(route_id, pickup_location=pickup_location)
+                elif bus_id and not existing_bus_for_route:
+                    manager.update_route(route_id, bus_id=bus_id)
+
+            # finally assign student to route (will enforce duplicate prevention)
+            aid = manager.assign_student_to_route(student_id, route_id)
 
         # build confirmation summary
         bus_info = None
@@ -386,12 +522,12 @@ def assign_transport(student_id):
             if drows:
                 driver_info = drows[0]
 
-        parts = [f"alloc id {aid}", f"route: {route_row['name']}" if route_row.get('name') else f"route id {route_id}"]
+        parts = [f"alloc id {aid}", f"route: {route_row['name']}" if route_row['name'] else f"route id {route_id}"]
         if bus_info:
             parts.append(f"bus: {bus_info['registration']}")
         if driver_info:
-            dn = driver_info.get('name')
-            dc = driver_info.get('contact') if 'contact' in driver_info.keys() else None
+            dn = driver_info['name']
+            dc = driver_info['contact']
             if dc:
                 parts.append(f"driver: {dn} ({dc})")
             else:
@@ -443,15 +579,15 @@ def add_student():
 @app.route("/rooms")
 @login_required(roles=["admin"])
 def rooms():
-    rooms = manager.list_rooms()
-    return render_template("rooms.html", rooms=rooms)
+    rooms, pager = _paged(manager.list_rooms, "hostel_rooms")
+    return render_template("rooms.html", rooms=rooms, pager=pager)
 
 
 @app.route("/drivers")
 @login_required(roles=["admin"])
 def drivers():
-    drivers = manager.list_drivers()
-    return render_template("drivers.html", drivers=drivers)
+    drivers, pager = _paged(manager.list_drivers, "drivers")
+    return render_template("drivers.html", drivers=drivers, pager=pager)
 
 
 @app.route("/drivers/add", methods=["GET", "POST"])
@@ -462,17 +598,7 @@ def add_driver():
         lic = request.form.get("license_no")
         contact = request.form.get("contact")
         try:
-            # ensure drivers table has contact column
-            try:
-                cols = [r[1] for r in manager.db.query("PRAGMA table_info(drivers)")]
-                if 'contact' not in cols:
-                    manager.db.execute("ALTER TABLE drivers ADD COLUMN contact TEXT")
-            except Exception:
-                pass
-
-            did = manager.register_driver(name, lic)
-            if contact:
-                manager.db.execute("UPDATE drivers SET contact=? WHERE id=?", (contact, did))
+            did = manager.register_driver(name, lic, contact)
             flash(f"Added driver id {did}", "success")
             return redirect(url_for("drivers"))
         except ValueError as e:
@@ -489,14 +615,7 @@ def edit_driver(driver_id):
         license_no = request.form.get("license_no")
         contact = request.form.get("contact")
         try:
-            manager.update_driver(driver_id, name=name, license_no=license_no)
-            # store/update contact column if present
-            try:
-                cols = [r[1] for r in manager.db.query("PRAGMA table_info(drivers)")]
-                if 'contact' in cols:
-                    manager.db.execute("UPDATE drivers SET contact=? WHERE id=?", (contact, driver_id))
-            except Exception:
-                pass
+            manager.update_driver(driver_id, name=name, license_no=license_no, contact=contact)
             flash("Driver updated", "success")
             return redirect(url_for("drivers"))
         except ValueError as e:
@@ -504,8 +623,7 @@ def edit_driver(driver_id):
             driver = {"id": driver_id, "name": name, "license_no": license_no, "contact": contact}
             return render_template("edit_driver.html", driver=driver)
     # GET
-    drivers = manager.list_drivers()
-    driver = next((d for d in drivers if d['id'] == driver_id), None)
+    driver = manager.get_driver(driver_id)
     if not driver:
         flash("Driver not found", "danger")
         return redirect(url_for('drivers'))
@@ -523,8 +641,8 @@ def delete_driver(driver_id):
 @app.route("/buses")
 @login_required(roles=["admin"])
 def buses():
-    buses = manager.list_buses()
-    return render_template("buses.html", buses=buses)
+    buses, pager = _paged(manager.list_buses, "buses")
+    return render_template("buses.html", buses=buses, pager=pager)
 
 
 @app.route("/buses/add", methods=["GET", "POST"])
@@ -564,8 +682,7 @@ def edit_bus(bus_id):
             drivers = manager.list_drivers()
             bus = {"id": bus_id, "registration": registration, "capacity": capacity, "driver_id": driver_id}
             return render_template("edit_bus.html", bus=bus, drivers=drivers)
-    buses = manager.list_buses()
-    bus = next((b for b in buses if b['id'] == bus_id), None)
+    bus = manager.get_bus(bus_id)
     if not bus:
         flash("Bus not found", "danger")
         return redirect(url_for('buses'))
@@ -610,70 +727,41 @@ def transport_index():
 @app.route('/admin/messages')
 @login_required(roles=["admin"])
 def admin_messages():
-    messages = manager.list_contact_messages()
-    return render_template('messages.html', messages=messages)
+    messages, pager = _paged(manager.list_contact_messages, "contact_messages", default_sort="created")
+    return render_template('messages.html', messages=messages, pager=pager)
 
 
 @app.route('/admin/messages/<int:msg_id>', methods=['GET', 'POST'])
 @login_required(roles=["admin"])
 def admin_message_detail(msg_id):
-    msg = manager.get_contact_message(msg_id)
-    if not msg:
+    # the whole thread comes from one indexed query on thread_root_id
+    root = manager.get_thread(msg_id)
+    if not root:
         flash('Message not found', 'danger')
         return redirect(url_for('admin_messages'))
 
-    # Build thread for this student's messages and extract subtree rooted at this message
-    all_rows = manager.db.query("SELECT * FROM contact_messages WHERE student_id=? ORDER BY created ASC", (msg['student_id'],))
-    msgs = [dict(r) for r in all_rows]
-    id_map = {m['id']: m for m in msgs}
-    for m in msgs:
-        m.setdefault('children', [])
-    roots = []
-    for m in msgs:
-        pid = m.get('parent_id')
-        if pid:
-            parent = id_map.get(pid)
-            if parent:
-                parent['children'].append(m)
-            else:
-                roots.append(m)
-        else:
-            roots.append(m)
-
-    # find subtree for this msg_id (if msg is a child, find its root)
-    def find_root(mid):
-        cur = id_map.get(mid)
-        while cur and cur.get('parent_id'):
-            cur = id_map.get(cur.get('parent_id'))
-        return cur
-
-    root = find_root(msg_id)
-    subtree = root if root else msg
-
-    # mark root and its direct descendants as read (best-effort)
     try:
-        manager.db.execute('UPDATE contact_messages SET is_read=1 WHERE id=? OR parent_id=?', (subtree['id'], subtree['id']))
+        manager.mark_thread_read(root['id'], 'admin')
     except Exception:
         pass
 
     if request.method == 'POST':
         # send reply to student: create a message record targeted at student
-        subject = request.form.get('subject') or f"Re: {msg.get('subject','') }"
+        subject = request.form.get('subject') or f"Re: {root.get('subject') or ''}"
         message = request.form.get('message') or ''
         if not message.strip():
             flash('Reply cannot be empty', 'danger')
-            return render_template('message_detail.html', root=subtree)
+            return render_template('message_detail.html', root=root)
         try:
-            # record reply: associate with root of thread
-            mid = manager.record_contact_message(msg['student_id'], 'student', msg['student_id'], subject, message,
-                                                 sender_role='admin', sender_id=None, parent_id=subtree['id'])
+            mid = manager.record_contact_message(root['student_id'], 'student', root['student_id'], subject, message,
+                                                 sender_role='admin', sender_id=None, parent_id=root['id'])
             flash(f'Reply sent (id {mid})', 'success')
         except Exception as e:
             flash(str(e), 'danger')
 
         return redirect(url_for('admin_messages'))
 
-    return render_template('message_detail.html', root=subtree)
+    return render_template('message_detail.html', root=root)
 
 
 @app.route('/student/messages')
@@ -685,8 +773,8 @@ def student_messages():
         flash('Student identity missing', 'danger')
         return redirect(url_for('dashboard'))
 
-    roots = _build_threads_for_student(student_id)
-    return render_template('student_messages.html', threads=roots)
+    threads = manager.list_message_threads(student_id)
+    return render_template('student_messages.html', threads=threads)
 
 
 @app.route('/student/messages/<int:msg_id>', methods=['GET', 'POST'])
@@ -698,30 +786,14 @@ def student_message_detail(msg_id):
         flash('Student identity missing', 'danger')
         return redirect(url_for('dashboard'))
 
-    # load all messages for this student and build tree
-    all_rows = manager.db.query("SELECT * FROM contact_messages WHERE student_id=? ORDER BY created ASC", (student_id,))
-    msgs = [dict(r) for r in all_rows]
-    id_map = {m['id']: m for m in msgs}
-    for m in msgs:
-        m.setdefault('children', [])
-    for m in msgs:
-        pid = m.get('parent_id')
-        if pid and pid in id_map:
-            id_map[pid]['children'].append(m)
-
-    target = id_map.get(msg_id)
-    if not target:
+    root = manager.get_thread(msg_id, student_id=student_id)
+    if not root:
         flash('Message not found', 'danger')
         return redirect(url_for('student_messages'))
 
-    # find root of this thread
-    root = target
-    while root.get('parent_id'):
-        root = id_map.get(root['parent_id'], root)
-
-    # mark as read for student view as well
+    # mark the replies addressed to this student as read
     try:
-        manager.db.execute('UPDATE contact_messages SET is_read=1 WHERE id=? OR parent_id=?', (root['id'], root['id']))
+        manager.mark_thread_read(root['id'], 'student', student_id)
     except Exception:
         pass
 
@@ -742,24 +814,6 @@ def student_message_detail(msg_id):
     return render_template('student_message_detail.html', root=root)
 
 
-def _build_threads_for_student(student_id):
-    rows = manager.db.query("SELECT * FROM contact_messages WHERE student_id=? ORDER BY created ASC", (student_id,))
-    msgs = [dict(r) for r in rows]
-    id_map = {m['id']: m for m in msgs}
-    for m in msgs:
-        m.setdefault('children', [])
-    roots = []
-    for m in msgs:
-        pid = m.get('parent_id')
-        if pid and pid in id_map:
-            id_map[pid]['children'].append(m)
-        else:
-            roots.append(m)
-    # newest first
-    roots.sort(key=lambda x: x.get('created') or '', reverse=True)
-    return roots
-
-
 @app.route("/routes/add", methods=["GET", "POST"])
 @login_required(roles=["admin"])
 def add_route():
@@ -779,8 +833,7 @@ def add_route():
 @login_required(roles=["admin"])
 def edit_route(route_id):
     # GET: render form with current route, buses; POST: update bus_id and pickup_location
-    routes = manager.active_routes_report()
-    route = next((r for r in routes if r['id'] == route_id), None)
+    route = manager.get_route(route_id)
     if not route:
         flash('Route not found', 'danger')
         return redirect(url_for('routes_list'))
@@ -790,12 +843,10 @@ def edit_route(route_id):
         pickup = request.form.get('pickup_location')
         bus_id = int(bus_id_raw) if bus_id_raw else None
         try:
-            if bus_id:
-                manager.db.execute('UPDATE routes SET bus_id=? WHERE id=?', (bus_id, route_id))
-            else:
-                manager.db.execute('UPDATE routes SET bus_id=NULL WHERE id=?', (route_id,))
+            fields = {'bus_id': bus_id}
             if pickup is not None:
-                manager.db.execute('UPDATE routes SET pickup_location=? WHERE id=?', (pickup, route_id))
+                fields['pickup_location'] = pickup
+            manager.update_route(route_id, **fields)
             flash('Route updated', 'success')
             return redirect(url_for('routes_list'))
         except Exception as e:
@@ -805,6 +856,42 @@ def edit_route(route_id):
     return render_template('edit_route.html', route=route, buses=buses)
 
 
+@app.route('/routes/<int:route_id>/attendance', methods=['GET', 'POST'])
+@login_required(roles=["admin"])
+def route_attendance(route_id):
+    # GET: active riders with their marks for ?date=; POST: the whole roster at once
+    route = manager.get_route(route_id)
+    if not route:
+        flash('Route not found', 'danger')
+        return redirect(url_for('routes_list'))
+    day = request.values.get('date') or datetime.date.today().isoformat()
+    try:
+        day = datetime.date.fromisoformat(day).isoformat()
+    except ValueError:
+        flash('Invalid date', 'danger')
+        return redirect(url_for('route_attendance', route_id=route_id))
+
+    if request.method == 'POST':
+        try:
+            roster = [int(sid) for sid in request.form.getlist('student_id')]
+            present = {int(sid) for sid in request.form.getlist('present')}
+        except ValueError:
+            abort(400)
+        # only the route's active riders may be marked
+        riders = {r['student_id'] for r in manager.attendance_roster(route_id, day)}
+        if not set(roster) <= riders or not present <= set(roster):
+            abort(400)
+        try:
+            count = manager.record_attendance(route_id, day, [(sid, sid in present) for sid in roster])
+            flash(f'Attendance saved for {count} riders ({len(present)} present)', 'success')
+            return redirect(url_for('route_attendance', route_id=route_id, date=day))
+        except Exception as e:
+            flash(str(e), 'danger')
+
+    riders = manager.attendance_roster(route_id, day)
+    return render_template('route_attendance.html', route=route, riders=riders, date=day)
+
+
 @app.route("/transport/enroll", methods=["POST"])
 @login_required(roles=["student"])
 def transport_enroll():
@@ -840,12 +927,13 @@ def transport_pay():
         prow = manager.db.query('SELECT * FROM transport_payments WHERE id=?', (pid,))
         if prow:
             p = dict(prow[0])
-            student = manager.get_student(student_id) or {}
+            student = g.student or {}
             sname = student.get('name') or f'#{student_id}'
             subject = f"Transport payment received from {sname}"
             message = f"Student {sname} (id {student_id}) paid {p.get('amount')} on {p.get('date')}. Receipt: {p.get('receipt_no') or ''}"
             try:
-                manager.record_contact_message(student_id, 'admin', None, subject, message, sender_role='student', sender_id=student_id)
+                manager.record_contact_message(student_id, 'admin', None, subject, message, sender_role='student',
+                                               sender_id=student_id, category='payment')
             except Exception:
                 pass
         flash("Payment recorded", "success")
@@ -926,12 +1014,13 @@ def hostel_pay():
         hrow = manager.db.query('SELECT * FROM hostel_payments WHERE id=?', (pid,))
         if hrow:
             h = dict(hrow[0])
-            student = manager.get_student(student_id) or {}
+            student = g.student or {}
             sname = student.get('name') or f'#{student_id}'
             subject = f"Hostel payment received from {sname}"
             message = f"Student {sname} (id {student_id}) paid {h.get('amount')} on {h.get('date')}. Receipt: {h.get('receipt_no') or ''}"
             try:
-                manager.record_contact_message(student_id, 'admin', None, subject, message, sender_role='student', sender_id=student_id)
+                manager.record_contact_message(student_id, 'admin', None, subject, message, sender_role='student',
+                                               sender_id=student_id, category='payment')
             except Exception:
                 pass
         flash('Hostel payment recorded', 'success')